@@ -35,11 +35,40 @@
 
 // Serial communication variables
 SoftwareSerial piSerial(RX_PIN, TX_PIN);  // RX, TX
-String inputBuffer = "";
+String inputBuffer = "";     // Command line from piSerial
+String usbInputBuffer = "";  // Command line from the USB port
 boolean stringComplete = false;
 unsigned long lastSerialCheck = 0;
 const unsigned long serialCheckInterval = 50;  // Check serial more frequently
 
+// Binary framed protocol (see protocol.py in the bridge), enabled on the port
+// the bridge sends PROTO:BIN1 on; the other port stays ASCII. A bridge that
+// restarts sends PROTO:BIN1 again as text, which is recognised in binary mode too.
+// Frame: A5 5A | length | type | seq | payload | CRC-16 LE
+#define NEGOTIATE_COMMAND "PROTO:BIN1"
+#define FRAME_SYNC1 0xA5
+#define FRAME_SYNC2 0x5A
+#define FRAME_MAX_PAYLOAD 64
+#define FRAME_SENSORS 0x10
+#define FRAME_STATUS 0x11
+#define FRAME_REQUEST 0x12
+#define FRAME_TEXT 0x13
+#define FRAME_COMMAND 0x20
+#define FRAME_ACK 0x21
+#define ACK_OK 0
+#define SENSOR_ID_DIST 1
+#define SENSOR_ID_LIGHT 2
+Stream *binaryPort = NULL;   // The port that negotiated frames; NULL while both speak ASCII
+uint8_t txSeq = 0;           // Sequence number of our last frame
+uint8_t lastCommandSeq = 0;  // Last command frame executed, to ignore retransmissions
+// Receive state machine
+enum RxState { RX_SYNC1, RX_SYNC2, RX_HEADER, RX_PAYLOAD, RX_CRC };
+RxState rxState = RX_SYNC1;
+uint8_t rxHeader[3];  // length, type, seq
+uint8_t rxPayload[FRAME_MAX_PAYLOAD];
+uint8_t rxCount = 0;
+uint16_t rxCrc = 0;
+
 // Motor control variables
 String driveMotorState = "stop";  // forward, backward, stop
 String steeringState = "center";  // left, center, right
@@ -47,6 +76,7 @@ String headlightsState = "off";   // on, off
 String lcdMessage = "Hello Drone!";
 unsigned long lastCommandCheck = 0;
 const unsigned long commandCheckInterval = 2000;  // Send sensor data every 2 seconds
+const unsigned long binarySensorInterval = 250;  // Frames are small enough to send 4 times a second
 unsigned long lastSafetyCheck = 0;
 const unsigned long safetyCheckInterval = 200;  // Check safety every 200ms
 int obstacleDistance = 0;
@@ -116,7 +146,7 @@ void loop() {
   }
   
   // Read sensor data and send data periodically
-  if (millis() - lastCommandCheck >= commandCheckInterval) {
+  if (millis() - lastCommandCheck >= (binaryPort ? binarySensorInterval : commandCheckInterval)) {
     readSensors();
     sendSensorData();
     lastCommandCheck = millis();
@@ -157,41 +187,181 @@ void readSensors() {
   lightLevel = ldr.read();
 }
 
-// Process serial commands from the bridge
-void receiveCommands() {
-  while (piSerial.available()) {
-    char inChar = (char)piSerial.read();
-    
-    // If end of command, process it
-    if (inChar == '\n') {
-      processCommand(inputBuffer);
-      inputBuffer = "";
-    } else {
-      inputBuffer += inChar;
-    }
+// CRC-16/CCITT (poly 0x1021), same as crc16() in protocol.py
+uint16_t crc16_update(uint16_t crc, uint8_t data) {
+  crc ^= (uint16_t)data << 8;
+  for (uint8_t i = 0; i < 8; i++) {
+    crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
   }
-  
-  // Also check hardware serial for debugging
-  while (Serial.available()) {
-    char inChar = (char)Serial.read();
+  return crc;
+}
+
+// Write one binary frame to the bridge on the port that negotiated frames
+void sendFrame(uint8_t type, uint8_t seq, const uint8_t *payload, uint8_t length) {
+  uint8_t header[3] = {length, type, seq};
+  uint16_t crc = 0xFFFF;
+  binaryPort->write(FRAME_SYNC1);
+  binaryPort->write(FRAME_SYNC2);
+  for (uint8_t i = 0; i < 3; i++) {
+    crc = crc16_update(crc, header[i]);
+    binaryPort->write(header[i]);
+  }
+  for (uint8_t i = 0; i < length; i++) {
+    crc = crc16_update(crc, payload[i]);
+    binaryPort->write(payload[i]);
+  }
+  binaryPort->write((uint8_t)(crc & 0xFF));
+  binaryPort->write((uint8_t)(crc >> 8));
+}
+
+// Debug output on the USB port, unless a bridge there is reading frames
+void debugPrintln(String text) {
+  if (binaryPort != &Serial) {
+    Serial.println(text);
+  }
+}
+
+// Send a text message: a frame of the given type on the binary port, the
+// "<prefix><text>" line on piSerial unless it is the binary port, and the
+// USB debug echo "<echo><prefix><text>" unless `echo` is NULL
+void sendMessage(uint8_t type, const char *prefix, String text, const char *echo) {
+  if (binaryPort) {
+    uint8_t length = min(text.length(), (unsigned int)FRAME_MAX_PAYLOAD);
+    sendFrame(type, ++txSeq, (const uint8_t *)text.c_str(), length);
+  }
+  if (binaryPort != &piSerial) {
+    piSerial.println(String(prefix) + text);
+  }
+  if (echo) {
+    debugPrintln(String(echo) + prefix + text);
+  }
+}
+
+// Feed one received byte to the frame parser. Any bad length or CRC drops
+// the partial frame and hunts for the next sync bytes.
+void receiveFrameByte(uint8_t inByte) {
+  switch (rxState) {
+    case RX_SYNC1:
+      if (inByte == FRAME_SYNC1) rxState = RX_SYNC2;
+      break;
+    case RX_SYNC2:
+      rxState = (inByte == FRAME_SYNC2) ? RX_HEADER : (inByte == FRAME_SYNC1 ? RX_SYNC2 : RX_SYNC1);
+      rxCount = 0;
+      rxCrc = 0xFFFF;
+      break;
+    case RX_HEADER:
+      rxHeader[rxCount++] = inByte;
+      rxCrc = crc16_update(rxCrc, inByte);
+      if (rxCount == 3) {
+        if (rxHeader[0] > FRAME_MAX_PAYLOAD) {
+          rxState = RX_SYNC1;
+        } else {
+          rxCount = 0;
+          rxState = rxHeader[0] ? RX_PAYLOAD : RX_CRC;
+        }
+      }
+      break;
+    case RX_PAYLOAD:
+      rxPayload[rxCount++] = inByte;
+      rxCrc = crc16_update(rxCrc, inByte);
+      if (rxCount == rxHeader[0]) {
+        rxCount = 0;
+        rxState = RX_CRC;
+      }
+      break;
+    case RX_CRC:
+      rxCrc ^= (uint16_t)inByte << (rxCount * 8);
+      if (++rxCount == 2) {
+        if (rxCrc == 0) {
+          handleFrame(rxHeader[1], rxHeader[2], rxPayload, rxHeader[0]);
+        }
+        rxState = RX_SYNC1;
+      }
+      break;
+  }
+}
+
+// Execute a command frame and ack its sequence number
+void handleFrame(uint8_t type, uint8_t seq, const uint8_t *payload, uint8_t length) {
+  if (type != FRAME_COMMAND) {
+    return;
+  }
+  uint8_t status = ACK_OK;
+  sendFrame(FRAME_ACK, seq, &status, 1);
+  // A retransmission means our ack was lost; don't run the command twice
+  if (seq == lastCommandSeq) {
+    return;
+  }
+  lastCommandSeq = seq;
+  String command = "";
+  for (uint8_t i = 0; i < length; i++) {
+    command += (char)payload[i];
+  }
+  processCommand(command, *binaryPort);
+}
+
+// Read the commands waiting on one port: frames if it is the binary port,
+// else newline-terminated text
+void receiveFrom(Stream &port, String &buffer) {
+  while (port.available()) {
+    char inChar = (char)port.read();
+    boolean framed = (binaryPort == &port);
+    if (framed) {
+      receiveFrameByte((uint8_t)inChar);
+    }
     
     // If end of command, process it
     if (inChar == '\n') {
-      processCommand(inputBuffer);
-      Serial.println("Processed command: " + inputBuffer);
-      inputBuffer = "";
+      String command = buffer;
+      buffer = "";
+      command.trim();
+      // Between frames only a renegotiation counts, e.g. from a restarted bridge
+      if (!framed) {
+        processCommand(command, port);
+        if (&port == &Serial) {
+          debugPrintln("Processed command: " + command);
+        }
+      } else if (command.endsWith(NEGOTIATE_COMMAND)) {
+        processCommand(NEGOTIATE_COMMAND, port);
+      }
     } else {
-      inputBuffer += inChar;
+      buffer += inChar;
+      if (framed && buffer.length() > strlen(NEGOTIATE_COMMAND) + 1) {
+        buffer.remove(0, 1);  // Frame bytes: keep just enough to spot the command
+      }
     }
   }
 }
 
-// Process the command received
-void processCommand(String command) {
+// Process serial commands from the bridge
+void receiveCommands() {
+  receiveFrom(piSerial, inputBuffer);
+  // Also check hardware serial, for debugging or a bridge on the USB port
+  receiveFrom(Serial, usbInputBuffer);
+}
+
+// Process the command received on `port`
+void processCommand(String command, Stream &port) {
   command.trim(); // Remove any leading/trailing whitespace
-  Serial.println("Command received: " + command);
+  debugPrintln("Command received: " + command);
   
-  if (command.startsWith("GET_ALL")) {
+  if (command == NEGOTIATE_COMMAND) {
+    // The bridge supports frames: confirm in ASCII on its port, then switch
+    // both directions there. The blank line ends any frame bytes the bridge
+    // is still reading as text when it renegotiates.
+    if (binaryPort == &port) {
+      port.println();
+    }
+    port.println("PROTO:BIN1 OK");
+    binaryPort = &port;
+    txSeq = 0;
+    lastCommandSeq = 0;
+    rxState = RX_SYNC1;
+    inputBuffer = "";
+    usbInputBuffer = "";
+    debugPrintln("Switched to binary protocol");
+  }
+  else if (command.startsWith("GET_ALL")) {
     // Request all control values
     requestControlValues();
   } 
@@ -204,7 +374,7 @@ void processCommand(String command) {
     if (newState != driveMotorState) {
       driveMotorState = newState;
       statusChanged = true;
-      Serial.println("Drive motor set to: " + driveMotorState);
+      debugPrintln("Drive motor set to: " + driveMotorState);
     }
   } 
   else if (command.startsWith("STEER:")) {
@@ -216,7 +386,7 @@ void processCommand(String command) {
     if (newState != steeringState) {
       steeringState = newState;
       statusChanged = true;
-      Serial.println("Steering set to: " + steeringState);
+      debugPrintln("Steering set to: " + steeringState);
     }
   } 
   else if (command.startsWith("LIGHTS:")) {
@@ -228,7 +398,7 @@ void processCommand(String command) {
     if (newState != headlightsState) {
       headlightsState = newState;
       statusChanged = true;
-      Serial.println("Headlights set to: " + headlightsState);
+      debugPrintln("Headlights set to: " + headlightsState);
     }
   } 
   else if (command.startsWith("LCD:")) {
@@ -239,7 +409,7 @@ void processCommand(String command) {
     if (newMessage != lcdMessage) {
       lcdMessage = newMessage;
       updateLCD(lcdMessage);
-      Serial.println("LCD message updated: " + lcdMessage);
+      debugPrintln("LCD message updated: " + lcdMessage);
     }
   }
   else if (command.startsWith("AUTO_LIGHTS:")) {
@@ -252,37 +422,45 @@ void processCommand(String command) {
     if (newAutoState != autoHeadlights) {
       autoHeadlights = newAutoState;
       statusChanged = true;
-      Serial.println("Auto headlights: " + autoState);
+      debugPrintln("Auto headlights: " + autoState);
     }
   }
   else if (command.startsWith("PING")) {
     // Respond to ping request
-    piSerial.println("PONG");
-    Serial.println("Ping received, responded with PONG");
+    sendMessage(FRAME_TEXT, "", "PONG", NULL);
+    debugPrintln("Ping received, responded with PONG");
   }
 }
 
 // Send sensor data to the bridge
 void sendSensorData() {
+  if (binaryPort) {
+    uint8_t payload[6] = {
+      SENSOR_ID_DIST, (uint8_t)(obstacleDistance & 0xFF), (uint8_t)(obstacleDistance >> 8),
+      SENSOR_ID_LIGHT, (uint8_t)(lightLevel & 0xFF), (uint8_t)(lightLevel >> 8)
+    };
+    sendFrame(FRAME_SENSORS, ++txSeq, payload, sizeof(payload));
+  }
+  
   String sensorData = "SENSORS:";
   sensorData += "DIST=" + String(obstacleDistance) + ";";
   sensorData += "LIGHT=" + String(lightLevel);
   
-  piSerial.println(sensorData);
-  Serial.println("Sending: " + sensorData);
+  if (binaryPort != &piSerial) {
+    piSerial.println(sensorData);
+  }
+  debugPrintln("Sending: " + sensorData);
 }
 
 // Report status changes to the bridge
 void reportStatusChanges() {
   // Only report if status changed and not too recent
   if (statusChanged && (millis() - lastStatusReport > statusReportInterval)) {
-    String statusUpdate = "STATUS:";
-    statusUpdate += "DRIVE=" + driveMotorState + ";";
+    String statusUpdate = "DRIVE=" + driveMotorState + ";";
     statusUpdate += "STEER=" + steeringState + ";";
     statusUpdate += "LIGHTS=" + headlightsState;
     
-    piSerial.println(statusUpdate);
-    Serial.println("Reporting status: " + statusUpdate);
+    sendMessage(FRAME_STATUS, "STATUS:", statusUpdate, "Reporting status: ");
     
     statusChanged = false;
     lastStatusReport = millis();
@@ -291,8 +469,8 @@ void reportStatusChanges() {
 
 // Request control values from the bridge
 void requestControlValues() {
-  piSerial.println("REQUEST:CONTROLS");
-  Serial.println("Requesting control values from serial bridge");
+  sendMessage(FRAME_REQUEST, "REQUEST:", "CONTROLS", NULL);
+  debugPrintln("Requesting control values from serial bridge");
 }
 
 // Apply the current control states to the hardware
@@ -337,8 +515,8 @@ void safetyCheck() {
       statusChanged = true;
       
       // Send urgent status update immediately
-      piSerial.println("STATUS:DRIVE=stop;REASON=obstacle;DISTANCE=" + String(obstacleDistance));
-      Serial.println("Safety stop triggered! Obstacle detected at " + String(obstacleDistance) + "cm");
+      sendMessage(FRAME_STATUS, "STATUS:", "DRIVE=stop;REASON=obstacle;DISTANCE=" + String(obstacleDistance), NULL);
+      debugPrintln("Safety stop triggered! Obstacle detected at " + String(obstacleDistance) + "cm");
       
       // Sound alarm if not already sounding
       if (!alarmActive || (millis() - lastAlarmTime > 2000)) {
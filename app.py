@@ -1,14 +1,46 @@
-from flask import Flask, render_template, request, jsonify
+import time
+# Start of the import phase of the startup timings reported by /api/startup
+IMPORT_STARTED = time.perf_counter()
+
+import server_mode
+if __name__ == '__main__':
+    # Green sockets and threads for the eventlet/gevent modes; must precede every
+    # other import. Only when run as the server: a bare import (tests, tools,
+    # flask shell) stays unpatched, and gunicorn's eventlet/gevent workers patch
+    # the process themselves.
+    server_mode.monkey_patch()
+
+from flask import Flask, Response, g, render_template, request, jsonify
 import mysql.connector
 import json
 import os
+import threading
+from collections import OrderedDict
 from dotenv import load_dotenv
-from webcam_stream import init_webcam_stream
+from webcam_stream import init_webcam_stream, opencv_import_seconds
+from control_channel import ControlPublisher
+from control_writes import ControlWriteBuffer, create_history_table, query_operation_stats
+from devices import create_device_tables, load_devices, parse_device_id
+from http_responses import CachedResponse, cached_response, compress_response, not_modified
+from chart_series import DOWNSAMPLE_METHODS, chart_payload, parse_max_points, rows_to_series
+from live_series import TimeSeriesStore, warm_store
+from protocol import MAX_PAYLOAD
+from serial_messages import control_command
+from sensor_layout import get_layout
+from sensor_rollups import (BUCKET_SECONDS, TIMEFRAMES, create_rollup_tables, query_bucket_series,
+                            query_sensor_summary)
+from telemetry import init_telemetry
+from metrics import CONTENT_TYPE, REGISTRY, Counter, Gauge, Histogram
 from datetime import datetime, timedelta
 
 # Load environment variables
 load_dotenv()
 
+# The bare Flask app: routes only, nothing running. Serve create_app() instead,
+# via `python app.py` or `gunicorn -k eventlet -w 1 'app:create_app()'`;
+# `app:app` has no Socket.IO, webcam feed, telemetry push or control flusher.
+# Importing `app` leaves the process unpatched, which suits in-process test
+# clients; call create_app() there only with SERVER_MODE=threading.
 app = Flask(__name__)
 
 # Database configuration
@@ -18,75 +50,449 @@ DB_CONFIG = {
     'password': os.getenv('DB_PASSWORD', ''),
     'database': os.getenv('DB_NAME', 'drone_db')
 }
+if server_mode.ASYNC_SERVER:
+    # The C extension blocks in native code; the pure-Python driver's sockets are patched green
+    DB_CONFIG['use_pure'] = True
+
+# Connection pool configuration
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '5'))
+
+
+class PooledConnection:
+    """Wrapper around a pooled connection; close() returns it to the pool"""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            self._pool.release(self._conn)
+            self._conn = None
+
+    def __del__(self):
+        # Don't lose the pool slot if a route forgets to close on an error path
+        self.close()
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of MySQL connections shared by the API routes"""
+
+    def __init__(self, config, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT):
+        self.config = config
+        self.size = size
+        self.timeout = timeout
+        self._idle = []
+        self._created = 0
+        self._lock = threading.Condition()
+        self._stats = {
+            'acquired': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'timeouts': 0,
+            'reconnects': 0,
+            'connect_errors': 0
+        }
+
+    def _connect(self):
+        try:
+            return mysql.connector.connect(**self.config)
+        except mysql.connector.Error as err:
+            print(f"Database connection error: {err}")
+            with self._lock:
+                self._stats['connect_errors'] += 1
+            return None
+
+    def _check(self, conn):
+        """Health-check a borrowed connection, reconnecting if it went away"""
+        try:
+            if conn.is_connected():
+                return conn
+            conn.reconnect(attempts=1, delay=0)
+            with self._lock:
+                self._stats['reconnects'] += 1
+            return conn
+        except mysql.connector.Error:
+            try:
+                conn.close()
+            except mysql.connector.Error:
+                pass
+            return None
+
+    def acquire(self):
+        """Borrow a connection, waiting up to `timeout` seconds if all are in use"""
+        deadline = None
+        waited = False
+        wait_start = time.monotonic()
+
+        with self._lock:
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._created < self.size:
+                    # Reserve a slot and connect outside the lock
+                    self._created += 1
+                    conn = None
+                    break
+                if deadline is None:
+                    deadline = wait_start + self.timeout
+                    waited = True
+                    self._stats['waits'] += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    self._stats['wait_time'] += time.monotonic() - wait_start
+                    return None
+                self._lock.wait(remaining)
+            if waited:
+                self._stats['wait_time'] += time.monotonic() - wait_start
+
+        conn = self._check(conn) if conn is not None else None
+        if conn is None:
+            conn = self._connect()
+        if conn is None:
+            # Give the reserved slot back so another caller can try
+            with self._lock:
+                self._created -= 1
+                self._lock.notify()
+            return None
+
+        with self._lock:
+            self._stats['acquired'] += 1
+        return PooledConnection(self, conn)
+
+    def release(self, conn):
+        """Return a connection to the pool, rolling back any open transaction"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except mysql.connector.Error:
+            try:
+                conn.close()
+            except mysql.connector.Error:
+                pass
+            conn = None
+
+        with self._lock:
+            if conn is None:
+                self._created -= 1
+            else:
+                self._idle.append(conn)
+            self._lock.notify()
+
+    def stats(self):
+        """Return a snapshot of the pool counters"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = self.size
+            stats['open'] = self._created
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._created - len(self._idle)
+            stats['wait_time'] = round(stats['wait_time'], 6)
+            return stats
+
+
+db_pool = ConnectionPool(DB_CONFIG)
+
+# Pushes control changes to the serial bridge as soon as they are written
+control_publisher = ControlPublisher()
+
+# Response cache configuration (seconds)
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '64'))
+CONTROLS_CACHE_TTL = float(os.getenv('CONTROLS_CACHE_TTL', '2'))
+ANALYTICS_CACHE_TTL = {
+    '1h': 5,
+    '24h': 30,
+    '7d': 120
+}
+
+
+class _PendingLoad:
+    """A load in progress that concurrent misses on the same key wait for"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+
+
+class ResponseCache:
+    """Thread-safe TTL + LRU cache for read endpoints, with miss coalescing"""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'evictions': 0,
+            'invalidations': 0
+        }
+
+    def get_or_load(self, key, ttl, loader):
+        """
+        Return the cached value for `key`, calling `loader` on a miss.
+        Only one caller runs the loader for a key; the rest wait for its result.
+        A None result (e.g. database unavailable) is returned but not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return entry[1]
+
+            pending = self._pending.get(key)
+            owner = pending is None
+            if owner:
+                self._stats['misses'] += 1
+                pending = self._pending[key] = _PendingLoad()
+            else:
+                self._stats['coalesced'] += 1
+
+        if not owner:
+            pending.done.wait()
+            return pending.value
+
+        value = None
+        try:
+            value = loader()
+        finally:
+            with self._lock:
+                if value is not None:
+                    self._entries[key] = (time.monotonic() + ttl, value)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                        self._stats['evictions'] += 1
+                del self._pending[key]
+            pending.value = value
+            pending.done.set()
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._stats['invalidations'] += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            lookups = stats['hits'] + stats['misses'] + stats['coalesced']
+            stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+            return stats
+
+
+response_cache = ResponseCache()
+
+# Backoff for the background schema check while the database is unreachable
+SCHEMA_RETRY_DELAY = float(os.getenv('SCHEMA_RETRY_DELAY', '1'))
+SCHEMA_MAX_RETRY_DELAY = float(os.getenv('SCHEMA_MAX_RETRY_DELAY', '30'))
+
+# Startup phase durations in seconds; schema_seconds stays None until the schema check succeeds
+startup = {
+    'server_mode': server_mode.SERVER_MODE,
+    'import_seconds': None,
+    'create_app_seconds': None,
+    'schema_seconds': None
+}
+
+# Metrics served on /metrics; pool and cache values are read at scrape time
+HTTP_REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Flask request latency by route',
+                                 ['method', 'route', 'status'])
+DB_POOL_CONNECTIONS = Gauge('db_pool_connections', 'Pooled MySQL connections by state', ['state'])
+DB_POOL_EVENTS = Counter('db_pool_events_total', 'Connection pool acquisitions, waits and failures', ['event'])
+DB_POOL_WAIT_SECONDS = Counter('db_pool_wait_seconds_total', 'Time spent waiting for a free pooled connection')
+CACHE_EVENTS = Counter('response_cache_events_total', 'Response cache lookups and evictions', ['event'])
+STARTUP_SECONDS = Gauge('app_startup_seconds', 'Duration of each startup phase', ['phase'])
+
+for _state in ('size', 'open', 'idle', 'in_use'):
+    DB_POOL_CONNECTIONS.labels(_state).set_function(lambda state=_state: db_pool.stats()[state])
+for _event in ('acquired', 'waits', 'timeouts', 'reconnects', 'connect_errors'):
+    DB_POOL_EVENTS.labels(_event).set_function(lambda event=_event: db_pool.stats()[event])
+DB_POOL_WAIT_SECONDS.set_function(lambda: db_pool.stats()['wait_time'])
+for _event in ('hits', 'misses', 'coalesced', 'evictions', 'invalidations'):
+    CACHE_EVENTS.labels(_event).set_function(lambda event=_event: response_cache.stats()[event])
+for _phase in ('import', 'create_app', 'schema'):
+    STARTUP_SECONDS.labels(_phase).set_function(lambda phase=_phase: startup[f'{phase}_seconds'] or 0.0)
+STARTUP_SECONDS.labels('opencv_import').set_function(lambda: opencv_import_seconds() or 0.0)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_latency(response):
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUEST_SECONDS.labels(request.method, route, response.status_code).observe(
+            time.perf_counter() - started
+        )
+    return response
+
+
+# Other JSON/text responses (devices, stats, /metrics) are compressed on the way out
+app.after_request(compress_response)
+
 
 def get_db_connection():
-    """Create and return a database connection"""
-    try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        return conn
-    except mysql.connector.Error as err:
-        print(f"Database connection error: {err}")
-        return None
+    """Borrow a database connection from the shared pool"""
+    return db_pool.acquire()
 
 def initialize_db():
-    """Create tables if they don't exist"""
+    """Create tables if they don't exist; returns whether the database was reachable"""
     conn = get_db_connection()
-    if conn:
+    if not conn:
+        print("Failed to initialize database")
+        return False
+    complete = True
+    try:
         cursor = conn.cursor()
         
-        # Create drone_controls table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS drone_controls (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            control_name VARCHAR(50) NOT NULL,
-            control_value VARCHAR(255) NOT NULL,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
-        )
-        ''')
-        
-        # Insert default values if table is empty
-        cursor.execute("SELECT COUNT(*) FROM drone_controls")
-        count = cursor.fetchone()[0]
+        # Create the device and per-device drone_controls tables, with
+        # default control values for the default vehicle, and the
+        # append-only log of control changes used for the operation stats
+        try:
+            create_device_tables(cursor)
+            create_history_table(cursor)
+        except mysql.connector.Error as err:
+            # CREATE TABLE IF NOT EXISTS leaves an older drone_controls as it was
+            print(f"Failed to create device and control tables: {err}. "
+                  "A database from before per-device controls needs `alembic upgrade head`")
+            complete = False
         
-        if count == 0:
-            default_controls = [
-                ('drive_motor', 'stop'),
-                ('steering', 'center'),
-                ('headlights', 'off'),
-                ('lcd_message', 'Hello Drone!')
-            ]
-            
-            cursor.executemany(
-                "INSERT INTO drone_controls (control_name, control_value) VALUES (%s, %s)",
-                default_controls
-            )
+        # Create the raw readings table for the configured storage layout and
+        # the rollup tables used by /api/sensor_analytics
+        try:
+            get_layout().create_tables(cursor)
+            create_rollup_tables(cursor)
+        except mysql.connector.Error as err:
+            print(f"Failed to create sensor tables: {err}")
+            complete = False
         
         conn.commit()
         cursor.close()
+    except mysql.connector.Error as err:
+        print(f"Failed to initialize database: {err}")
+        return False
+    finally:
         conn.close()
-        print("Database initialized successfully")
-    else:
-        print("Failed to initialize database")
+    print("Database initialized successfully" if complete else "Database initialized with errors, see above")
+    return True
 
-# Initialize database on startup
-initialize_db()
+def initialize_db_until_ready():
+    """Schema check off the startup path, retried with backoff until MySQL answers"""
+    started = time.perf_counter()
+    delay = SCHEMA_RETRY_DELAY
+    while not initialize_db():
+        time.sleep(delay)
+        delay = min(delay * 2, SCHEMA_MAX_RETRY_DELAY)
+    startup['schema_seconds'] = round(time.perf_counter() - started, 3)
+
+# Recent readings kept in memory, fed by the bridge's telemetry; the last hour
+# is loaded from the database in the background so 1h analytics skip MySQL
+live_series = TimeSeriesStore()
 
 @app.route('/')
 def index():
     """Render the dashboard page"""
     return render_template('index.html')
 
-@app.route('/api/controls', methods=['GET'])
-def get_controls():
-    """API endpoint to get current control values"""
+def load_controls(device_id):
+    """Read a device's current control values, or None if the database is unavailable"""
     conn = get_db_connection()
-    if conn:
+    if not conn:
+        return None
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(
+        "SELECT control_name, control_value FROM drone_controls WHERE device_id = %s",
+        (device_id,)
+    )
+    controls = cursor.fetchall()
+    cursor.close()
+    conn.close()
+    # Changes still waiting in the write buffer are newer than the table
+    pending = control_writes.pending_values(device_id)
+    for control in controls:
+        if control['control_name'] in pending:
+            control['control_value'] = pending[control['control_name']]
+    return controls
+
+# Per-device version of the control values, bumped on every change the app
+# hears of (API writes, bridge telemetry, write-buffer flushes). It is the
+# ETag of /api/controls, so a dashboard poll that already has the current
+# values gets a 304 without a query. The boot id keeps versions from another
+# process or an earlier run from matching.
+CONTROLS_ETAG_BOOT = os.urandom(4).hex()
+controls_versions = {}
+controls_versions_lock = threading.Lock()
+controls_version_counter = 0
+
+def controls_etag(device_id):
+    with controls_versions_lock:
+        return f"c{CONTROLS_ETAG_BOOT}-{device_id}-{controls_versions.get(device_id, 0)}"
+
+def invalidate_controls(device_id):
+    global controls_version_counter
+    with controls_versions_lock:
+        controls_version_counter += 1
+        controls_versions[device_id] = controls_version_counter
+    response_cache.invalidate(('controls', device_id))
+
+def invalidate_flushed_controls(device_ids):
+    for device_id in device_ids:
+        invalidate_controls(device_id)
+
+# Button presses are coalesced and written to drone_controls (+ history) in batches
+control_writes = ControlWriteBuffer(get_db_connection, on_flush=invalidate_flushed_controls)
+
+@app.route('/api/devices', methods=['GET'])
+def get_devices():
+    """API endpoint to list the vehicles and whether their bridge is connected"""
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({"error": "Database connection failed"}), 500
+    try:
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT control_name, control_value FROM drone_controls")
-        controls = cursor.fetchall()
+        devices = load_devices(cursor)
         cursor.close()
+        return jsonify(devices)
+    except mysql.connector.Error as err:
+        print(f"Error listing devices: {err}")
+        return jsonify({"error": f"Database error: {str(err)}"}), 500
+    finally:
         conn.close()
-        return jsonify(controls)
+
+@app.route('/api/controls', methods=['GET'])
+def get_controls():
+    """API endpoint to get current control values of one device (?device=<id>)"""
+    device_id = parse_device_id(request.args.get('device'))
+    # Read the version before loading: a change during the load makes the tag stale, never the body
+    etag = controls_etag(device_id)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    controls = response_cache.get_or_load(
+        ('controls', device_id), CONTROLS_CACHE_TTL, lambda: cached_response(load_controls(device_id), etag)
+    )
+    if controls is not None:
+        return controls.response()
     return jsonify({"error": "Database connection failed"}), 500
 
 @app.route('/api/control/<control_name>', methods=['POST'])
@@ -94,99 +500,190 @@ def update_control(control_name):
     """API endpoint to update a specific control"""
     data = request.json
     new_value = data.get('value')
+    device_id = parse_device_id(data.get('device', request.args.get('device')))
     
     if not new_value:
         return jsonify({"error": "No value provided"}), 400
     
+    # The bridge sends the value as one command; it has to fit in a binary frame
+    command = control_command(control_name, new_value)
+    if command and len(command.encode('utf-8')) > MAX_PAYLOAD:
+        return jsonify({"error": f"Value too long for {control_name}: commands are limited to {MAX_PAYLOAD} bytes"}), 400
+    
+    # The vehicle and dashboards hear about the change right away; the
+    # database write is coalesced with other presses of the same control
+    control_writes.set(control_name, new_value, device_id)
+    invalidate_controls(device_id)
+    control_publisher.publish(control_name, new_value, device_id)
+    if telemetry_hub is not None:
+        telemetry_hub.update_controls({control_name: new_value}, device_id)
+    return jsonify({"success": True, "device": device_id, "control": control_name, "value": new_value})
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus scrape endpoint"""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+@app.route('/api/db_pool', methods=['GET'])
+def get_db_pool_stats():
+    """API endpoint to report connection pool usage"""
+    return jsonify(db_pool.stats())
+
+@app.route('/api/control_writes', methods=['GET'])
+def get_control_write_stats():
+    """API endpoint to report how many control writes were coalesced"""
+    return jsonify(control_writes.get_stats())
+
+@app.route('/api/live_series', methods=['GET'])
+def get_live_series_stats():
+    """API endpoint to report what the in-memory sensor store holds"""
+    return jsonify(live_series.stats())
+
+@app.route('/api/startup', methods=['GET'])
+def get_startup_stats():
+    """API endpoint to report how long startup, the schema check and the OpenCV import took"""
+    stats = dict(startup)
+    stats['opencv_import_seconds'] = opencv_import_seconds()
+    return jsonify(stats)
+
+@app.route('/api/cache', methods=['GET'])
+def get_cache_stats():
+    """API endpoint to report response cache hits and misses"""
+    return jsonify(response_cache.stats())
+
+def load_operation_stats(timeframe, device_id):
+    """Control change counts for the analytics payload, or None if the database is unavailable"""
     conn = get_db_connection()
-    if conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE drone_controls SET control_value = %s WHERE control_name = %s",
-            (new_value, control_name)
-        )
-        conn.commit()
+    if not conn:
+        return None
+    try:
+        cursor = conn.cursor(dictionary=True)
+        operation_stats = query_operation_stats(cursor, timeframe, device_id)
         cursor.close()
+        return operation_stats
+    except mysql.connector.Error as err:
+        print(f"Error getting operation stats: {err}")
+        return None
+    finally:
         conn.close()
-        return jsonify({"success": True, "control": control_name, "value": new_value})
-    
-    return jsonify({"error": "Database connection failed"}), 500
 
 @app.route('/api/sensor_analytics', methods=['GET'])
 def get_sensor_analytics():
-    """API endpoint to get sensor analytics data"""
+    """API endpoint to get sensor analytics data (?device=<id>, or all devices when omitted)"""
     timeframe = request.args.get('timeframe', '24h')
+    if timeframe not in ANALYTICS_CACHE_TTL:
+        timeframe = '24h'  # Default to 24h
+    device_id = parse_device_id(request.args.get('device'), None)
+    # Chart resolution (raw/minute/hour) and the most points per line to send back
+    resolution = request.args.get('resolution')
+    if resolution != 'raw' and resolution not in BUCKET_SECONDS:
+        resolution = TIMEFRAMES[timeframe][0]
+    max_points = parse_max_points(request.args.get('max_points'))
+    method = request.args.get('downsample', 'lttb')
+    if method not in DOWNSAMPLE_METHODS:
+        method = 'lttb'
     
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({"error": "Database connection failed"}), 500
+    errors = []
     
-    try:
-        cursor = conn.cursor(dictionary=True)
-        
-        # Calculate the time boundary based on the timeframe
-        if timeframe == '1h':
-            time_sql = "timestamp >= DATE_SUB(NOW(), INTERVAL 1 HOUR)"
-        elif timeframe == '24h':
-            time_sql = "timestamp >= DATE_SUB(NOW(), INTERVAL 24 HOUR)"
-        elif timeframe == '7d':
-            time_sql = "timestamp >= DATE_SUB(NOW(), INTERVAL 7 DAY)"
-        else:
-            time_sql = "timestamp >= DATE_SUB(NOW(), INTERVAL 24 HOUR)"  # Default to 24h
-        
-        # Get summary stats for each sensor type
-        cursor.execute(f"""
-            SELECT 
-                reading_type, 
-                AVG(reading_value) AS avg_value,
-                MIN(reading_value) AS min_value,
-                MAX(reading_value) AS max_value,
-                COUNT(*) AS reading_count
-            FROM 
-                sensor_readings
-            WHERE 
-                {time_sql}
-            GROUP BY 
-                reading_type
-        """)
-        
-        summary_stats = cursor.fetchall()
-        
-        # Get time series data for charts (hourly averages)
-        cursor.execute(f"""
-            SELECT 
-                reading_type,
-                DATE_FORMAT(timestamp, '%Y-%m-%d %H:00:00') AS hour_bucket,
-                AVG(reading_value) AS avg_value
-            FROM 
-                sensor_readings
-            WHERE 
-                {time_sql}
-            GROUP BY 
-                reading_type, hour_bucket
-            ORDER BY 
-                hour_bucket
-        """)
-        
-        time_series = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
-        
-        return jsonify({
+    # Short windows come straight from the in-memory store when it covers them
+    live = live_series.analytics(timeframe, device_id, resolution)
+    if live is not None:
+        summary_stats, series = live
+        operation_stats = response_cache.get_or_load(
+            ('operations', timeframe, device_id), ANALYTICS_CACHE_TTL[timeframe],
+            lambda: load_operation_stats(timeframe, device_id)
+        )
+        return CachedResponse({
             'summary': summary_stats,
-            'time_series': time_series
-        })
+            'series': chart_payload(series, resolution, BUCKET_SECONDS.get(resolution), max_points, method),
+            'operations': operation_stats or [],
+            'source': 'memory'
+        }).response()
+    
+    # Raw samples are only kept in memory; the database answers with minute buckets
+    if resolution == 'raw':
+        resolution = 'minute'
+    
+    def load_analytics():
+        conn = get_db_connection()
+        if not conn:
+            errors.append("Database connection failed")
+            return None
         
-    except mysql.connector.Error as err:
-        print(f"Error getting sensor analytics: {err}")
-        if conn:
+        try:
+            cursor = conn.cursor(dictionary=True)
+            
+            # Answer from the minute/hour rollups maintained at ingest time
+            summary_stats = query_sensor_summary(cursor, timeframe, device_id=device_id)
+            series = rows_to_series(query_bucket_series(cursor, timeframe, resolution, device_id))
+            
+            # How often each control value was set, from the indexed history table
+            operation_stats = query_operation_stats(cursor, timeframe, device_id)
+            
+            cursor.close()
             conn.close()
-        return jsonify({"error": f"Database error: {str(err)}"}), 500
+            
+            # Thinned to at most max_points per line before it is cached and sent
+            return CachedResponse({
+                'summary': summary_stats,
+                'series': chart_payload(series, resolution, BUCKET_SECONDS[resolution], max_points, method),
+                'operations': operation_stats
+            })
+            
+        except mysql.connector.Error as err:
+            print(f"Error getting sensor analytics: {err}")
+            if conn:
+                conn.close()
+            errors.append(f"Database error: {str(err)}")
+            return None
+    
+    analytics = response_cache.get_or_load(
+        ('sensor_analytics', timeframe, device_id, resolution, max_points, method),
+        ANALYTICS_CACHE_TTL[timeframe], load_analytics
+    )
+    if analytics is None:
+        return jsonify({"error": errors[0] if errors else "Database connection failed"}), 500
+    return analytics.response()
+
+# Set up by create_app(); None while the module is only imported
+socketio = None
+webcam_streamer = None
+telemetry_hub = None
 
-# Initialize SocketIO and webcam streaming
-socketio, webcam_streamer = init_webcam_stream(app)
+def create_app():
+    """
+    Start the app's background work and return the Flask app; later calls
+    return it unchanged. Nothing here waits on MySQL or OpenCV: the schema
+    check and the 1h warm-up run on background threads, and the camera stack
+    is imported when the first viewer starts the stream.
+    """
+    global socketio, webcam_streamer, telemetry_hub
+    if socketio is not None:
+        return app
+    started = time.perf_counter()
+    
+    threading.Thread(target=initialize_db_until_ready, name="SchemaInit", daemon=True).start()
+    threading.Thread(target=warm_store, args=(live_series, get_db_connection), daemon=True).start()
+    control_writes.start()
+    
+    # Initialize SocketIO and webcam streaming
+    socketio, webcam_streamer = init_webcam_stream(app, async_mode=server_mode.SERVER_MODE)
+    
+    # Push live telemetry from the serial bridge to subscribed dashboards
+    telemetry_hub = init_telemetry(
+        socketio,
+        load_controls=load_controls,
+        on_controls_changed=invalidate_controls,
+        on_sensors=live_series.add_readings
+    )
+    
+    startup['import_seconds'] = round(started - IMPORT_STARTED, 3)
+    startup['create_app_seconds'] = round(time.perf_counter() - started, 3)
+    print(f"App ready in {(time.perf_counter() - IMPORT_STARTED) * 1000:.0f} ms "
+          f"(imports {startup['import_seconds'] * 1000:.0f} ms)")
+    return app
 
 if __name__ == '__main__':
-    # Use socketio.run instead of app.run
-    socketio.run(app, debug=True, host='0.0.0.0', allow_unsafe_werkzeug=True)
\ No newline at end of file
+    # SERVER_MODE picks the eventlet/gevent production server or the Werkzeug dev server
+    flask_app = create_app()
+    server_mode.run(socketio, flask_app)
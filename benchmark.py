@@ -0,0 +1,649 @@
+"""
+Headless benchmark harness for the serial bridge, the Flask app and the webcam
+streamer. Runs against a simulated Arduino on a pty (fake_arduino.py), a local
+MySQL/MariaDB database and a synthetic camera, and writes the results as JSON
+so runs can be compared.
+
+    python benchmark.py                              # everything, results in bench_results/
+    python benchmark.py --scenarios ingest,rtt --db none
+    python benchmark.py --scenarios ingest,rtt --db none --protocol binary --noise-every 50
+    python benchmark.py --compare bench_results/old.json
+
+Scenarios:
+  ingest     serial lines -> SensorIngestBuffer -> DB: rows/s, drain time, CPU
+  rtt        API control push -> bridge -> Arduino -> "Command received" echo
+  analytics  /api/sensor_analytics and /api/controls latency, cold and cached
+  stream     WebcamStreamer capture/encode/publish timings, viewer fps, CPU
+  parse      Arduino line parsing on the traffic recorded in serial_bridge.log
+
+Use a throwaway database (--db-name, default drone_bench): it is created if
+missing and seeded with synthetic readings. With --db none the bridge writes
+to a connection that discards rows, which isolates the serial/parse/buffer
+path; the analytics scenario needs MySQL and is skipped.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from fake_arduino import FakeArduino
+
+logger = logging.getLogger("Benchmark")
+
+SCENARIOS = ('ingest', 'rtt', 'analytics', 'stream', 'parse')
+ANALYTICS_TIMEFRAMES = ('1h', '24h', '7d')
+# Recorded bridge traffic next to this script, wherever the benchmark is run from
+DEFAULT_PARSE_LOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'serial_bridge.log')
+
+# app.py is imported in-process next to the simulator threads; keep it unpatched
+os.environ['SERVER_MODE'] = 'threading'
+
+
+def summarize(samples):
+    """Latency percentiles in milliseconds for a list of durations in seconds"""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return round(ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000, 3)
+
+    return {
+        'count': len(ordered),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+        'p50_ms': percentile(50),
+        'p90_ms': percentile(90),
+        'p99_ms': percentile(99),
+        'max_ms': round(ordered[-1] * 1000, 3)
+    }
+
+
+class CpuMeter:
+    """Process CPU time over a wall-clock interval (includes the simulators)"""
+
+    def __init__(self):
+        self.wall = time.monotonic()
+        self.cpu = time.process_time()
+
+    def percent(self):
+        wall = time.monotonic() - self.wall
+        return round((time.process_time() - self.cpu) / wall * 100, 1) if wall else 0.0
+
+
+class NullCursor:
+    rowcount = 0
+
+    def execute(self, sql, params=None):
+        self.rowcount = 0
+
+    def executemany(self, sql, rows):
+        self.rowcount = len(list(rows))
+
+    def fetchall(self):
+        return []
+
+    def fetchone(self):
+        return (None,)
+
+    def close(self):
+        pass
+
+
+class NullConnection:
+    """Stand-in for a MySQL connection that accepts and discards every write"""
+
+    def cursor(self, dictionary=False, **kwargs):
+        return NullCursor()
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SyntheticCamera:
+    """cv2.VideoCapture stand-in producing textured, moving frames at a fixed rate"""
+
+    PATTERNS = 8
+
+    def __init__(self, camera_id=0, fps=30, seed=0):
+        self.fps = fps
+        self.width = 640
+        self.height = 480
+        self.seed = seed
+        self.patterns = None
+        self.count = 0
+        self.next_at = time.monotonic()
+
+    def set(self, prop, value):
+        import cv2
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            self.width = int(value)
+        elif prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            self.height = int(value)
+        return True
+
+    def isOpened(self):
+        return True
+
+    def _build_patterns(self):
+        # Smooth gradients plus noise, so JPEG encoding costs about what a real scene does
+        rng = np.random.default_rng(self.seed)
+        y, x = np.mgrid[0:self.height, 0:self.width]
+        base = np.stack([(x * 255 // self.width), (y * 255 // self.height), ((x + y) % 256)], axis=-1)
+        self.patterns = []
+        for i in range(self.PATTERNS):
+            noise = rng.integers(0, 24, size=base.shape)
+            frame = np.roll(base, i * self.width // self.PATTERNS, axis=1) + noise
+            self.patterns.append(np.clip(frame, 0, 255).astype(np.uint8))
+
+    def grab(self):
+        return self.read()[0]
+
+    def read(self, image=None):
+        if self.patterns is None:
+            self._build_patterns()
+        self.next_at += 1.0 / self.fps
+        time.sleep(max(0, self.next_at - time.monotonic()))
+        frame = self.patterns[self.count % self.PATTERNS]
+        self.count += 1
+        if image is not None and image.shape == frame.shape:
+            np.copyto(image, frame)
+            return True, image
+        return True, frame.copy()
+
+    def release(self):
+        pass
+
+
+def configure_environment(args, workdir):
+    """Point the repo modules at the benchmark database and scratch files before importing them"""
+    os.environ['DB_NAME'] = args.db_name
+    os.environ['INGEST_SPILL_FILE'] = os.path.join(workdir, 'sensor_spill.csv')
+    os.environ['STORAGE_MAINTENANCE_INTERVAL'] = '86400'
+
+
+def prepare_database(args):
+    """Create and initialise the benchmark database; returns an error string if MySQL is unusable"""
+    import mysql.connector
+    config = {
+        'host': os.getenv('DB_HOST', 'localhost'),
+        'user': os.getenv('DB_USER', 'root'),
+        'password': os.getenv('DB_PASSWORD', '')
+    }
+    try:
+        conn = mysql.connector.connect(**config)
+        cursor = conn.cursor()
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{args.db_name}`")
+        cursor.close()
+        conn.close()
+    except mysql.connector.Error as err:
+        return str(err)
+
+    import app
+    app.initialize_db()
+    return None
+
+
+def seed_readings(rows, days=7, batch=5000):
+    """Insert synthetic readings spread over the last `days` days, with their rollups"""
+    import app
+    from sensor_layout import get_layout
+    from sensor_rollups import apply_rollups
+
+    layout = get_layout()
+    now = datetime.now()
+    step = timedelta(days=days) / max(rows // 2, 1)
+    conn = app.get_db_connection()
+    cursor = conn.cursor()
+    try:
+        pending = []
+        for i in range(rows // 2):
+            timestamp = now - step * i
+            pending.append(('DIST', float(20 + (i * 7) % 300), timestamp, 1))
+            pending.append(('LIGHT', float((i * 3) % 100), timestamp, 1))
+            if len(pending) >= batch:
+                layout.insert(cursor, pending)
+                apply_rollups(cursor, pending)
+                conn.commit()
+                pending = []
+        if pending:
+            layout.insert(cursor, pending)
+            apply_rollups(cursor, pending)
+            conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+
+class BridgeRunner:
+    """Runs serial_bridge.run_bridge() in a thread against a FakeArduino (device 1) and any `extra_fakes` (2..N)"""
+
+    def __init__(self, fake, use_db, protocol='ascii', extra_fakes=()):
+        self.fake = fake
+        self.fakes = [fake, *extra_fakes]
+        self.use_db = use_db
+        self.protocol = protocol
+        self.thread = None
+        self.acks = {}
+
+    def start(self, timeout=15.0):
+        import serial_bridge
+        self.bridge = serial_bridge
+        serial_bridge.SERIAL_PORT = self.fake.port
+        serial_bridge.SERIAL_PORTS = ','.join(
+            f"{device_id}={fake.port}" for device_id, fake in enumerate(self.fakes, 1)
+        ) if len(self.fakes) > 1 else ''
+        serial_bridge.SERIAL_PROTOCOL = self.protocol
+        if not self.use_db:
+            serial_bridge.get_db_connection = NullConnection
+
+        # Record when the bridge sees each command echo, for round-trip times
+        handle_line = serial_bridge.handle_arduino_line
+
+        def observe_line(line, device_id=1):
+            if line.startswith("Command received: "):
+                self.acks.setdefault(line[len("Command received: "):].strip(), time.monotonic())
+            return handle_line(line, device_id)
+
+        serial_bridge.handle_arduino_line = observe_line
+        self.thread = threading.Thread(target=asyncio.run, args=(serial_bridge.run_bridge(),), daemon=True)
+        self.thread.start()
+        # The bridge asks for a full resync once the port is open and settled
+        for fake in self.fakes:
+            if fake.wait_for_command("GET_ALL", timeout=timeout) is None:
+                raise RuntimeError(f"Serial bridge did not connect to the fake Arduino on {fake.port}")
+
+    def stop(self):
+        bridge = self.bridge
+        if bridge.bridge_loop is not None:
+            bridge.bridge_loop.call_soon_threadsafe(bridge.shutdown_event.set)
+        self.thread.join(timeout=30)
+
+
+def bench_ingest(runner, args):
+    """Flood the bridge with sensor lines and measure how fast rows reach the database"""
+    fake = runner.fake
+    ingest = runner.bridge.sensor_ingest
+    before = ingest.get_stats()
+    lines_before = fake.counts['sensors']
+    cpu = CpuMeter()
+    started = time.monotonic()
+
+    fake.sensor_rate = args.ingest_rate
+    time.sleep(args.duration)
+    fake.sensor_rate = args.sensor_rate
+    elapsed = time.monotonic() - started
+    during = ingest.get_stats()
+    cpu_percent = cpu.percent()
+    lines = fake.counts['sensors'] - lines_before
+
+    # Let the buffer drain everything that was emitted (two readings per line)
+    expected = before['added'] + lines * 2
+    drain_started = time.monotonic()
+    while time.monotonic() - drain_started < args.drain_timeout:
+        stats = ingest.get_stats()
+        if stats['added'] >= expected and stats['pending'] == 0:
+            break
+        time.sleep(0.05)
+    drained = ingest.get_stats()
+
+    inserted = during['inserted'] - before['inserted']
+    return {
+        'duration_s': round(elapsed, 3),
+        'lines_emitted': lines,
+        'lines_per_sec': round(lines / elapsed, 1),
+        'rows_inserted': inserted,
+        'rows_per_sec': round(inserted / elapsed, 1),
+        'rows_after_drain': drained['inserted'] - before['inserted'],
+        'drain_s': round(time.monotonic() - drain_started, 3),
+        'batches': drained['batches'] - before['batches'],
+        'spilled': drained['spilled'] - before['spilled'],
+        'dropped': drained['dropped'] - before['dropped'],
+        'flush_errors': drained['flush_errors'] - before['flush_errors'],
+        'cpu_percent': cpu_percent
+    }
+
+
+def bench_rtt(runner, args):
+    """Push LCD changes over the control channel and time them to the device and back"""
+    from control_channel import ControlPublisher
+
+    fake = runner.fake
+    publisher = ControlPublisher()
+    to_device = []
+    round_trip = []
+    timeouts = 0
+    for i in range(args.commands):
+        value = f"bench {i}"
+        command = f"LCD:{value}"
+        since = len(fake.commands)
+        sent_at = time.monotonic()
+        publisher.publish('lcd_message', value)
+        received_at = fake.wait_for_command(command, timeout=2.0, since=since)
+        if received_at is None:
+            timeouts += 1
+            continue
+        to_device.append(received_at - sent_at)
+        deadline = time.monotonic() + 2.0
+        while command not in runner.acks and time.monotonic() < deadline:
+            time.sleep(0.0005)
+        if command in runner.acks:
+            round_trip.append(runner.acks[command] - sent_at)
+        time.sleep(args.command_interval)
+    return {
+        'commands': args.commands,
+        'timeouts': timeouts,
+        'to_device': summarize(to_device),
+        'round_trip': summarize(round_trip)
+    }
+
+
+def legacy_parse(line):
+    """The substring/split parsing serial_bridge did before the message registry, for comparison"""
+    if "SENSORS:" in line:
+        parsed = {}
+        for part in line.split("SENSORS:")[1].split(';'):
+            if '=' in part:
+                key, value = part.split('=')
+                parsed[key] = value
+        readings = []
+        for key, value in parsed.items():
+            try:
+                readings.append((key, float(value)))
+            except ValueError:
+                pass
+        return 'sensors', readings
+    elif "STATUS:" in line:
+        updates = {}
+        for part in line.split("STATUS:")[1].split(';'):
+            if '=' in part:
+                key, value = part.split('=')
+                updates[key] = value
+        return 'status', updates
+    elif "REQUEST:CONTROLS" in line:
+        return 'request', None
+    elif line.startswith("Command received: "):
+        return 'ack', None
+    return 'other', None
+
+
+def bench_parse(args):
+    """Parse throughput of recorded Arduino traffic: message registry vs the old substring chain"""
+    from replay import parse_log
+    from serial_messages import MessageRegistry, parse_fields, parse_readings
+
+    lines = [event.text for event in parse_log(args.parse_log, keep_replies=True) if event.direction == 'rx']
+    if not lines:
+        return {'skipped': f"no received lines in {args.parse_log}"}
+    registry = MessageRegistry()
+    registry.register('SENSORS', 'sensors', parser=parse_readings)
+    registry.register('STATUS', 'status', parser=parse_fields)
+    registry.register('REQUEST', 'request')
+    registry.register_phrase('Command received', 'ack')
+
+    kinds = {}
+    for line in lines:
+        kind = registry.parse(line)[0]
+        kinds[kind] = kinds.get(kind, 0) + 1
+
+    def run(parse):
+        legacy_errors = 0
+        started = time.perf_counter()
+        for _ in range(args.parse_passes):
+            for line in lines:
+                try:
+                    parse(line)
+                except ValueError:
+                    legacy_errors += 1
+        return time.perf_counter() - started, legacy_errors
+
+    total = len(lines) * args.parse_passes
+    legacy_time, legacy_errors = run(legacy_parse)
+    registry_time, _ = run(registry.parse)
+    return {
+        'log': args.parse_log,
+        'lines': len(lines),
+        'passes': args.parse_passes,
+        'kinds': kinds,
+        'legacy_lines_per_sec': round(total / legacy_time),
+        'legacy_errors': legacy_errors // args.parse_passes,
+        'registry_lines_per_sec': round(total / registry_time),
+        'registry_ns_per_line': round(registry_time / total * 1e9),
+        'speedup': round(legacy_time / registry_time, 2)
+    }
+
+
+def bench_analytics(args):
+    """Time the dashboard endpoints uncached (cache invalidated) and cached"""
+    import app
+
+    seed_readings(args.seed_rows)
+    client = app.app.test_client()
+    endpoints = [f"/api/sensor_analytics?timeframe={tf}" for tf in ANALYTICS_TIMEFRAMES]
+    endpoints.append("/api/controls")
+
+    results = {'seed_rows': args.seed_rows}
+    for url in endpoints:
+        cold, warm = [], []
+        size = 0
+        for _ in range(args.requests):
+            app.response_cache.clear()
+            started = time.perf_counter()
+            response = client.get(url)
+            cold.append(time.perf_counter() - started)
+            size = len(response.data)
+            if response.status_code != 200:
+                raise RuntimeError(f"{url} returned {response.status_code}")
+        for _ in range(args.requests):
+            started = time.perf_counter()
+            client.get(url)
+            warm.append(time.perf_counter() - started)
+        results[url] = {'uncached': summarize(cold), 'cached': summarize(warm), 'response_bytes': size}
+    return results
+
+
+def bench_stream(args):
+    """Run the webcam pipeline on a synthetic camera with several MJPEG viewers"""
+    from webcam_stream import WebcamStreamer
+
+    streamer = WebcamStreamer(
+        None, fps=args.camera_fps, transport='mjpeg',
+        camera_factory=lambda camera_id: SyntheticCamera(camera_id, fps=args.camera_fps)
+    )
+    if not streamer.start():
+        raise RuntimeError("Webcam streamer did not start on the synthetic camera")
+
+    stop = threading.Event()
+    viewers = [{'frames': 0, 'bytes': 0} for _ in range(args.viewers)]
+
+    def watch(counters):
+        for part in streamer.mjpeg_frames(fps=args.viewer_fps):
+            if part.startswith(b'--'):
+                counters['frames'] += 1
+            counters['bytes'] += len(part)
+            if stop.is_set():
+                break
+
+    threads = [threading.Thread(target=watch, args=(counters,), daemon=True) for counters in viewers]
+    cpu = CpuMeter()
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.stream_seconds)
+    elapsed = time.monotonic() - started
+    cpu_percent = cpu.percent()
+    stats = streamer.stats()
+    stop.set()
+    streamer.stop()
+    for thread in threads:
+        thread.join(timeout=2.0)
+
+    return {
+        'camera_fps': args.camera_fps,
+        'viewer_fps_cap': args.viewer_fps,
+        'viewer_fps': [round(v['frames'] / elapsed, 2) for v in viewers],
+        'viewer_kbytes_per_sec': [round(v['bytes'] / elapsed / 1024, 1) for v in viewers],
+        'pipeline': stats,
+        'cpu_percent': cpu_percent
+    }
+
+
+def flatten(results, prefix=''):
+    """Numeric leaves of a result tree, keyed by dotted path"""
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, path + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(previous, current):
+    old = flatten(previous.get('results', {}))
+    new = flatten(current.get('results', {}))
+    print(f"{'metric':<70} {'previous':>12} {'current':>12} {'change':>8}")
+    for key in sorted(old.keys() & new.keys()):
+        change = f"{(new[key] - old[key]) / old[key] * 100:+.1f}%" if old[key] else ''
+        print(f"{key:<70} {old[key]:>12} {new[key]:>12} {change:>8}")
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the serial bridge, Flask app and webcam streamer")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"comma-separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument('--db', choices=('mysql', 'none'), default='mysql',
+                        help="write to a local MySQL/MariaDB, or discard rows")
+    parser.add_argument('--db-name', default='drone_bench', help="throwaway database used for the run")
+    parser.add_argument('--duration', type=float, default=10.0, help="ingest flood duration (s)")
+    parser.add_argument('--ingest-rate', type=float, default=0.0,
+                        help="sensor lines/s during the ingest run (0 = as fast as possible)")
+    parser.add_argument('--sensor-rate', type=float, default=2.0, help="background sensor lines/s otherwise")
+    parser.add_argument('--drain-timeout', type=float, default=30.0)
+    parser.add_argument('--protocol', choices=('ascii', 'binary'), default='ascii',
+                        help="serial protocol the bridge negotiates with the fake Arduino")
+    parser.add_argument('--noise-every', type=int, default=0,
+                        help="inject line noise every N sensor lines (0 = clean link)")
+    parser.add_argument('--commands', type=int, default=200, help="control pushes timed by the rtt run")
+    parser.add_argument('--command-interval', type=float, default=0.02)
+    parser.add_argument('--requests', type=int, default=50, help="requests per endpoint and cache state")
+    parser.add_argument('--seed-rows', type=int, default=100000, help="synthetic readings for analytics")
+    parser.add_argument('--stream-seconds', type=float, default=10.0)
+    parser.add_argument('--camera-fps', type=int, default=30)
+    parser.add_argument('--viewers', type=int, default=3)
+    parser.add_argument('--viewer-fps', type=int, default=15)
+    parser.add_argument('--parse-log', default=DEFAULT_PARSE_LOG, help="recorded traffic for the parse run")
+    parser.add_argument('--parse-passes', type=int, default=50)
+    parser.add_argument('--output', help="results file (default bench_results/<timestamp>.json)")
+    parser.add_argument('--compare', help="earlier results file to compare against")
+    parser.add_argument('--log-level', default='WARNING')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Configure logging before the repo modules do, so their log files are left alone
+    logging.basicConfig(level=args.log_level, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    workdir = tempfile.mkdtemp(prefix='drone-bench-')
+    configure_environment(args, workdir)
+
+    use_db = args.db == 'mysql'
+    db_note = args.db
+    if use_db and ({'ingest', 'rtt', 'analytics'} & set(scenarios)):
+        error = prepare_database(args)
+        if error:
+            logger.warning(f"MySQL unavailable, discarding rows instead: {error}")
+            use_db = False
+            db_note = f"none (MySQL unavailable: {error})"
+
+    results = {}
+    if {'ingest', 'rtt'} & set(scenarios):
+        fake = FakeArduino(sensor_rate=args.sensor_rate, obstacle_every=50, request_every=500,
+                           noise_every=args.noise_every, seed=1)
+        fake.start()
+        runner = BridgeRunner(fake, use_db, args.protocol)
+        try:
+            runner.start()
+            if 'ingest' in scenarios:
+                print("Running ingest benchmark...")
+                results['ingest'] = bench_ingest(runner, args)
+            if 'rtt' in scenarios:
+                print("Running command round-trip benchmark...")
+                results['rtt'] = bench_rtt(runner, args)
+            runner.stop()
+        finally:
+            fake.stop()
+        results['serial'] = dict(fake.counts, protocol='binary' if fake.binary else 'ascii')
+
+    if 'analytics' in scenarios:
+        if use_db:
+            print("Running analytics benchmark...")
+            results['analytics'] = bench_analytics(args)
+        else:
+            results['analytics'] = {'skipped': 'requires MySQL (--db mysql)'}
+
+    if 'stream' in scenarios:
+        print("Running stream benchmark...")
+        results['stream'] = bench_stream(args)
+
+    if 'parse' in scenarios:
+        print("Running parse benchmark...")
+        results['parse'] = bench_parse(args)
+
+    report = {
+        'meta': {
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'db': db_note,
+            'storage_layout': os.getenv('SENSOR_STORAGE_LAYOUT', 'rows'),
+            'args': vars(args)
+        },
+        'results': results
+    }
+
+    output = args.output or os.path.join('bench_results', datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    print(json.dumps(results, indent=2, default=str))
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
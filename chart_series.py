@@ -0,0 +1,130 @@
+import os
+
+import numpy as np
+
+# Points per chart line when the client doesn't ask for a number
+CHART_MAX_POINTS = int(os.getenv('CHART_MAX_POINTS', '500'))
+MIN_POINTS = 10
+MAX_POINTS = 5000
+
+DOWNSAMPLE_METHODS = ('lttb', 'minmax')
+
+
+def lttb_indices(x, y, threshold):
+    """
+    Indices of the points Largest-Triangle-Three-Buckets keeps out of
+    (x, y): the first and last point plus, from each of threshold - 2 equal
+    buckets, the point forming the largest triangle with the previously kept
+    point and the next bucket's average. Keeps peaks and the overall shape.
+    """
+    size = len(x)
+    if threshold >= size or threshold < 3:
+        return np.arange(size)
+    edges = np.linspace(1, size - 1, threshold - 1).astype(np.int64)
+    # Every bucket's average up front; the last bucket's "next" is the last point
+    counts = np.diff(edges)
+    mean_x = np.append(np.add.reduceat(x[:size - 1], edges[:-1]) / counts, x[-1])
+    mean_y = np.append(np.add.reduceat(y[:size - 1], edges[:-1]) / counts, y[-1])
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0] = 0
+    kept[-1] = size - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_x, next_y = mean_x[bucket + 1], mean_y[bucket + 1]
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(areas.argmax())
+        kept[bucket + 1] = previous
+    return kept
+
+
+def minmax_indices(x, y, threshold):
+    """Indices of the minimum and maximum of each of threshold / 2 equal buckets, plus the end points"""
+    size = len(x)
+    if threshold >= size or threshold < 4:
+        return np.arange(size)
+    edges = np.linspace(0, size, threshold // 2 + 1).astype(np.int64)
+    kept = [0, size - 1]
+    for start, end in zip(edges[:-1], edges[1:]):
+        if end > start:
+            kept.append(start + int(np.argmin(y[start:end])))
+            kept.append(start + int(np.argmax(y[start:end])))
+    return np.unique(kept)
+
+
+DOWNSAMPLERS = {
+    'lttb': lttb_indices,
+    'minmax': minmax_indices
+}
+
+
+def parse_max_points(value, default=CHART_MAX_POINTS):
+    try:
+        return min(max(int(value), MIN_POINTS), MAX_POINTS)
+    except (TypeError, ValueError):
+        return default
+
+
+def rows_to_series(rows):
+    """{reading_type: (epoch seconds, values)} from (reading_type, bucket_start datetime, avg_value) rows"""
+    grouped = {}
+    for row in rows:
+        if isinstance(row, dict):
+            row = (row['reading_type'], row['bucket_start'], row['avg_value'])
+        reading_type, bucket_start, value = row
+        grouped.setdefault(reading_type, ([], []))
+        grouped[reading_type][0].append(bucket_start.timestamp())
+        grouped[reading_type][1].append(float(value))
+    return {reading_type: (np.array(times), np.array(values)) for reading_type, (times, values) in grouped.items()}
+
+
+def columnar_series(series, max_points=CHART_MAX_POINTS, method='lttb'):
+    """
+    Chart payload for {reading_type: (times, values)}: one shared, sorted
+    `timestamps` array (epoch seconds) and a `values` array per reading type
+    (None where that type has no point). With more than `max_points`
+    timestamps, each type keeps its own LTTB (or min/max) points out of an
+    equal share of the budget, and the union is what is returned.
+    """
+    types = sorted(series)
+    if not types:
+        return {'timestamps': [], 'values': {}, 'source_points': 0}
+    timestamps = np.unique(np.concatenate([series[reading_type][0] for reading_type in types]))
+    grid = np.full((len(types), len(timestamps)), np.nan)
+    for row, reading_type in enumerate(types):
+        times, values = series[reading_type]
+        grid[row, np.searchsorted(timestamps, times)] = values
+    source_points = len(timestamps)
+
+    if len(timestamps) > max_points:
+        select = DOWNSAMPLERS.get(method, lttb_indices)
+        budget = max(max_points // len(types), 3)
+        kept = []
+        for row in grid:
+            present = np.flatnonzero(~np.isnan(row))
+            kept.append(present[select(timestamps[present], row[present], budget)])
+        kept = np.unique(np.concatenate(kept))
+        timestamps = timestamps[kept]
+        grid = grid[:, kept]
+
+    grid = np.round(grid, 3)
+    return {
+        'timestamps': np.round(timestamps, 3).tolist(),
+        'values': {reading_type: [None if value != value else value for value in grid[row].tolist()]
+                   for row, reading_type in enumerate(types)},
+        'source_points': source_points
+    }
+
+
+def chart_payload(series, resolution, bucket_seconds, max_points=CHART_MAX_POINTS, method='lttb'):
+    """The analytics response's 'series' object: columnar points plus how they were produced"""
+    method = method if method in DOWNSAMPLERS else 'lttb'
+    payload = columnar_series(series, max_points, method)
+    payload.update({
+        'resolution': resolution,
+        'bucket_seconds': bucket_seconds,
+        'points': len(payload['timestamps']),
+        'downsample': method if payload['source_points'] > len(payload['timestamps']) else None
+    })
+    return payload
@@ -0,0 +1,85 @@
+import asyncio
+import json
+import os
+import socket
+import logging
+
+from devices import DEFAULT_DEVICE_ID
+
+logger = logging.getLogger("ControlChannel")
+
+# Local change-notification channel between the Flask API and the serial bridge.
+# Datagrams on the loopback interface keep this dependency-free and portable
+# (the bridge also runs on Windows, where AF_UNIX datagram sockets are missing).
+CONTROL_CHANNEL_HOST = os.getenv('CONTROL_CHANNEL_HOST', '127.0.0.1')
+CONTROL_CHANNEL_PORT = int(os.getenv('CONTROL_CHANNEL_PORT', '5055'))
+
+
+def encode_change(control_name, control_value, device_id=DEFAULT_DEVICE_ID):
+    """Encode a control change as a datagram payload"""
+    return json.dumps({'device': device_id, 'control': control_name, 'value': control_value}).encode('utf-8')
+
+
+def decode_change(payload):
+    """Decode a datagram payload, returning (control_name, control_value, device_id) or None"""
+    try:
+        message = json.loads(payload.decode('utf-8'))
+        return message['control'], message['value'], int(message.get('device', DEFAULT_DEVICE_ID))
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+class ControlPublisher:
+    """Fire-and-forget publisher used by the API when a control is written"""
+
+    def __init__(self, host=CONTROL_CHANNEL_HOST, port=CONTROL_CHANNEL_PORT):
+        self.address = (host, port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+
+    def publish(self, control_name, control_value, device_id=DEFAULT_DEVICE_ID):
+        """Publish a change; returns False if nobody could be notified"""
+        try:
+            self.sock.sendto(encode_change(control_name, control_value, device_id), self.address)
+            return True
+        except OSError as e:
+            # The bridge may not be running; DB reconciliation will catch up
+            logger.debug(f"Could not publish control change: {e}")
+            return False
+
+    def close(self):
+        self.sock.close()
+
+
+class ControlChannelProtocol(asyncio.DatagramProtocol):
+    """Asyncio protocol that forwards each received change to a callback"""
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def datagram_received(self, data, addr):
+        change = decode_change(data)
+        if change:
+            self.callback([change])
+        else:
+            logger.warning(f"Ignoring malformed control change: {data!r}")
+
+
+class ControlSubscriber:
+    """Receiving end of the channel, owned by the serial bridge"""
+
+    def __init__(self, host=CONTROL_CHANNEL_HOST, port=CONTROL_CHANNEL_PORT):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.sock.setblocking(False)
+
+    async def attach(self, callback):
+        """Deliver changes to `callback` from the running event loop"""
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: ControlChannelProtocol(callback), sock=self.sock
+        )
+        return transport
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,240 @@
+import os
+import threading
+import time
+import logging
+from datetime import datetime
+
+import mysql.connector
+
+from devices import DEFAULT_DEVICE_ID
+from metrics import Counter, Gauge, Histogram
+from sensor_rollups import DEFAULT_TIMEFRAME, TIMEFRAMES, device_filter
+
+logger = logging.getLogger("ControlWrites")
+
+# Writes to the same control within this many seconds are folded into one
+CONTROL_WRITE_WINDOW = float(os.getenv('CONTROL_WRITE_WINDOW', '0.25'))
+# Delay before retrying a batch the database refused, doubling up to the max
+CONTROL_RETRY_DELAY = float(os.getenv('CONTROL_RETRY_DELAY', '1'))
+CONTROL_MAX_RETRY_DELAY = float(os.getenv('CONTROL_MAX_RETRY_DELAY', '30'))
+
+CONTROL_WRITES = Counter('control_writes_total', 'Control writes by outcome', ['outcome'])
+CONTROL_PENDING = Gauge('control_writes_pending', 'Coalesced control values waiting for a flush')
+CONTROL_FLUSH_SECONDS = Histogram('control_flush_seconds', 'Time to write one batch of control changes',
+                                  ['result'])
+
+HISTORY_TABLE_SQL = '''
+CREATE TABLE IF NOT EXISTS drone_controls_history (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    device_id INT NOT NULL DEFAULT 1,
+    control_name VARCHAR(50) NOT NULL,
+    control_value VARCHAR(255) NOT NULL,
+    source VARCHAR(20) NOT NULL DEFAULT 'dashboard',
+    write_count INT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3),
+    INDEX idx_history_time (updated_at, device_id, control_name, control_value)
+)
+'''
+
+UPDATE_SQL = "UPDATE drone_controls SET control_value = %s WHERE device_id = %s AND control_name = %s"
+
+HISTORY_INSERT_SQL = '''
+INSERT INTO drone_controls_history (device_id, control_name, control_value, source, write_count, updated_at)
+VALUES (%s, %s, %s, %s, %s, %s)
+'''
+
+# The index covers the time range and every grouped column, so this never reads table rows
+OPERATION_STATS_SQL = '''
+SELECT
+    control_name,
+    control_value,
+    COUNT(*) AS change_count,
+    SUM(write_count) AS write_count
+FROM
+    drone_controls_history
+WHERE
+    updated_at >= {window_start}
+    {device_filter}
+GROUP BY
+    control_name, control_value
+ORDER BY
+    control_name, change_count DESC
+'''
+
+
+def create_history_table(cursor):
+    cursor.execute(HISTORY_TABLE_SQL)
+
+
+def query_operation_stats(cursor, timeframe='24h', device_id=None):
+    """How often each control value was set in the timeframe (device_id=None covers all vehicles)"""
+    if timeframe not in TIMEFRAMES:
+        timeframe = DEFAULT_TIMEFRAME
+    _, window_start = TIMEFRAMES[timeframe]
+    cursor.execute(OPERATION_STATS_SQL.format(
+        window_start=window_start,
+        device_filter=device_filter('device_id', device_id)
+    ))
+    return cursor.fetchall()
+
+
+class ControlWriteBuffer:
+    """
+    Write-behind buffer for control changes.
+
+    set() only records the latest value per (device, control); a background
+    flusher writes everything that has been pending for `window` seconds in
+    one transaction: an UPDATE of the current-state row in drone_controls and
+    an appended drone_controls_history row per control. Presses that land in
+    the same window are folded into that one row (counted in write_count), so
+    a user mashing the steering buttons costs one commit per window instead
+    of one per press. If the database is down the latest values are kept and
+    retried with backoff; nothing older than them needs writing.
+    """
+
+    def __init__(self, connection_factory, window=CONTROL_WRITE_WINDOW, on_flush=None,
+                 retry_delay=CONTROL_RETRY_DELAY, max_retry_delay=CONTROL_MAX_RETRY_DELAY):
+        self.connection_factory = connection_factory
+        self.window = window
+        self.on_flush = on_flush  # called with the device ids of each written batch
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        # (device_id, control_name) -> [value, source, write_count, first_write, last_write]
+        self.pending = {}
+        self.lock = threading.Condition()
+        self.thread = None
+        self.running = False
+        self.failures = 0
+        self.stats = {
+            'accepted': 0,
+            'coalesced': 0,
+            'written': 0,
+            'batches': 0,
+            'flush_errors': 0
+        }
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._flush_thread, name="ControlWriteFlusher")
+        self.thread.daemon = True
+        self.thread.start()
+
+        CONTROL_PENDING.set_function(lambda: len(self.pending))
+        for outcome in ('accepted', 'coalesced', 'written'):
+            CONTROL_WRITES.labels(outcome).set_function(lambda outcome=outcome: self.stats[outcome])
+
+    def stop(self):
+        """Stop the flusher after trying once more to write what is pending"""
+        with self.lock:
+            self.running = False
+            self.lock.notify()
+        if self.thread:
+            self.thread.join(timeout=10.0)
+            self.thread = None
+
+    def set(self, control_name, control_value, device_id=DEFAULT_DEVICE_ID, source='dashboard'):
+        """Record a control change without blocking on the database"""
+        now = time.monotonic()
+        key = (device_id, control_name)
+        with self.lock:
+            self.stats['accepted'] += 1
+            entry = self.pending.get(key)
+            if entry is None:
+                self.pending[key] = [control_value, source, 1, now, datetime.now()]
+                self.lock.notify()
+            else:
+                self.stats['coalesced'] += 1
+                entry[0] = control_value
+                entry[1] = source
+                entry[2] += 1
+                entry[4] = datetime.now()
+
+    def pending_values(self, device_id):
+        """Values set for a device that aren't in drone_controls yet, as {control_name: value}"""
+        with self.lock:
+            return {name: entry[0] for (pending_device, name), entry in self.pending.items()
+                    if pending_device == device_id}
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['pending'] = len(self.pending)
+        return stats
+
+    def _flush_thread(self):
+        while True:
+            with self.lock:
+                while self.running:
+                    if self.pending:
+                        delay = self.window if not self.failures else min(
+                            self.retry_delay * 2 ** (self.failures - 1), self.max_retry_delay)
+                        due = min(entry[3] for entry in self.pending.values()) + delay
+                        remaining = due - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self.lock.wait(remaining)
+                    else:
+                        self.lock.wait()
+                batch = self.pending
+                self.pending = {}
+                running = self.running
+
+            if batch:
+                self._write(batch)
+            if not running:
+                break
+
+    def _write(self, batch):
+        if self._update(batch):
+            with self.lock:
+                self.failures = 0
+                self.stats['written'] += len(batch)
+                self.stats['batches'] += 1
+            if self.on_flush:
+                self.on_flush({device_id for device_id, _ in batch})
+            return
+        with self.lock:
+            self.failures += 1
+            self.stats['flush_errors'] += 1
+            # Keep the failed values unless the control was set again meanwhile
+            for key, entry in batch.items():
+                newer = self.pending.get(key)
+                if newer is None:
+                    self.pending[key] = entry
+                else:
+                    newer[2] += entry[2]
+                    newer[3] = entry[3]
+
+    def _update(self, batch):
+        conn = self.connection_factory()
+        if not conn:
+            return False
+        started = time.perf_counter()
+        try:
+            cursor = conn.cursor()
+            cursor.executemany(UPDATE_SQL, [
+                (value, device_id, control_name)
+                for (device_id, control_name), (value, *_) in batch.items()
+            ])
+            cursor.executemany(HISTORY_INSERT_SQL, [
+                (device_id, control_name, value, source, write_count, written_at)
+                for (device_id, control_name), (value, source, write_count, _, written_at) in batch.items()
+            ])
+            conn.commit()
+            cursor.close()
+            CONTROL_FLUSH_SECONDS.labels('ok').observe(time.perf_counter() - started)
+            logger.debug(f"Wrote {len(batch)} control changes")
+            return True
+        except mysql.connector.Error as err:
+            logger.error(f"Error writing control changes: {err}")
+            try:
+                conn.rollback()
+            except mysql.connector.Error:
+                pass  # The connection is gone; the transaction died with it
+            CONTROL_FLUSH_SECONDS.labels('error').observe(time.perf_counter() - started)
+            return False
+        finally:
+            conn.close()
@@ -2,60 +2,133 @@
 CREATE DATABASE IF NOT EXISTS drone_db;
 USE drone_db;
 
--- Create drone_controls table
+-- Vehicles managed by the serial bridge. serial_port is the port the bridge
+-- supervisor opens for the vehicle (SERIAL_PORTS overrides it).
+CREATE TABLE IF NOT EXISTS device (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    status VARCHAR(10),
+    serial_port VARCHAR(100)
+);
+
+INSERT IGNORE INTO device (id, name, status) VALUES (1, 'Drone 1', 'offline');
+
+-- Create drone_controls table, one row per device and control
 CREATE TABLE IF NOT EXISTS drone_controls (
     id INT AUTO_INCREMENT PRIMARY KEY,
+    device_id INT NOT NULL DEFAULT 1,
     control_name VARCHAR(50) NOT NULL,
     control_value VARCHAR(255) NOT NULL,
-    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    UNIQUE KEY uq_device_control (device_id, control_name)
 );
 
--- Insert default values if not already present
--- Drive motor control (forward, backward, stop)
-INSERT INTO drone_controls (control_name, control_value)
-SELECT 'drive_motor', 'stop'
-WHERE NOT EXISTS (SELECT 1 FROM drone_controls WHERE control_name = 'drive_motor');
-
--- Steering control (left, center, right)
-INSERT INTO drone_controls (control_name, control_value)
-SELECT 'steering', 'center'
-WHERE NOT EXISTS (SELECT 1 FROM drone_controls WHERE control_name = 'steering');
-
--- Headlights control
-INSERT INTO drone_controls (control_name, control_value)
-SELECT 'headlights', 'off'
-WHERE NOT EXISTS (SELECT 1 FROM drone_controls WHERE control_name = 'headlights');
+-- Insert default values for the first device if not already present
+INSERT IGNORE INTO drone_controls (device_id, control_name, control_value) VALUES
+    (1, 'drive_motor', 'stop'),      -- Drive motor control (forward, backward, stop)
+    (1, 'steering', 'center'),       -- Steering control (left, center, right)
+    (1, 'headlights', 'off'),        -- Headlights control
+    (1, 'lcd_message', 'Hello Drone!');  -- LCD message
 
--- LCD message
-INSERT INTO drone_controls (control_name, control_value)
-SELECT 'lcd_message', 'Hello Drone!'
-WHERE NOT EXISTS (SELECT 1 FROM drone_controls WHERE control_name = 'lcd_message');
+-- Every control change, appended in batches by the API and serial bridge
+-- (control_writes.py). Presses of one control within the coalescing window
+-- share a row; write_count says how many there were. The index covers the
+-- operation stats query so it never reads table rows.
+CREATE TABLE IF NOT EXISTS drone_controls_history (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    device_id INT NOT NULL DEFAULT 1,
+    control_name VARCHAR(50) NOT NULL,
+    control_value VARCHAR(255) NOT NULL,
+    source VARCHAR(20) NOT NULL DEFAULT 'dashboard',  -- dashboard or arduino
+    write_count INT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3),
+    INDEX idx_history_time (updated_at, device_id, control_name, control_value)
+);
 
 -- Create a sample database user with appropriate permissions
 -- GRANT ALL PRIVILEGES ON drone_db.* TO 'drone_user'@'localhost' IDENTIFIED BY 'your_password';
 -- FLUSH PRIVILEGES;
 
+-- Raw readings are range-partitioned by day so expired days can be dropped
+-- cheaply. The serial bridge (sensor_storage.py) splits pmax into daily
+-- partitions ahead of time and drops them after RAW_RETENTION_DAYS. The
+-- partition column must be part of the primary key.
 CREATE TABLE IF NOT EXISTS sensor_readings (
-    id INT AUTO_INCREMENT PRIMARY KEY,
+    id INT AUTO_INCREMENT,
+    device_id INT NOT NULL DEFAULT 1,
     reading_type VARCHAR(50) NOT NULL,
     reading_value FLOAT NOT NULL,
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, timestamp),
     INDEX idx_reading_type (reading_type),
     INDEX idx_timestamp (timestamp)
+)
+PARTITION BY RANGE (UNIX_TIMESTAMP(timestamp)) (
+    PARTITION pmax VALUES LESS THAN MAXVALUE
+);
+
+-- Compact layout (SENSOR_STORAGE_LAYOUT=compact): one narrow row per sample
+-- with a smallint type id instead of the repeated type name. Clustered on
+-- (timestamp, device_id, type_id, seq) so time-range scans need no secondary
+-- index; seq numbers samples of one type and device within the same second.
+CREATE TABLE IF NOT EXISTS sensor_types (
+    id SMALLINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+    name VARCHAR(50) NOT NULL,
+    UNIQUE KEY uq_sensor_type_name (name)
+);
+
+INSERT IGNORE INTO sensor_types (name) VALUES ('DIST'), ('LIGHT');
+
+CREATE TABLE IF NOT EXISTS sensor_samples (
+    timestamp TIMESTAMP NOT NULL,
+    device_id SMALLINT UNSIGNED NOT NULL DEFAULT 1,
+    type_id SMALLINT UNSIGNED NOT NULL,
+    seq SMALLINT UNSIGNED NOT NULL DEFAULT 0,
+    value FLOAT NOT NULL,
+    PRIMARY KEY (timestamp, device_id, type_id, seq)
+)
+PARTITION BY RANGE (UNIX_TIMESTAMP(timestamp)) (
+    PARTITION pmax VALUES LESS THAN MAXVALUE
 );
 
+-- Minute and hour rollups of the raw readings, maintained incrementally by the
+-- serial bridge in the same transaction as the raw inserts
+CREATE TABLE IF NOT EXISTS sensor_rollup_minute (
+    device_id INT NOT NULL DEFAULT 1,
+    reading_type VARCHAR(50) NOT NULL,
+    bucket_start DATETIME NOT NULL,
+    reading_count INT NOT NULL,
+    value_sum DOUBLE NOT NULL,
+    value_min FLOAT NOT NULL,
+    value_max FLOAT NOT NULL,
+    value_sumsq DOUBLE NOT NULL,
+    PRIMARY KEY (bucket_start, device_id, reading_type)
+);
+
+CREATE TABLE IF NOT EXISTS sensor_rollup_hour (
+    device_id INT NOT NULL DEFAULT 1,
+    reading_type VARCHAR(50) NOT NULL,
+    bucket_start DATETIME NOT NULL,
+    reading_count INT NOT NULL,
+    value_sum DOUBLE NOT NULL,
+    value_min FLOAT NOT NULL,
+    value_max FLOAT NOT NULL,
+    value_sumsq DOUBLE NOT NULL,
+    PRIMARY KEY (bucket_start, device_id, reading_type)
+);
+
+-- Hourly averages now read from the materialized hour rollup instead of
+-- re-aggregating the raw table
 CREATE OR REPLACE VIEW hourly_sensor_averages AS
 SELECT 
+    device_id,
     reading_type,
-    DATE_FORMAT(timestamp, '%Y-%m-%d %H:00:00') AS hour_bucket,
-    AVG(reading_value) AS average_value,
-    MIN(reading_value) AS min_value,
-    MAX(reading_value) AS max_value,
-    COUNT(*) AS reading_count
+    DATE_FORMAT(bucket_start, '%Y-%m-%d %H:00:00') AS hour_bucket,
+    value_sum / reading_count AS average_value,
+    value_min AS min_value,
+    value_max AS max_value,
+    reading_count
 FROM 
-    sensor_readings
-GROUP BY 
-    reading_type, hour_bucket
+    sensor_rollup_hour
 ORDER BY 
-    hour_bucket DESC, reading_type;
-
+    hour_bucket DESC, device_id, reading_type;
@@ -0,0 +1,96 @@
+import os
+import logging
+
+logger = logging.getLogger("Devices")
+
+# Vehicles are rows of the `device` table. Single-vehicle setups (and rows
+# written before device ids existed) belong to DEFAULT_DEVICE_ID.
+DEFAULT_DEVICE_ID = int(os.getenv('DEFAULT_DEVICE_ID', '1'))
+DEFAULT_DEVICE_NAME = os.getenv('DEFAULT_DEVICE_NAME', 'Drone 1')
+
+DEFAULT_CONTROLS = [
+    ('drive_motor', 'stop'),
+    ('steering', 'center'),
+    ('headlights', 'off'),
+    ('lcd_message', 'Hello Drone!')
+]
+
+
+def parse_device_id(value, default=DEFAULT_DEVICE_ID):
+    """Device id from a request argument, or `default` when missing/invalid"""
+    try:
+        return int(value) if value not in (None, '') else default
+    except (TypeError, ValueError):
+        return default
+
+
+def parse_serial_ports(spec):
+    """Parse SERIAL_PORTS, e.g. "1=/dev/ttyUSB0,2=/dev/ttyUSB1", into {device_id: port}"""
+    ports = {}
+    for entry in (spec or '').split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        device_id, sep, port = entry.partition('=')
+        if not sep or not port.strip():
+            logger.warning(f"Ignoring malformed SERIAL_PORTS entry: {entry!r}")
+            continue
+        ports[int(device_id)] = port.strip()
+    return ports
+
+
+def create_device_tables(cursor):
+    """Create the device table and the per-device controls table with the default vehicle"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS device (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(100) NOT NULL,
+        status VARCHAR(10),
+        serial_port VARCHAR(100)
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS drone_controls (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        device_id INT NOT NULL DEFAULT 1,
+        control_name VARCHAR(50) NOT NULL,
+        control_value VARCHAR(255) NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        UNIQUE KEY uq_device_control (device_id, control_name)
+    )
+    ''')
+    cursor.execute(
+        "INSERT IGNORE INTO device (id, name, status) VALUES (%s, %s, %s)",
+        (DEFAULT_DEVICE_ID, DEFAULT_DEVICE_NAME, 'offline')
+    )
+    ensure_device_controls(cursor, DEFAULT_DEVICE_ID)
+
+
+def ensure_device_controls(cursor, device_id):
+    """Give a device the default control rows it doesn't have yet"""
+    cursor.executemany(
+        "INSERT IGNORE INTO drone_controls (device_id, control_name, control_value) VALUES (%s, %s, %s)",
+        [(device_id, name, value) for name, value in DEFAULT_CONTROLS]
+    )
+
+
+def load_devices(cursor):
+    """All devices as dicts (id, name, status, serial_port), `cursor` must be a dictionary cursor"""
+    cursor.execute("SELECT id, name, status, serial_port FROM device ORDER BY id")
+    return cursor.fetchall()
+
+
+def register_device(cursor, device_id, serial_port):
+    """Make sure a bridged device exists, recording the port it is attached to"""
+    cursor.execute(
+        """
+        INSERT INTO device (id, name, status, serial_port) VALUES (%s, %s, 'offline', %s)
+        ON DUPLICATE KEY UPDATE serial_port = VALUES(serial_port)
+        """,
+        (device_id, f"Drone {device_id}", serial_port)
+    )
+    ensure_device_controls(cursor, device_id)
+
+
+def set_device_status(cursor, device_id, status):
+    cursor.execute("UPDATE device SET status = %s WHERE id = %s", (status, device_id))
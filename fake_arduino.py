@@ -0,0 +1,302 @@
+import os
+import pty
+import random
+import select
+import threading
+import time
+import tty
+import logging
+
+from protocol import (ACK_OK, FRAME_ACK, FRAME_COMMAND, FRAME_REQUEST, FRAME_SENSORS, FRAME_STATUS,
+                      FRAME_TEXT, NEGOTIATE_ACCEPT, NEGOTIATE_COMMAND, FrameDecoder, encode_frame,
+                      encode_sensors)
+
+logger = logging.getLogger("FakeArduino")
+
+# Messages Firmware.ino sends to the bridge on piSerial...
+SENSOR_LINE = "SENSORS:DIST={distance};LIGHT={light}"
+OBSTACLE_LINE = "STATUS:DRIVE=stop;REASON=obstacle;DISTANCE={distance}"
+STATUS_LINE = "STATUS:DRIVE={drive};STEER={steer};LIGHTS={lights}"
+REQUEST_LINE = "REQUEST:CONTROLS"
+BOOT_LINE = "STATUS:BOOT=complete"
+# ...and the debug lines it prints on the USB port for them
+SENSOR_ECHO = "Sending: "
+STATUS_ECHO = "Reporting status: "
+OBSTACLE_DEBUG = "Safety stop triggered! Obstacle detected at {distance}cm"
+REQUEST_DEBUG = "Requesting control values from serial bridge"
+PONG_DEBUG = "Ping received, responded with PONG"
+BOOT_DEBUG = "Starting Remote Control Drone"
+ACK_LINE = "Command received: {command}"
+
+# Commands that change state reported back in a STATUS line, like the firmware
+STATUS_COMMANDS = {'DRIVE': 'drive', 'STEER': 'steer', 'LIGHTS': 'lights'}
+
+PORTS = ('usb', 'pi')
+
+
+class FakeArduino:
+    """
+    Simulated drone Arduino for benchmarks and local runs without hardware,
+    with a pseudo-terminal for each of the firmware's two serial ports:
+    `port` is the USB port (debug echoes such as "Sending: SENSORS:..." and
+    the "Command received: ..." acks) and `pi_port` is piSerial (the bare
+    messages, including REQUEST:CONTROLS and PONG). Point SERIAL_PORT at
+    either; commands are accepted on both.
+
+    Emits sensor lines at `sensor_rate` per second (0 = as fast as the reader
+    takes them; may be changed while running), an obstacle STATUS every `obstacle_every` sensor lines and a
+    REQUEST:CONTROLS every `request_every` sensor lines (0 disables either).
+    Every command is recorded with its arrival time. Like the firmware, the
+    port a PROTO:BIN1 arrives on switches to binary frames (acking commands
+    by sequence number) while the other stays ASCII, and a PROTO:BIN1 sent as
+    text renegotiates. `noise_every` injects a burst of line noise on the USB
+    port every that many sensor lines.
+    """
+
+    def __init__(self, sensor_rate=2.0, obstacle_every=0, request_every=0, noise_every=0, seed=None):
+        self.sensor_rate = sensor_rate
+        self.obstacle_every = obstacle_every
+        self.request_every = request_every
+        self.noise_every = noise_every
+        self.random = random.Random(seed)
+        self.binary_port = None  # 'usb' or 'pi' once a bridge negotiated frames there
+        self.seq = 0
+        self.last_command_seq = 0
+
+        self.master_fds = {}
+        self.slave_fds = {}
+        self.attached = set()  # ports a bridge has written to
+        self.port = None
+        self.pi_port = None
+        self.running = False
+        self.threads = []
+        self.write_lock = threading.Lock()
+
+        self.state = {'drive': 'stop', 'steer': 'center', 'lights': 'off'}
+        self.distance = 214
+        self.light = 63
+
+        self.commands = []
+        self.command_cond = threading.Condition()
+        self.counts = {'sensors': 0, 'status': 0, 'request': 0, 'ack': 0}
+
+    @property
+    def binary(self):
+        return self.binary_port is not None
+
+    def start(self):
+        names = {}
+        for name in PORTS:
+            self.master_fds[name], self.slave_fds[name] = pty.openpty()
+            # No echo or newline translation, like a real serial device
+            tty.setraw(self.slave_fds[name])
+            os.set_blocking(self.master_fds[name], False)
+            names[name] = os.ttyname(self.slave_fds[name])
+        self.port, self.pi_port = names['usb'], names['pi']
+        self.running = True
+        for target in (self._emit_thread, self._command_thread):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logger.info(f"Fake Arduino on {self.port} (USB) and {self.pi_port} (piSerial)")
+        return self.port
+
+    def stop(self):
+        self.running = False
+        for thread in self.threads:
+            thread.join(timeout=1.0)
+        self.threads = []
+        for fd in (*self.master_fds.values(), *self.slave_fds.values()):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def _write(self, port, data):
+        """Write to a port; waits for a bridge to read it, but drops what no bridge is reading"""
+        fd = self.master_fds[port]
+        view = memoryview(data)
+        while view:
+            try:
+                written = os.write(fd, view)
+            except BlockingIOError:
+                if port not in self.attached:
+                    return  # Lost, like bytes sent on a port with nothing listening
+                select.select([], [fd], [], 0.2)
+                continue
+            view = view[written:]
+
+    def _write_text(self, port, line):
+        self._write(port, (line + "\r\n").encode('utf-8'))
+
+    def _frame(self, line):
+        """The binary frame the firmware sends instead of an ASCII line"""
+        for echo in (SENSOR_ECHO, STATUS_ECHO):
+            if line.startswith(echo):
+                line = line[len(echo):]
+        self.seq = (self.seq + 1) & 0xFF
+        if line.startswith("SENSORS:"):
+            fields = (field.split('=') for field in line[len("SENSORS:"):].split(';'))
+            return encode_frame(FRAME_SENSORS, self.seq, encode_sensors({name: int(value) for name, value in fields}))
+        for frame_type, prefix in ((FRAME_STATUS, "STATUS:"), (FRAME_REQUEST, "REQUEST:")):
+            if line.startswith(prefix):
+                return encode_frame(frame_type, self.seq, line[len(prefix):].encode('utf-8'))
+        return encode_frame(FRAME_TEXT, self.seq, line.encode('utf-8'))
+
+    def _debug(self, line):
+        """A USB debug line; left out while a bridge there reads frames"""
+        if self.binary_port != 'usb':
+            self._write_text('usb', line)
+
+    def write_line(self, line, kind=None, debug=None):
+        """
+        Send a message the way sendMessage() in the firmware does: a frame on
+        the binary port, the line on piSerial unless that is the binary port,
+        and the `debug` line on USB
+        """
+        with self.write_lock:
+            if self.binary_port:
+                self._write(self.binary_port, self._frame(line))
+            if self.binary_port != 'pi':
+                self._write_text('pi', line)
+            if debug:
+                self._debug(debug)
+            if kind:
+                self.counts[kind] += 1
+
+    def write_port_line(self, line, kind=None):
+        """Send a line exactly as a bridge on the USB port reads it, e.g. a recorded one"""
+        with self.write_lock:
+            self._write('usb', self._frame(line) if self.binary_port == 'usb' else (line + "\r\n").encode('utf-8'))
+            if kind:
+                self.counts[kind] += 1
+
+    def write_noise(self):
+        with self.write_lock:
+            self._write('usb', bytes(self.random.randrange(256) for _ in range(self.random.randint(1, 12))))
+
+    def next_reading(self):
+        """Drift the simulated distance/light readings a little each sample"""
+        self.distance = min(400, max(5, self.distance + self.random.randint(-3, 3)))
+        self.light = min(100, max(0, self.light + self.random.randint(-2, 2)))
+        return self.distance, self.light
+
+    def wait_for_command(self, command, timeout=5.0, since=0):
+        """Return the arrival time of `command` (looking at entries from index `since`), or None"""
+        deadline = time.monotonic() + timeout
+        with self.command_cond:
+            while True:
+                for received_at, received in self.commands[since:]:
+                    if received == command:
+                        return received_at
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.command_cond.wait(remaining)
+
+    def _emit_thread(self):
+        next_at = time.monotonic()
+        sent = 0
+        try:
+            self.write_line(BOOT_LINE, 'status', debug=BOOT_DEBUG)
+            while self.running:
+                distance, light = self.next_reading()
+                line = SENSOR_LINE.format(distance=distance, light=light)
+                self.write_line(line, 'sensors', debug=SENSOR_ECHO + line)
+                sent += 1
+                if self.obstacle_every and sent % self.obstacle_every == 0:
+                    distance = self.random.randint(5, 19)
+                    self.write_line(OBSTACLE_LINE.format(distance=distance), 'status',
+                                    debug=OBSTACLE_DEBUG.format(distance=distance))
+                if self.request_every and sent % self.request_every == 0:
+                    self.write_line(REQUEST_LINE, 'request', debug=REQUEST_DEBUG)
+                if self.noise_every and sent % self.noise_every == 0:
+                    self.write_noise()
+                # sensor_rate may be changed while running
+                if self.sensor_rate > 0:
+                    next_at += 1.0 / self.sensor_rate
+                    time.sleep(max(0, next_at - time.monotonic()))
+                else:
+                    next_at = time.monotonic()
+        except OSError:
+            # Ports closed by stop()
+            pass
+
+    def _command_thread(self):
+        ports = {fd: name for name, fd in self.master_fds.items()}
+        buffers = dict.fromkeys(PORTS, b'')
+        decoders = {name: FrameDecoder() for name in PORTS}
+        try:
+            while self.running:
+                readable, _, _ = select.select(list(ports), [], [], 0.2)
+                for fd in readable:
+                    name = ports[fd]
+                    chunk = os.read(fd, 4096)
+                    if not chunk:
+                        return
+                    received_at = time.monotonic()
+                    self.attached.add(name)
+                    # Byte by byte like receiveFrom() in the firmware, since a
+                    # PROTO:BIN1 switches the rest of the chunk to frames
+                    for byte in chunk:
+                        framed = self.binary_port == name
+                        if framed:
+                            for frame in decoders[name].feed(bytes((byte,))):
+                                if frame.type == FRAME_COMMAND:
+                                    self._handle_frame(frame, name, received_at)
+                        if byte != ord('\n'):
+                            buffers[name] = buffers[name] + bytes((byte,))
+                            if framed:
+                                buffers[name] = buffers[name][-(len(NEGOTIATE_COMMAND) + 1):]
+                            continue
+                        command = buffers[name].decode('utf-8', errors='replace').strip()
+                        buffers[name] = b''
+                        if framed and command.endswith(NEGOTIATE_COMMAND):
+                            command = NEGOTIATE_COMMAND
+                        elif framed:
+                            continue
+                        if command:
+                            self._handle_command(command, name, received_at)
+                        if command == NEGOTIATE_COMMAND:
+                            decoders[name] = FrameDecoder()
+        except OSError:
+            pass
+
+    def _handle_frame(self, frame, port, received_at):
+        with self.write_lock:
+            self._write(port, encode_frame(FRAME_ACK, frame.seq, bytes([ACK_OK])))
+            self.counts['ack'] += 1
+        # A retransmission of a command we already ran is only acked again
+        if frame.seq != self.last_command_seq:
+            self.last_command_seq = frame.seq
+            self._handle_command(frame.payload.decode('utf-8', errors='replace'), port, received_at)
+
+    def _handle_command(self, command, port, received_at):
+        with self.command_cond:
+            self.commands.append((received_at, command))
+            self.command_cond.notify_all()
+
+        with self.write_lock:
+            if self.binary_port != 'usb':
+                self._write_text('usb', ACK_LINE.format(command=command))
+                self.counts['ack'] += 1
+        if command == NEGOTIATE_COMMAND:
+            with self.write_lock:
+                if self.binary_port == port:
+                    # Ends any frame the bridge is still reading as text
+                    self._write(port, b"\r\n")
+                self._write_text(port, NEGOTIATE_ACCEPT)
+                self.binary_port = port
+                self.seq = 0
+                self.last_command_seq = 0
+        elif command.startswith("GET_ALL"):
+            self.write_line(REQUEST_LINE, 'request', debug=REQUEST_DEBUG)
+        elif command.startswith("PING"):
+            self.write_line("PONG", debug=PONG_DEBUG)
+        else:
+            name, _, value = command.partition(':')
+            key = STATUS_COMMANDS.get(name)
+            if key and self.state[key] != value.strip():
+                self.state[key] = value.strip()
+                line = STATUS_LINE.format(**self.state)
+                self.write_line(line, 'status', debug=STATUS_ECHO + line)
@@ -0,0 +1,126 @@
+import gzip
+import hashlib
+import os
+import threading
+import zlib
+
+from flask import Response, current_app, request
+
+from metrics import Counter
+
+# Bodies smaller than this aren't worth a compression pass
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '512'))
+COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', '6'))
+COMPRESSIBLE_TYPES = ('application/json', 'text/html', 'text/plain', 'text/css', 'application/javascript')
+
+# Content coding -> ETag suffix; a strong validator must differ per coding
+ENCODINGS = ('gzip', 'deflate')
+ETAG_SUFFIXES = {
+    None: '',
+    'gzip': '-gz',
+    'deflate': '-df'
+}
+
+HTTP_ENCODED = Counter('http_response_encoding_total', 'Responses sent by content coding', ['encoding'])
+HTTP_NOT_MODIFIED = Counter('http_not_modified_total', 'Conditional GETs answered with 304 Not Modified')
+
+
+def encode(body, encoding):
+    if encoding == 'gzip':
+        # mtime=0 keeps the output (and so its ETag) identical between runs
+        return gzip.compress(body, compresslevel=COMPRESS_LEVEL, mtime=0)
+    return zlib.compress(body, COMPRESS_LEVEL)
+
+
+def negotiate_encoding(body_size):
+    """The best coding the client accepts (q-values honoured) for a body of this size, or None"""
+    if body_size < COMPRESS_MIN_SIZE:
+        return None
+    return request.accept_encodings.best_match(ENCODINGS)
+
+
+def matching_etag(etag, if_none_match):
+    """The tag in the client's If-None-Match naming any coding of `etag`, or None"""
+    if if_none_match.star_tag:
+        return etag
+    for suffix in ETAG_SUFFIXES.values():
+        if if_none_match.contains(etag + suffix):
+            return etag + suffix
+    return None
+
+
+def not_modified(etag):
+    """
+    A 304 if the client already has version `etag`, else None. Lets a route
+    whose version is cheap to know skip loading the body altogether.
+    """
+    matched = matching_etag(etag, request.if_none_match)
+    if matched is None:
+        return None
+    HTTP_NOT_MODIFIED.inc()
+    response = Response(status=304)
+    response.set_etag(matched)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+class CachedResponse:
+    """
+    A JSON response serialized once, with a strong ETag (over its bytes
+    unless the caller knows a version for it) and each compressed variant
+    built on first use. Stored in the response cache, so a hit costs neither
+    a query nor a dumps() nor a gzip pass.
+    """
+
+    def __init__(self, payload, etag=None):
+        self.payload = payload
+        self.body = current_app.json.dumps(payload, separators=(',', ':')).encode() + b'\n'
+        self.etag = etag or hashlib.sha1(self.body).hexdigest()[:20]
+        self.variants = {None: self.body}
+        self.lock = threading.Lock()
+
+    def variant(self, encoding):
+        with self.lock:
+            body = self.variants.get(encoding)
+            if body is None:
+                body = self.variants[encoding] = encode(self.body, encoding)
+        return body
+
+    def response(self):
+        """200 with the negotiated coding, or 304 if the client already has this version"""
+        encoding = negotiate_encoding(len(self.body))
+        etag = self.etag + ETAG_SUFFIXES[encoding]
+        if matching_etag(self.etag, request.if_none_match) is not None:
+            HTTP_NOT_MODIFIED.inc()
+            response = Response(status=304)
+        else:
+            response = Response(self.variant(encoding), mimetype='application/json')
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+                HTTP_ENCODED.labels(encoding).inc()
+        response.set_etag(etag)
+        # Browsers revalidate with If-None-Match instead of reusing it unchecked
+        response.headers['Cache-Control'] = 'no-cache'
+        response.vary.add('Accept-Encoding')
+        return response
+
+
+def cached_response(payload, etag=None):
+    """Wrap a loader's result for the response cache; None (a failed load) stays None"""
+    return CachedResponse(payload, etag) if payload is not None else None
+
+
+def compress_response(response):
+    """after_request hook: gzip/deflate any other sizeable text or JSON response the client accepts"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    body = response.get_data()
+    encoding = negotiate_encoding(len(body))
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.set_data(encode(body, encoding))
+        response.headers['Content-Encoding'] = encoding
+        HTTP_ENCODED.labels(encoding).inc()
+    return response
@@ -0,0 +1,268 @@
+import os
+import threading
+import time
+import logging
+from datetime import datetime
+
+import mysql.connector
+import numpy as np
+
+from sensor_layout import get_layout
+from sensor_rollups import BUCKET_SECONDS
+
+logger = logging.getLogger("LiveSeries")
+
+# Samples kept per (device, reading type); 1h at 10 readings/s by default
+LIVE_SERIES_CAPACITY = int(os.getenv('LIVE_SERIES_CAPACITY', '36000'))
+# Dashboard timeframes answered from memory, with their window in seconds
+LIVE_TIMEFRAMES = {
+    '1h': 3600
+}
+# A device whose newest sample is older than this many sensor intervals is
+# treated as no longer being recorded, and its windows come from the database
+SENSOR_INTERVAL = float(os.getenv('SENSOR_INTERVAL', '2.0'))  # Firmware.ino commandCheckInterval
+LIVE_SERIES_STALE_AFTER = float(os.getenv('LIVE_SERIES_STALE_AFTER', '5')) * SENSOR_INTERVAL
+PERCENTILES = (50, 90, 99)
+
+
+class RingSeries:
+    """
+    Fixed-size ring of (epoch seconds, value) samples in two float64 arrays.
+    Samples are kept in time order (a late sample is stamped with the newest
+    time), so the stored part is at most two sorted segments and a window is
+    found with searchsorted instead of a scan.
+    """
+
+    def __init__(self, capacity=LIVE_SERIES_CAPACITY):
+        self.times = np.empty(capacity)
+        self.values = np.empty(capacity)
+        self.capacity = capacity
+        self.head = 0  # next slot to write
+        self.size = 0
+
+    def append(self, timestamp, value):
+        if self.size and timestamp < self.newest():
+            timestamp = self.newest()
+        self.times[self.head] = timestamp
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def newest(self):
+        return self.times[self.head - 1]
+
+    def oldest(self):
+        return self.times[self.head if self.size == self.capacity else 0]
+
+    def segments(self):
+        """The stored samples as (times, values) views, oldest segment first"""
+        if self.size < self.capacity:
+            return [(self.times[:self.size], self.values[:self.size])]
+        return [(self.times[self.head:], self.values[self.head:]), (self.times[:self.head], self.values[:self.head])]
+
+    def window(self, since):
+        """Copies of the samples at or after `since`, in time order"""
+        times, values = [], []
+        for segment_times, segment_values in self.segments():
+            start = np.searchsorted(segment_times, since)
+            times.append(segment_times[start:])
+            values.append(segment_values[start:])
+        return np.concatenate(times), np.concatenate(values)
+
+    def load(self, times, values):
+        """Merge older samples (e.g. from the database) in front of the stored ones"""
+        stored_times, stored_values = self.window(-np.inf)
+        if len(stored_times):
+            keep = times < stored_times[0]
+            times, values = times[keep], values[keep]
+        times = np.concatenate((times, stored_times))[-self.capacity:]
+        values = np.concatenate((values, stored_values))[-self.capacity:]
+        self.size = len(times)
+        self.times[:self.size] = times
+        self.values[:self.size] = values
+        self.head = self.size % self.capacity
+
+
+def bucket_stats(times, values, bucket_seconds):
+    """Per-bucket (start, count, mean, min, max) for time-ordered samples, buckets aligned to the epoch"""
+    # Bucket boundaries come from a binary search per bucket rather than a pass over every sample
+    edges = np.arange(times[0] // bucket_seconds, times[-1] // bucket_seconds + 1) * bucket_seconds
+    starts = np.searchsorted(times, edges)
+    counts = np.diff(np.append(starts, len(times)))
+    filled = counts > 0
+    edges, starts, counts = edges[filled], starts[filled], counts[filled]
+    means = np.add.reduceat(values, starts) / counts
+    return (edges, counts, means,
+            np.minimum.reduceat(values, starts), np.maximum.reduceat(values, starts))
+
+
+def window_summary(reading_type, values):
+    stats = {
+        'reading_type': reading_type,
+        'avg_value': float(values.mean()),
+        'min_value': float(values.min()),
+        'max_value': float(values.max()),
+        'stddev_value': float(values.std()),
+        'reading_count': len(values)
+    }
+    for percentile, value in zip(PERCENTILES, np.percentile(values, PERCENTILES).tolist()):
+        stats[f'p{percentile}_value'] = value
+    return stats
+
+
+class TimeSeriesStore:
+    """
+    In-process store of recent sensor readings, one RingSeries per
+    (device, reading type), for windowed statistics without MySQL.
+
+    A device's window is only answered from memory when the store holds all of
+    it: samples have been recorded (or loaded) without a gap since before the
+    window start, the newest one is recent, and the ring hasn't wrapped past
+    it. Otherwise callers fall back to the database.
+    """
+
+    def __init__(self, capacity=LIVE_SERIES_CAPACITY, stale_after=LIVE_SERIES_STALE_AFTER):
+        self.capacity = capacity
+        self.stale_after = stale_after
+        self.series = {}  # (device_id, reading_type) -> RingSeries
+        self.covered_since = {}  # device_id -> epoch seconds from which every reading was recorded
+        self.last_sample = {}  # device_id -> epoch seconds of the newest reading
+        self.lock = threading.Lock()
+
+    def add_readings(self, readings, timestamp=None, device_id=1):
+        """Record one line of readings, {reading_type: value}, taken at `timestamp` (epoch seconds)"""
+        timestamp = timestamp or time.time()
+        with self.lock:
+            last = self.last_sample.get(device_id)
+            if last is None or timestamp - last > self.stale_after:
+                # Readings during the gap may have gone to the database without us
+                self.covered_since[device_id] = timestamp
+            self.last_sample[device_id] = timestamp if last is None else max(timestamp, last)
+            for reading_type, value in readings.items():
+                series = self.series.get((device_id, reading_type))
+                if series is None:
+                    series = self.series[(device_id, reading_type)] = RingSeries(self.capacity)
+                series.append(timestamp, float(value))
+
+    def load(self, rows, since):
+        """Load (reading_type, value, epoch seconds, device_id) rows recorded from `since` on"""
+        grouped = {}
+        for reading_type, value, timestamp, device_id in rows:
+            grouped.setdefault((device_id, reading_type), []).append((timestamp, value))
+        with self.lock:
+            for key, samples in grouped.items():
+                samples = np.array(sorted(samples), dtype=float)
+                series = self.series.get(key)
+                if series is None:
+                    series = self.series[key] = RingSeries(self.capacity)
+                series.load(samples[:, 0], samples[:, 1])
+                device_id = key[0]
+                self.last_sample[device_id] = max(samples[-1, 0], self.last_sample.get(device_id, -np.inf))
+            for device_id in {key[0] for key in grouped} | set(self.covered_since):
+                self.covered_since[device_id] = min(self.covered_since.get(device_id, since), since)
+
+    def covers(self, seconds, device_id=None, now=None):
+        """Whether the last `seconds` of the device (or of every known device) are all in memory"""
+        now = now or time.time()
+        since = now - seconds
+        with self.lock:
+            devices = [device_id] if device_id is not None else list(self.covered_since)
+            if not devices:
+                return False
+            for device in devices:
+                if self.covered_since.get(device, np.inf) > since:
+                    return False
+                if now - self.last_sample.get(device, -np.inf) > self.stale_after:
+                    return False
+            return all(series.size < series.capacity or series.oldest() <= since
+                       for (device, _), series in self.series.items() if device in devices)
+
+    def windows(self, seconds, device_id=None, now=None):
+        """{reading_type: (times, values)} for the last `seconds`, merging devices when device_id is None"""
+        since = (now or time.time()) - seconds
+        parts = {}
+        with self.lock:
+            for (device, reading_type), series in self.series.items():
+                if device_id is None or device == device_id:
+                    parts.setdefault(reading_type, []).append(series.window(since))
+        windows = {}
+        for reading_type, samples in parts.items():
+            times = np.concatenate([part[0] for part in samples])
+            values = np.concatenate([part[1] for part in samples])
+            if len(samples) > 1:
+                order = np.argsort(times, kind='stable')
+                times, values = times[order], values[order]
+            if len(times):
+                windows[reading_type] = (times, values)
+        return windows
+
+    def summary(self, seconds, device_id=None, now=None):
+        """Count, mean, min, max, standard deviation and percentiles per reading type"""
+        return [window_summary(reading_type, values)
+                for reading_type, (_, values) in sorted(self.windows(seconds, device_id, now).items())]
+
+    def downsample(self, seconds, bucket_seconds, device_id=None, now=None):
+        """{reading_type: (bucket starts, counts, means, mins, maxes)} arrays for the last `seconds`"""
+        return {reading_type: bucket_stats(times, values, bucket_seconds)
+                for reading_type, (times, values) in self.windows(seconds, device_id, now).items()}
+
+    def analytics(self, timeframe, device_id=None, resolution='minute'):
+        """
+        (summary, {reading_type: (times, values)}) for a timeframe in
+        LIVE_TIMEFRAMES, or None if memory doesn't cover it. The series are
+        the raw samples for resolution 'raw', else per-minute or per-hour
+        averages stamped with the bucket start.
+        """
+        if timeframe not in LIVE_TIMEFRAMES:
+            return None
+        seconds = LIVE_TIMEFRAMES[timeframe]
+        now = time.time()
+        if not self.covers(seconds, device_id, now):
+            return None
+        summary = []
+        series = {}
+        for reading_type, (times, values) in sorted(self.windows(seconds, device_id, now).items()):
+            summary.append(window_summary(reading_type, values))
+            if resolution == 'raw':
+                series[reading_type] = (times, values)
+            else:
+                starts, _, means, _, _ = bucket_stats(times, values, BUCKET_SECONDS.get(resolution, 60))
+                series[reading_type] = (starts, means)
+        return summary, series
+
+    def stats(self):
+        with self.lock:
+            return {
+                'series': len(self.series),
+                'samples': sum(series.size for series in self.series.values()),
+                'capacity': self.capacity,
+                'devices': {str(device): datetime.fromtimestamp(since).isoformat(timespec='seconds')
+                            for device, since in self.covered_since.items()}
+            }
+
+
+def warm_store(store, connection_factory, seconds=max(LIVE_TIMEFRAMES.values()), layout=None):
+    """Fill the store with the last `seconds` of raw readings from the database; returns the row count"""
+    layout = layout or get_layout()
+    conn = connection_factory()
+    if not conn:
+        return 0
+    since = time.time() - seconds
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT {layout.type_column}, {layout.value_column}, {layout.timestamp_column}, {layout.device_column}
+            FROM {layout.source()}
+            WHERE {layout.timestamp_column} >= FROM_UNIXTIME({int(since)})
+        """)
+        rows = [(reading_type, value, timestamp.timestamp(), device_id)
+                for reading_type, value, timestamp, device_id in cursor.fetchall()]
+        cursor.close()
+    except mysql.connector.Error as err:
+        logger.error(f"Could not load recent readings into memory: {err}")
+        return 0
+    finally:
+        conn.close()
+    store.load(rows, since)
+    logger.info(f"Loaded {len(rows)} recent readings into the live series store")
+    return len(rows)
@@ -0,0 +1,160 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from metrics import Counter
+
+# Log pipeline configuration
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'compact')  # 'compact' (logfmt) or 'text' (the old format)
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(5 * 1024 * 1024)))  # Rotate log files at this size
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '3'))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))  # Records buffered before dropping
+LOG_DEDUP_WINDOW = float(os.getenv('LOG_DEDUP_WINDOW', '10'))  # Seconds an identical message is suppressed
+LOG_INFO_RATE = float(os.getenv('LOG_INFO_RATE', '50'))  # INFO/DEBUG records per second per logger (0 = no limit)
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+LOG_RECORDS_DROPPED = Counter('log_records_dropped_total', 'Log records not written', ['reason'])
+
+_listener = None
+
+# Attributes every LogRecord has; anything else was passed with extra={...}
+STANDARD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class CompactFormatter(logging.Formatter):
+    """One logfmt line per record: t=... l=INFO n=SerialBridge m="..." plus any extra fields"""
+
+    def format(self, record):
+        timestamp = datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds')
+        message = record.getMessage().replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts = [f't={timestamp}', f'l={record.levelname}', f'n={record.name}', f'm="{message}"']
+        for key, value in record.__dict__.items():
+            if key not in STANDARD_ATTRS:
+                parts.append(f'{key}={value}')
+        if record.exc_info:
+            exc = self.formatException(record.exc_info).replace('\n', '\\n')
+            parts.append(f'exc="{exc}"')
+        return ' '.join(parts)
+
+
+class LogThrottle(logging.Filter):
+    """
+    Drops identical messages repeated within `window` seconds (the next one
+    through notes how many were suppressed) and samples INFO/DEBUG records
+    down to `info_rate` per second per logger. Runs on the caller's thread
+    before the record is queued, so it only does dictionary lookups.
+    """
+
+    MAX_TRACKED = 1000
+
+    def __init__(self, window=LOG_DEDUP_WINDOW, info_rate=LOG_INFO_RATE):
+        super().__init__()
+        self.window = window
+        self.info_rate = info_rate
+        self.lock = threading.Lock()
+        self.recent = {}  # (logger, level, msg) -> [last emitted at, suppressed since]
+        self.buckets = {}  # logger -> [tokens, last refill, sampled out since]
+        self.deduplicated = LOG_RECORDS_DROPPED.labels('deduplicated')
+        self.sampled = LOG_RECORDS_DROPPED.labels('sampled')
+
+    def filter(self, record):
+        now = record.created
+        key = (record.name, record.levelno, record.msg)
+        notes = []
+        with self.lock:
+            entry = self.recent.get(key)
+            if entry is not None and now - entry[0] < self.window:
+                entry[1] += 1
+                self.deduplicated.inc()
+                return False
+            if entry is not None and entry[1]:
+                notes.append(f"repeated {entry[1]} times")
+
+            if record.levelno < logging.WARNING and self.info_rate > 0:
+                bucket = self.buckets.get(record.name)
+                if bucket is None:
+                    bucket = self.buckets[record.name] = [self.info_rate, now, 0]
+                bucket[0] = min(self.info_rate, bucket[0] + (now - bucket[1]) * self.info_rate)
+                bucket[1] = now
+                if bucket[0] < 1:
+                    bucket[2] += 1
+                    self.sampled.inc()
+                    return False
+                bucket[0] -= 1
+                if bucket[2]:
+                    notes.append(f"{bucket[2]} records sampled out")
+                    bucket[2] = 0
+
+            if len(self.recent) >= self.MAX_TRACKED:
+                self.recent = {k: v for k, v in self.recent.items() if now - v[0] < self.window}
+            self.recent[key] = [now, 0]
+
+        if notes:
+            record.msg = f"{record.getMessage()} ({', '.join(notes)})"
+            record.args = None
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self.queue_full = LOG_RECORDS_DROPPED.labels('queue_full')
+
+    def enqueue(self, record):
+        try:
+            if self.dropped:
+                notice = logging.LogRecord('Logging', logging.WARNING, __file__, 0,
+                                           f"Log queue full, dropped {self.dropped} records", None, None)
+                self.queue.put_nowait(notice)
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            self.queue_full.inc()
+
+
+def configure_logging(log_file, level=LOG_LEVEL, log_format=LOG_FORMAT):
+    """
+    Route all logging through a bounded queue to a background thread that
+    writes a size-rotated file and the console, so callers never wait on
+    log I/O. Like logging.basicConfig, does nothing if the root logger
+    already has handlers. Returns the QueueListener (or None).
+    """
+    global _listener
+    root = logging.getLogger()
+    if root.handlers:
+        return None
+
+    formatter = CompactFormatter() if log_format == 'compact' else logging.Formatter(TEXT_FORMAT)
+    file_handler = RotatingFileHandler(log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+    console_handler = logging.StreamHandler()
+    for handler in (file_handler, console_handler):
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(LogThrottle())
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+    return _listener
+
+
+def shutdown_logging():
+    """Write out queued records and stop the logging thread; safe to call twice"""
+    global _listener
+    if _listener is not None:
+        listener, _listener = _listener, None
+        listener.stop()
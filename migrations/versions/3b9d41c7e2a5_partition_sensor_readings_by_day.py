@@ -0,0 +1,80 @@
+"""Partition sensor_readings by day
+
+Revision ID: 3b9d41c7e2a5
+Revises: 0e7668abf8f2
+Create Date: 2026-10-17 09:12:05.118240
+
+"""
+from datetime import date, timedelta
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b9d41c7e2a5'
+down_revision = '0e7668abf8f2'
+branch_labels = None
+depends_on = None
+
+# Keep in step with PARTITION_DAYS_AHEAD in sensor_storage.py
+DAYS_AHEAD = 3
+
+
+def partition_definitions(first_day, last_day):
+    definitions = []
+    day = first_day
+    while day <= last_day:
+        upper = (day + timedelta(days=1)).strftime('%Y-%m-%d 00:00:00')
+        definitions.append(
+            f"PARTITION p{day.strftime('%Y%m%d')} VALUES LESS THAN (UNIX_TIMESTAMP('{upper}'))"
+        )
+        day += timedelta(days=1)
+    definitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+    return ',\n        '.join(definitions)
+
+
+def upgrade():
+    bind = op.get_bind()
+    has_table = sa.inspect(bind).has_table('sensor_readings')
+
+    today = date.today()
+    oldest = None
+    if has_table:
+        oldest = bind.execute(sa.text("SELECT DATE(MIN(timestamp)) FROM sensor_readings")).scalar()
+    first_day = min(oldest or today, today)
+
+    # Build the partitioned copy next to the old table, then swap them
+    op.execute(f"""
+    CREATE TABLE sensor_readings_partitioned (
+        id INT AUTO_INCREMENT,
+        reading_type VARCHAR(50) NOT NULL,
+        reading_value FLOAT NOT NULL,
+        timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id, timestamp),
+        INDEX idx_reading_type (reading_type),
+        INDEX idx_timestamp (timestamp)
+    )
+    PARTITION BY RANGE (UNIX_TIMESTAMP(timestamp)) (
+        {partition_definitions(first_day, today + timedelta(days=DAYS_AHEAD))}
+    )
+    """)
+
+    if has_table:
+        op.execute("""
+        INSERT INTO sensor_readings_partitioned (id, reading_type, reading_value, timestamp)
+        SELECT id, reading_type, reading_value, COALESCE(timestamp, NOW())
+        FROM sensor_readings
+        """)
+        op.execute("""
+        RENAME TABLE sensor_readings TO sensor_readings_unpartitioned,
+                     sensor_readings_partitioned TO sensor_readings
+        """)
+        op.execute("DROP TABLE sensor_readings_unpartitioned")
+    else:
+        op.execute("RENAME TABLE sensor_readings_partitioned TO sensor_readings")
+
+
+def downgrade():
+    op.execute("ALTER TABLE sensor_readings REMOVE PARTITIONING")
+    op.execute("ALTER TABLE sensor_readings DROP PRIMARY KEY, ADD PRIMARY KEY (id)")
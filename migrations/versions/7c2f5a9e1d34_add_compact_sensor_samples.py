@@ -0,0 +1,64 @@
+"""Add compact sensor_types/sensor_samples layout
+
+Revision ID: 7c2f5a9e1d34
+Revises: 3b9d41c7e2a5
+Create Date: 2026-10-17 11:40:27.503118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c2f5a9e1d34'
+down_revision = '3b9d41c7e2a5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+    CREATE TABLE sensor_types (
+        id SMALLINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(50) NOT NULL,
+        UNIQUE KEY uq_sensor_type_name (name)
+    )
+    """)
+    op.execute("INSERT INTO sensor_types (name) VALUES ('DIST'), ('LIGHT')")
+
+    # A single pmax partition; the bridge's storage maintenance splits it into
+    # daily partitions starting from the oldest copied row
+    op.execute("""
+    CREATE TABLE sensor_samples (
+        timestamp TIMESTAMP NOT NULL,
+        type_id SMALLINT UNSIGNED NOT NULL,
+        seq SMALLINT UNSIGNED NOT NULL DEFAULT 0,
+        value FLOAT NOT NULL,
+        PRIMARY KEY (timestamp, type_id, seq)
+    )
+    PARTITION BY RANGE (UNIX_TIMESTAMP(timestamp)) (
+        PARTITION pmax VALUES LESS THAN MAXVALUE
+    )
+    """)
+
+    bind = op.get_bind()
+    if sa.inspect(bind).has_table('sensor_readings'):
+        op.execute("""
+        INSERT IGNORE INTO sensor_types (name)
+        SELECT DISTINCT reading_type FROM sensor_readings
+        """)
+        op.execute("""
+        INSERT INTO sensor_samples (timestamp, type_id, seq, value)
+        SELECT
+            r.timestamp,
+            t.id,
+            ROW_NUMBER() OVER (PARTITION BY r.reading_type, r.timestamp ORDER BY r.id) - 1,
+            r.reading_value
+        FROM sensor_readings r
+        JOIN sensor_types t ON t.name = r.reading_type
+        """)
+
+
+def downgrade():
+    op.drop_table('sensor_samples')
+    op.drop_table('sensor_types')
@@ -0,0 +1,97 @@
+"""Key controls, readings and rollups by device
+
+Revision ID: a91d4e6b2f80
+Revises: 7c2f5a9e1d34
+Create Date: 2026-10-17 14:05:12.318846
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a91d4e6b2f80'
+down_revision = '7c2f5a9e1d34'
+branch_labels = None
+depends_on = None
+
+ROLLUP_TABLES = ('sensor_rollup_minute', 'sensor_rollup_hour')
+
+HOURLY_VIEW = """
+CREATE OR REPLACE VIEW hourly_sensor_averages AS
+SELECT
+    {device}reading_type,
+    DATE_FORMAT(bucket_start, '%Y-%m-%d %H:00:00') AS hour_bucket,
+    value_sum / reading_count AS average_value,
+    value_min AS min_value,
+    value_max AS max_value,
+    reading_count
+FROM
+    sensor_rollup_hour
+ORDER BY
+    hour_bucket DESC, {device}reading_type
+"""
+
+
+def upgrade():
+    op.add_column('device', sa.Column('serial_port', sa.String(length=100), nullable=True))
+    # Everything recorded so far belongs to the original vehicle
+    op.execute("INSERT IGNORE INTO device (id, name, status) VALUES (1, 'Drone 1', 'offline')")
+
+    tables = set(sa.inspect(op.get_bind()).get_table_names())
+    if 'drone_controls' in tables:
+        op.execute("""
+        ALTER TABLE drone_controls
+            ADD COLUMN device_id INT NOT NULL DEFAULT 1 AFTER id,
+            ADD UNIQUE KEY uq_device_control (device_id, control_name)
+        """)
+    if 'sensor_readings' in tables:
+        op.execute("ALTER TABLE sensor_readings ADD COLUMN device_id INT NOT NULL DEFAULT 1 AFTER id")
+    if 'sensor_samples' in tables:
+        op.execute("""
+        ALTER TABLE sensor_samples
+            ADD COLUMN device_id SMALLINT UNSIGNED NOT NULL DEFAULT 1 AFTER timestamp,
+            DROP PRIMARY KEY,
+            ADD PRIMARY KEY (timestamp, device_id, type_id, seq)
+        """)
+    for table in ROLLUP_TABLES:
+        if table in tables:
+            op.execute(f"""
+            ALTER TABLE {table}
+                ADD COLUMN device_id INT NOT NULL DEFAULT 1 FIRST,
+                DROP PRIMARY KEY,
+                ADD PRIMARY KEY (bucket_start, device_id, reading_type)
+            """)
+    if 'sensor_rollup_hour' in tables:
+        op.execute(HOURLY_VIEW.format(device='device_id, '))
+
+
+def downgrade():
+    # Only the original vehicle's rows fit the device-less keys
+    tables = set(sa.inspect(op.get_bind()).get_table_names())
+    if 'sensor_rollup_hour' in tables:
+        op.execute(HOURLY_VIEW.format(device=''))
+    for table in ROLLUP_TABLES:
+        if table in tables:
+            op.execute(f"DELETE FROM {table} WHERE device_id <> 1")
+            op.execute(f"""
+            ALTER TABLE {table}
+                DROP PRIMARY KEY,
+                ADD PRIMARY KEY (bucket_start, reading_type),
+                DROP COLUMN device_id
+            """)
+    if 'sensor_samples' in tables:
+        op.execute("DELETE FROM sensor_samples WHERE device_id <> 1")
+        op.execute("""
+        ALTER TABLE sensor_samples
+            DROP PRIMARY KEY,
+            ADD PRIMARY KEY (timestamp, type_id, seq),
+            DROP COLUMN device_id
+        """)
+    if 'sensor_readings' in tables:
+        op.execute("DELETE FROM sensor_readings WHERE device_id <> 1")
+        op.drop_column('sensor_readings', 'device_id')
+    if 'drone_controls' in tables:
+        op.execute("DELETE FROM drone_controls WHERE device_id <> 1")
+        op.execute("ALTER TABLE drone_controls DROP INDEX uq_device_control, DROP COLUMN device_id")
+    op.drop_column('device', 'serial_port')
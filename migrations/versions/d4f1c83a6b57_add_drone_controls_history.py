@@ -0,0 +1,45 @@
+"""Add drone_controls_history
+
+Revision ID: d4f1c83a6b57
+Revises: a91d4e6b2f80
+Create Date: 2026-10-17 16:22:48.904117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4f1c83a6b57'
+down_revision = 'a91d4e6b2f80'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # One row per coalesced control write; the index covers the operation stats query
+    op.execute("""
+    CREATE TABLE drone_controls_history (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        device_id INT NOT NULL DEFAULT 1,
+        control_name VARCHAR(50) NOT NULL,
+        control_value VARCHAR(255) NOT NULL,
+        source VARCHAR(20) NOT NULL DEFAULT 'dashboard',
+        write_count INT NOT NULL DEFAULT 1,
+        updated_at TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3),
+        INDEX idx_history_time (updated_at, device_id, control_name, control_value)
+    )
+    """)
+
+    # Start the history from the current state of every control
+    bind = op.get_bind()
+    if sa.inspect(bind).has_table('drone_controls'):
+        op.execute("""
+        INSERT INTO drone_controls_history (device_id, control_name, control_value, source, updated_at)
+        SELECT device_id, control_name, control_value, 'initial', updated_at
+        FROM drone_controls
+        """)
+
+
+def downgrade():
+    op.drop_table('drone_controls_history')
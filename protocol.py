@@ -0,0 +1,215 @@
+import binascii
+import struct
+import logging
+from collections import namedtuple
+
+from metrics import Counter
+
+logger = logging.getLogger("Protocol")
+
+# Optional binary framing for the Arduino link, negotiated per connection.
+# The bridge sends NEGOTIATE_COMMAND as an ordinary ASCII command; firmware
+# that supports frames answers with the NEGOTIATE_ACCEPT line and switches
+# both directions to frames. Older firmware ignores it and the link stays ASCII.
+#
+# Frame: SYNC (A5 5A) | length | type | seq | payload[length] | CRC-16 (LE)
+# The CRC (CCITT, init 0xFFFF) covers length, type, seq and payload. After a
+# bad CRC or length the decoder skips one byte and hunts for the next SYNC.
+NEGOTIATE_COMMAND = "PROTO:BIN1"
+NEGOTIATE_ACCEPT = "PROTO:BIN1 OK"
+
+SYNC = b'\xa5\x5a'
+HEADER = struct.Struct('<BBB')  # length, type, seq
+CRC = struct.Struct('<H')
+MAX_PAYLOAD = 64
+MAX_LINE = 1024  # ASCII bytes kept while waiting for a newline
+
+# Frame types, firmware -> bridge
+FRAME_SENSORS = 0x10  # payload: (sensor id u8, value i16) pairs
+FRAME_STATUS = 0x11  # payload: "DRIVE=stop;REASON=obstacle;..."
+FRAME_REQUEST = 0x12  # payload: "CONTROLS"
+FRAME_TEXT = 0x13  # payload: any other line, e.g. "PONG"
+FRAME_ACK = 0x21  # seq: the acked command's seq; payload: ACK_OK/ACK_REJECTED
+# Frame types, bridge -> firmware
+FRAME_COMMAND = 0x20  # payload: "DRIVE:forward"; retransmitted with the same seq until acked
+
+ACK_OK = 0
+ACK_REJECTED = 1
+
+SENSOR_FIELD = struct.Struct('<Bh')
+SENSOR_NAMES = {1: 'DIST', 2: 'LIGHT'}
+SENSOR_IDS = {name: sensor_id for sensor_id, name in SENSOR_NAMES.items()}
+
+# Frames that carry the text of an ASCII line after a fixed prefix
+TEXT_FRAMES = {FRAME_STATUS: 'STATUS:', FRAME_REQUEST: 'REQUEST:', FRAME_TEXT: ''}
+
+FRAME_ERRORS = Counter('serial_frame_errors_total', 'Binary frames discarded or missing by reason', ['reason'])
+FRAME_RESYNC_BYTES = Counter('serial_frame_resync_bytes_total', 'Bytes skipped while hunting for a frame start')
+
+Frame = namedtuple('Frame', 'type seq payload')
+
+
+def crc16(data):
+    """CRC-16/CCITT-FALSE, the same as crc16_update() in Firmware.ino"""
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def encode_frame(frame_type, seq, payload=b''):
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f"Frame payload too long ({len(payload)} > {MAX_PAYLOAD} bytes)")
+    body = HEADER.pack(len(payload), frame_type, seq & 0xFF) + payload
+    return SYNC + body + CRC.pack(crc16(body))
+
+
+def encode_sensors(readings):
+    """Sensor frame payload for {name: int value}, as sent by the firmware"""
+    return b''.join(SENSOR_FIELD.pack(SENSOR_IDS[name], value) for name, value in readings.items())
+
+
+def frame_line(frame):
+    """The ASCII line the firmware would have printed for a frame, or None"""
+    if frame.type == FRAME_SENSORS:
+        if len(frame.payload) % SENSOR_FIELD.size:
+            FRAME_ERRORS.labels('malformed').inc()
+            return None
+        fields = ';'.join(f"{SENSOR_NAMES.get(sensor_id, f'S{sensor_id}')}={value}"
+                          for sensor_id, value in SENSOR_FIELD.iter_unpack(frame.payload))
+        return f"SENSORS:{fields}"
+    prefix = TEXT_FRAMES.get(frame.type)
+    if prefix is None:
+        FRAME_ERRORS.labels('unknown_type').inc()
+        return None
+    return prefix + frame.payload.decode('utf-8', errors='replace')
+
+
+class FrameDecoder:
+    """Incremental frame parser that resynchronises on the next SYNC after noise"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.crc_errors = FRAME_ERRORS.labels('crc')
+        self.oversize = FRAME_ERRORS.labels('oversize')
+
+    def feed(self, data):
+        """Add received bytes; returns the complete, valid frames"""
+        buffer = self.buffer
+        buffer += data
+        frames = []
+        start = 0
+        skipped = 0
+        while True:
+            index = buffer.find(SYNC, start)
+            if index < 0:
+                # Keep a trailing first SYNC byte; its partner may be in the next read
+                keep = len(buffer) - 1 if buffer[-1:] == SYNC[:1] else len(buffer)
+                skipped += max(0, keep - start)
+                start = max(start, keep)
+                break
+            skipped += index - start
+            header_end = index + len(SYNC) + HEADER.size
+            if len(buffer) < header_end:
+                start = index
+                break
+            length, frame_type, seq = HEADER.unpack_from(buffer, index + len(SYNC))
+            if length > MAX_PAYLOAD:
+                self.oversize.inc()
+                skipped += 1
+                start = index + 1
+                continue
+            end = header_end + length + CRC.size
+            if len(buffer) < end:
+                start = index
+                break
+            body = bytes(buffer[index + len(SYNC):end - CRC.size])
+            if crc16(body) != CRC.unpack_from(buffer, end - CRC.size)[0]:
+                self.crc_errors.inc()
+                skipped += 1
+                start = index + 1
+                continue
+            frames.append(Frame(frame_type, seq, body[HEADER.size:]))
+            start = end
+        del buffer[:start]
+        if skipped:
+            FRAME_RESYNC_BYTES.inc(skipped)
+        return frames
+
+
+class AsciiCodec:
+    """
+    Newline-delimited text, the firmware's default. With `upgrade`, switches
+    to BinaryCodec (exposed as `next`) when the firmware accepts the
+    binary protocol; bytes after the accept line go to the new codec.
+
+    feed() returns (line, ack_seq) events; text acks are plain lines.
+    """
+
+    framed = False
+
+    def __init__(self, upgrade=False):
+        self.upgrade = upgrade
+        self.next = None
+        self.buffer = bytearray()
+
+    def encode(self, command, seq=None):
+        return (command + '\n').encode('utf-8')
+
+    def feed(self, data):
+        buffer = self.buffer
+        buffer += data
+        events = []
+        while True:
+            end = buffer.find(b'\n')
+            if end < 0:
+                if len(buffer) > MAX_LINE:
+                    logger.warning(f"Discarding {len(buffer)} bytes without a line ending")
+                    buffer.clear()
+                break
+            line = buffer[:end].decode('utf-8', errors='replace').strip()
+            del buffer[:end + 1]
+            if not line:
+                continue
+            if self.upgrade and line == NEGOTIATE_ACCEPT:
+                self.next = BinaryCodec()
+                events.extend(self.next.feed(bytes(buffer)))
+                buffer.clear()
+                break
+            events.append((line, None))
+        return events
+
+
+class BinaryCodec:
+    """
+    CRC-checked frames. Frames are turned back into the equivalent ASCII
+    lines so the bridge handles both modes alike; acks are returned as
+    (None, seq) events. Gaps in the firmware's sequence numbers are counted
+    as lost frames.
+    """
+
+    framed = True
+
+    def __init__(self):
+        self.next = None
+        self.decoder = FrameDecoder()
+        self.last_seq = None
+        self.lost = FRAME_ERRORS.labels('lost')
+
+    def encode(self, command, seq):
+        return encode_frame(FRAME_COMMAND, seq, command.encode('utf-8'))
+
+    def feed(self, data):
+        events = []
+        for frame in self.decoder.feed(data):
+            if frame.type == FRAME_ACK:
+                if frame.payload[:1] == bytes([ACK_REJECTED]):
+                    logger.warning(f"Arduino rejected command seq {frame.seq}")
+                events.append((None, frame.seq))
+                continue
+            if self.last_seq is not None:
+                missing = (frame.seq - self.last_seq - 1) & 0xFF
+                if missing:
+                    self.lost.inc(missing)
+            self.last_seq = frame.seq
+            line = frame_line(frame)
+            if line:
+                events.append((line, None))
+        return events
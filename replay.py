@@ -0,0 +1,512 @@
+"""
+Replay recorded serial traffic into the bridge and load the dashboard, for
+capacity planning. serial_bridge.log is parsed into a timeline of the lines
+the Arduino sent ("Received ...") and the commands the bridge wrote
+("Sent ..."). The Arduino lines are replayed through one fake serial port
+per simulated vehicle (fake_arduino.py) into serial_bridge.run_bridge(),
+while simulated dashboards poll app.py's /api/* routes and subscribe to the
+Socket.IO telemetry (and optionally webcam) stream.
+
+    python replay.py --speed 1                          # real time, one vehicle
+    python replay.py --speed 20 --vehicles 4 --clients 50 --sio-clients 20
+    python replay.py --speed max --db none --clients 0   # bridge throughput only
+    python replay.py --url http://drone-host:5000 --clients 200
+
+Gaps longer than --max-gap (bridge restarts, idle periods) are shortened to
+it. Without --url the app is served in this process next to the bridge, so
+the two compete for one interpreter; point --url at a separately started
+app.py for numbers closer to production. Socket.IO clients need
+python-socketio's client transports (websocket-client or requests).
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import re
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from urllib.parse import urlsplit
+
+from benchmark import (BridgeRunner, CpuMeter, NullConnection, SyntheticCamera, configure_environment,
+                       git_revision, prepare_database, summarize)
+from fake_arduino import FakeArduino
+from serial_messages import CONTROL_COMMANDS
+
+logger = logging.getLogger("Replay")
+
+# Both log formats written by logging_setup.py: 'text' and 'compact' (logfmt)
+TEXT_ENTRY = re.compile(r'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3})(?: - \S+)? - [A-Z]+ - (.*)$')
+COMPACT_ENTRY = re.compile(r'^t=(\S+) l=\w+ n=\S+ m="((?:[^"\\]|\\.)*)"')
+COMPACT_ESCAPES = re.compile(r'\\(.)')
+# "Received: ...", "Received from Arduino: ...", "Received from Arduino 2: ...", "Sent to Arduino: ..."
+TRAFFIC_MESSAGE = re.compile(r'^(Received|Sent)(?: (?:from|to) Arduino)?(?: (\d+))?: (.*)$')
+
+# Firmware answers to a command; the fake Arduino produces its own for live commands
+REPLY_PREFIXES = ('Command received: ', 'Processed command: ')
+
+MAX_GAP = 5.0
+ANALYTICS_TIMEFRAMES = ('1h', '24h', '7d')
+STEERING_VALUES = ('left', 'center', 'right')
+
+LogEvent = namedtuple('LogEvent', 'offset direction device text')
+
+# Firmware command -> the control the dashboard changed to cause it
+COMMAND_CONTROLS = {command: control for control, command in CONTROL_COMMANDS.items()}
+
+
+def parse_entry(entry):
+    """(datetime, message) for one log line, or None for lines in neither format"""
+    match = TEXT_ENTRY.match(entry)
+    if match:
+        return datetime.strptime(match.group(1), '%Y-%m-%d %H:%M:%S,%f'), match.group(2).rstrip()
+    match = COMPACT_ENTRY.match(entry)
+    if match:
+        message = COMPACT_ESCAPES.sub(lambda m: '\n' if m.group(1) == 'n' else m.group(1), match.group(2))
+        return datetime.fromisoformat(match.group(1)), message
+    return None
+
+
+def parse_log(path, max_gap=MAX_GAP, keep_replies=False):
+    """
+    Timeline of the serial traffic in a bridge log as LogEvents: offset in
+    seconds from the first event (gaps capped at `max_gap`), direction 'rx'
+    (Arduino -> bridge) or 'tx' (bridge -> Arduino), device id and line.
+    """
+    events = []
+    offset = 0.0
+    last = None
+    with open(path, errors='replace') as f:
+        for entry in f:
+            parsed = parse_entry(entry)
+            if parsed is None:
+                continue
+            timestamp, message = parsed
+            match = TRAFFIC_MESSAGE.match(message)
+            if not match:
+                continue
+            direction = 'rx' if match.group(1) == 'Received' else 'tx'
+            text = match.group(3).strip()
+            if not text or (direction == 'rx' and not keep_replies and text.startswith(REPLY_PREFIXES)):
+                continue
+            if last is not None:
+                offset += min(max(0.0, (timestamp - last).total_seconds()), max_gap)
+            last = timestamp
+            events.append(LogEvent(offset, direction, int(match.group(2) or 1), text))
+    return events
+
+
+def line_kind(text):
+    for tag, kind in (('SENSORS:', 'sensors'), ('STATUS:', 'status'), ('REQUEST:', 'request')):
+        if tag in text:
+            return kind
+    return 'other'
+
+
+class ReplayArduino(FakeArduino):
+    """
+    FakeArduino that plays back recorded lines on its USB port instead of
+    simulating sensors.
+    Playback starts when `go` is set and follows the recorded offsets divided
+    by `speed` (0 = as fast as the bridge reads them); `lag` records how far
+    behind schedule each line was written. Commands are still answered like
+    the firmware does.
+    """
+
+    def __init__(self, events, speed=1.0, loops=1, seed=None):
+        super().__init__(sensor_rate=0, seed=seed)
+        self.events = events
+        self.speed = speed
+        self.loops = loops
+        self.counts['other'] = 0
+        self.go = threading.Event()
+        self.finished = threading.Event()
+        self.lag = []
+        self.skipped = 0
+
+    def _emit_thread(self):
+        try:
+            while self.running and not self.go.wait(0.2):
+                pass
+            for _ in range(self.loops):
+                started = time.monotonic()
+                for event in self.events:
+                    if not self.running:
+                        return
+                    if self.speed:
+                        delay = started + event.offset / self.speed - time.monotonic()
+                        if delay > 0:
+                            time.sleep(delay)
+                        self.lag.append(max(0.0, -delay))
+                    try:
+                        self.write_port_line(event.text, line_kind(event.text))
+                    except ValueError:
+                        # Longer than a binary frame payload
+                        self.skipped += 1
+        except OSError:
+            # Port closed by stop()
+            pass
+        finally:
+            self.finished.set()
+
+
+def replay_commands(events, speed, stop):
+    """Re-issue the recorded control commands through the control channel, like the API does"""
+    from control_channel import ControlPublisher
+
+    publisher = ControlPublisher()
+    started = time.monotonic()
+    published = 0
+    for event in events:
+        command, _, value = event.text.partition(':')
+        control = COMMAND_CONTROLS.get(command)
+        if control is None:
+            continue
+        if speed and stop.wait(max(0.0, started + event.offset / speed - time.monotonic())):
+            break
+        if stop.is_set():
+            break
+        publisher.publish(control, value, event.device)
+        published += 1
+    return published
+
+
+def start_app(use_db, camera_fps):
+    """Serve app.py on a free local port in this process; returns its base URL"""
+    # The replay's own threads must stay real threads, so the app runs unpatched on Werkzeug
+    os.environ['SERVER_MODE'] = 'threading'
+    import app
+
+    if not use_db:
+        app.get_db_connection = NullConnection
+        app.control_writes.connection_factory = NullConnection
+    app.create_app()
+    app.webcam_streamer.camera_factory = lambda camera_id: SyntheticCamera(camera_id, fps=camera_fps)
+
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    thread = threading.Thread(
+        target=app.socketio.run, args=(app.app,),
+        kwargs={'host': '127.0.0.1', 'port': port, 'allow_unsafe_werkzeug': True, 'log_output': False},
+        daemon=True
+    )
+    thread.start()
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("app.py did not start listening")
+
+
+def run_http_client(index, base_url, device_ids, args, stop, result):
+    """One simulated dashboard polling the API and pressing steering buttons"""
+    url = urlsplit(base_url)
+    rng = random.Random(index)
+    device_id = device_ids[index % len(device_ids)]
+    conn = None
+
+    def request(method, path, body=None):
+        nonlocal conn
+        route = f"{method} {path.split('?')[0]}"
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        started = time.perf_counter()
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=args.request_timeout)
+            conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException) as e:
+            result['errors'][type(e).__name__] = result['errors'].get(type(e).__name__, 0) + 1
+            if conn is not None:
+                conn.close()
+            conn = None
+            return
+        result['latency'].setdefault(route, []).append(time.perf_counter() - started)
+        result['status'][status] = result['status'].get(status, 0) + 1
+
+    # Stagger the clients so their polls don't line up
+    if stop.wait(rng.uniform(0, args.poll_interval)):
+        return
+    request('GET', '/api/devices')
+    next_poll = time.monotonic()
+    next_press = time.monotonic() + (rng.expovariate(args.control_rate) if args.control_rate else float('inf'))
+    while not stop.is_set():
+        now = time.monotonic()
+        if now >= next_poll:
+            request('GET', f"/api/controls?device={device_id}")
+            request('GET', f"/api/sensor_analytics?timeframe={rng.choice(ANALYTICS_TIMEFRAMES)}&device={device_id}")
+            next_poll += args.poll_interval
+        if now >= next_press:
+            request('POST', '/api/control/steering', {'value': rng.choice(STEERING_VALUES), 'device': device_id})
+            next_press += rng.expovariate(args.control_rate)
+        stop.wait(max(0.0, min(next_poll, next_press) - time.monotonic()))
+    if conn is not None:
+        conn.close()
+
+
+def run_socketio_client(index, base_url, device_ids, args, stop, result):
+    """One simulated dashboard subscribed to a vehicle's telemetry (and the webcam with --webcam)"""
+    import socketio
+
+    device_id = device_ids[index % len(device_ids)]
+    client = socketio.Client(reconnection=False)
+
+    @client.on('telemetry')
+    def on_telemetry(event):
+        result['events'] += 1
+        if isinstance(event, dict) and event.get('ts'):
+            result['latency'].append(max(0.0, time.time() - event['ts']))
+
+    @client.on('webcam_frame')
+    def on_webcam_frame(data):
+        result['frames'] += 1
+        result['frame_bytes'] += len(data.get('image', '')) if isinstance(data, dict) else 0
+        return True
+
+    try:
+        started = time.perf_counter()
+        client.connect(base_url, wait_timeout=args.request_timeout)
+        result['connect'].append(time.perf_counter() - started)
+        client.call('subscribe_telemetry', {'device': device_id}, timeout=args.request_timeout)
+        if args.webcam:
+            client.call('start_stream', {}, timeout=args.request_timeout)
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+        return
+    stop.wait()
+    client.disconnect()
+
+
+def merge_http_results(results, elapsed):
+    latency = {}
+    status = {}
+    errors = {}
+    for result in results:
+        for route, samples in result['latency'].items():
+            latency.setdefault(route, []).extend(samples)
+        for key, count in result['status'].items():
+            status[key] = status.get(key, 0) + count
+        for key, count in result['errors'].items():
+            errors[key] = errors.get(key, 0) + count
+    requests = sum(len(samples) for samples in latency.values())
+    return {
+        'clients': len(results),
+        'requests': requests,
+        'requests_per_sec': round(requests / elapsed, 1) if elapsed else 0.0,
+        'status': status,
+        'errors': errors,
+        'routes': {route: summarize(samples) for route, samples in sorted(latency.items())}
+    }
+
+
+def merge_socketio_results(results, elapsed):
+    connected = [result for result in results if 'error' not in result]
+    errors = {}
+    for result in results:
+        if 'error' in result:
+            errors[result['error']] = errors.get(result['error'], 0) + 1
+    events = sum(result['events'] for result in connected)
+    frames = sum(result['frames'] for result in connected)
+    return {
+        'clients': len(results),
+        'connected': len(connected),
+        'errors': errors,
+        'connect': summarize([sample for result in connected for sample in result['connect']]),
+        'telemetry_events': events,
+        'telemetry_events_per_sec': round(events / elapsed, 1) if elapsed else 0.0,
+        'telemetry_latency': summarize([sample for result in connected for sample in result['latency']]),
+        'webcam_frames': frames,
+        'webcam_fps_per_client': round(frames / elapsed / len(connected), 2) if connected and elapsed else 0.0,
+        'webcam_bytes': sum(result['frame_bytes'] for result in connected)
+    }
+
+
+def lines_handled(bridge):
+    return sum(counter.get() for counter in bridge.LINES_BY_TYPE.values())
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded serial traffic and simulate dashboards")
+    parser.add_argument('--log', default='serial_bridge.log', help="bridge log to replay")
+    parser.add_argument('--speed', default='1',
+                        help="replay speed: 1 = as recorded, N = N times faster, 'max' = as fast as possible")
+    parser.add_argument('--loops', type=int, default=1, help="times to play the timeline")
+    parser.add_argument('--max-gap', type=float, default=MAX_GAP, help="longest pause kept from the log (s)")
+    parser.add_argument('--duration', type=float, default=0.0, help="stop after this many seconds (0 = end of log)")
+    parser.add_argument('--keep-replies', action='store_true',
+                        help="also replay recorded command replies (duplicates the live ones)")
+    parser.add_argument('--with-commands', action='store_true',
+                        help="re-issue the recorded control commands through the control channel")
+    parser.add_argument('--vehicles', type=int, default=1, help="fake serial ports, each replaying the log")
+    parser.add_argument('--protocol', choices=('ascii', 'binary'), default='ascii')
+    parser.add_argument('--db', choices=('mysql', 'none'), default='mysql',
+                        help="write to a local MySQL/MariaDB, or discard rows")
+    parser.add_argument('--db-name', default='drone_bench', help="throwaway database used for the run")
+    parser.add_argument('--url', help="load an already running app.py instead of serving one in-process")
+    parser.add_argument('--clients', type=int, default=10, help="simulated dashboards polling /api/*")
+    parser.add_argument('--poll-interval', type=float, default=5.0, help="seconds between a client's polls")
+    parser.add_argument('--control-rate', type=float, default=0.2, help="steering presses/s per client")
+    parser.add_argument('--sio-clients', type=int, default=0, help="simulated Socket.IO telemetry subscribers")
+    parser.add_argument('--webcam', action='store_true', help="Socket.IO clients also watch the webcam stream")
+    parser.add_argument('--camera-fps', type=int, default=20)
+    parser.add_argument('--request-timeout', type=float, default=10.0)
+    parser.add_argument('--drain-timeout', type=float, default=30.0)
+    parser.add_argument('--output', help="results file (default bench_results/replay-<timestamp>.json)")
+    parser.add_argument('--log-level', default='WARNING')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    speed = 0.0 if args.speed == 'max' else float(args.speed)
+
+    timeline = parse_log(args.log, args.max_gap, args.keep_replies)
+    received = [event for event in timeline if event.direction == 'rx']
+    sent = [event for event in timeline if event.direction == 'tx']
+    if not received:
+        sys.exit(f"No serial traffic found in {args.log}")
+
+    workdir = tempfile.mkdtemp(prefix='drone-replay-')
+    configure_environment(args, workdir)
+    use_db = args.db == 'mysql'
+    db_note = args.db
+    if use_db:
+        error = prepare_database(args)
+        if error:
+            logger.warning(f"MySQL unavailable, discarding rows instead: {error}")
+            use_db = False
+            db_note = f"none (MySQL unavailable: {error})"
+
+    fakes = [ReplayArduino(received, speed, args.loops, seed=i) for i in range(args.vehicles)]
+    for fake in fakes:
+        fake.start()
+    runner = BridgeRunner(fakes[0], use_db, args.protocol, fakes[1:])
+    stop = threading.Event()
+    threads = []
+    try:
+        runner.start()
+        device_ids = list(range(1, args.vehicles + 1))
+        base_url = args.url
+        if base_url is None and (args.clients or args.sio_clients):
+            base_url = start_app(use_db, args.camera_fps)
+
+        http_results = [{'latency': {}, 'status': {}, 'errors': {}} for _ in range(args.clients)]
+        sio_results = [{'events': 0, 'latency': [], 'frames': 0, 'frame_bytes': 0, 'connect': []}
+                       for _ in range(args.sio_clients)]
+        for index, result in enumerate(http_results):
+            threads.append(threading.Thread(target=run_http_client, daemon=True,
+                                            args=(index, base_url, device_ids, args, stop, result)))
+        for index, result in enumerate(sio_results):
+            threads.append(threading.Thread(target=run_socketio_client, daemon=True,
+                                            args=(index, base_url, device_ids, args, stop, result)))
+        for thread in threads:
+            thread.start()
+
+        print(f"Replaying {len(received)} lines x{args.loops} into {args.vehicles} vehicle(s) "
+              f"at {'max' if not speed else f'{speed:g}x'} speed...")
+        ingest_before = runner.bridge.sensor_ingest.get_stats()
+        cpu = CpuMeter()
+        started = time.monotonic()
+        commands = {}
+        if args.with_commands:
+            command_thread = threading.Thread(
+                target=lambda: commands.setdefault('published', replay_commands(sent, speed, stop)), daemon=True
+            )
+            command_thread.start()
+        for fake in fakes:
+            fake.go.set()
+        for fake in fakes:
+            remaining = started + args.duration - time.monotonic() if args.duration else None
+            if not fake.finished.wait(remaining):
+                break
+        elapsed = time.monotonic() - started
+        stop.set()
+        cpu_percent = cpu.percent()
+
+        # Wait for the bridge to get through everything the fakes wrote since
+        # they opened, including their replies to its commands
+        written = sum(sum(fake.counts.values()) for fake in fakes)
+        drain_started = time.monotonic()
+        while time.monotonic() - drain_started < args.drain_timeout:
+            if lines_handled(runner.bridge) >= written:
+                break
+            time.sleep(0.05)
+        drain = time.monotonic() - drain_started
+        handled = lines_handled(runner.bridge)
+        ingest = runner.bridge.sensor_ingest.get_stats()
+        for thread in threads:
+            thread.join(timeout=args.request_timeout)
+        runner.stop()
+    finally:
+        stop.set()
+        for fake in fakes:
+            fake.stop()
+
+    lag = [sample for fake in fakes for sample in fake.lag]
+    results = {
+        'timeline': {
+            'log': args.log,
+            'received_lines': len(received),
+            'sent_commands': len(sent),
+            'recorded_seconds': round(timeline[-1].offset, 3),
+            'max_gap_s': args.max_gap
+        },
+        'replay': {
+            'speed': args.speed,
+            'vehicles': args.vehicles,
+            'protocol': 'binary' if fakes[0].binary else 'ascii',
+            'duration_s': round(elapsed, 3),
+            'lines_written': written,
+            'lines_per_sec': round(written / elapsed, 1) if elapsed else 0.0,
+            'lines_handled': handled,
+            'drain_s': round(drain, 3),
+            'skipped': sum(fake.skipped for fake in fakes),
+            'schedule_lag': summarize(lag) if speed else None,
+            'commands_replayed': commands.get('published', 0),
+            'rows_added': ingest['added'] - ingest_before['added'],
+            'rows_inserted': ingest['inserted'] - ingest_before['inserted'],
+            'rows_spilled': ingest['spilled'] - ingest_before['spilled'],
+            'cpu_percent': cpu_percent
+        },
+        'serial': {fake.port: dict(fake.counts) for fake in fakes}
+    }
+    if args.clients:
+        results['http'] = merge_http_results(http_results, elapsed)
+    if args.sio_clients:
+        results['socketio'] = merge_socketio_results(sio_results, elapsed)
+
+    report = {
+        'meta': {
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'git_revision': git_revision(),
+            'cpu_count': os.cpu_count(),
+            'db': db_note,
+            'app': args.url or 'in-process',
+            'args': vars(args)
+        },
+        'results': results
+    }
+    output = args.output or os.path.join('bench_results',
+                                         'replay-' + datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    print(json.dumps(results, indent=2, default=str))
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
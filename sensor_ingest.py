@@ -0,0 +1,264 @@
+import os
+import threading
+import time
+import logging
+from collections import deque
+from datetime import datetime
+
+import mysql.connector
+
+from devices import DEFAULT_DEVICE_ID
+from metrics import Counter, Gauge, Histogram
+from sensor_layout import get_layout
+from sensor_rollups import apply_rollups
+
+logger = logging.getLogger("SensorIngest")
+
+# Ingest buffer configuration
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '200'))  # Flush once this many rows are pending
+INGEST_FLUSH_INTERVAL = float(os.getenv('INGEST_FLUSH_INTERVAL', '1.0'))  # ...or after this many seconds
+INGEST_MAX_PENDING = int(os.getenv('INGEST_MAX_PENDING', '5000'))  # Rows held in memory before spilling
+INGEST_SPILL_FILE = os.getenv('INGEST_SPILL_FILE', 'sensor_spill.csv')
+INGEST_SPILL_MAX_BYTES = int(os.getenv('INGEST_SPILL_MAX_BYTES', str(10 * 1024 * 1024)))
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+INGEST_INSERT_SECONDS = Histogram('sensor_insert_seconds',
+                                  'Time to insert one batch of readings and its rollups', ['result'])
+INGEST_BATCH_ROWS = Histogram('sensor_insert_batch_rows', 'Rows per inserted batch',
+                              buckets=(1, 10, 50, 100, 200, 500, 1000, 5000))
+INGEST_ROWS = Counter('sensor_ingest_rows_total', 'Sensor readings through the ingest buffer by outcome',
+                      ['outcome'])
+INGEST_PENDING = Gauge('sensor_ingest_pending', 'Readings buffered in memory waiting for a flush')
+INGEST_SPILL_BYTES = Gauge('sensor_ingest_spill_bytes', 'Size of the on-disk spill file')
+
+
+class SensorIngestBuffer:
+    """
+    In-memory buffer for sensor readings with a background flusher.
+
+    add() never touches the database, so the serial path can't stall on MySQL.
+    The flusher writes pending rows with one multi-row executemany() when
+    `batch_size` rows are waiting or `flush_interval` seconds have passed.
+    When MySQL is slow or down, rows beyond `max_pending` and failed batches
+    are appended to a bounded on-disk spill file, which is replayed once the
+    database accepts writes again. Rows are only dropped when the spill file
+    is full.
+    """
+
+    def __init__(self, connection_factory, batch_size=INGEST_BATCH_SIZE,
+                 flush_interval=INGEST_FLUSH_INTERVAL, max_pending=INGEST_MAX_PENDING,
+                 spill_file=INGEST_SPILL_FILE, spill_max_bytes=INGEST_SPILL_MAX_BYTES, layout=None):
+        self.connection_factory = connection_factory
+        self.layout = layout or get_layout()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.spill_file = spill_file
+        self.spill_max_bytes = spill_max_bytes
+
+        self.pending = deque()
+        self.lock = threading.Condition()
+        self.spill_lock = threading.Lock()
+        self.thread = None
+        self.running = False
+        self.stats = {
+            'added': 0,
+            'inserted': 0,
+            'batches': 0,
+            'spilled': 0,
+            'replayed': 0,
+            'dropped': 0,
+            'flush_errors': 0,
+            'spill_errors': 0
+        }
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._flush_thread, name="SensorIngestFlusher")
+        self.thread.daemon = True
+        self.thread.start()
+        
+        INGEST_PENDING.set_function(lambda: len(self.pending))
+        INGEST_SPILL_BYTES.set_function(self._spill_size)
+        for outcome in ('added', 'inserted', 'spilled', 'replayed', 'dropped'):
+            INGEST_ROWS.labels(outcome).set_function(lambda outcome=outcome: self.stats[outcome])
+
+    def stop(self):
+        """Stop the flusher after writing (or spilling) everything still pending"""
+        with self.lock:
+            self.running = False
+            self.lock.notify()
+        if self.thread:
+            self.thread.join(timeout=10.0)
+            self.thread = None
+
+    def add(self, reading_type, reading_value, timestamp=None, device_id=DEFAULT_DEVICE_ID):
+        """Queue one reading without blocking on the database"""
+        row = (reading_type, reading_value, timestamp or datetime.now(), device_id)
+        with self.lock:
+            self.stats['added'] += 1
+            if len(self.pending) < self.max_pending:
+                self.pending.append(row)
+                if len(self.pending) >= self.batch_size:
+                    self.lock.notify()
+                return
+        # Backpressure: the flusher is behind, so overflow goes to disk
+        self._spill([row])
+
+    def pending_count(self):
+        with self.lock:
+            return len(self.pending)
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['pending'] = len(self.pending)
+        stats['spill_bytes'] = self._spill_size()
+        return stats
+
+    def _flush_thread(self):
+        while True:
+            with self.lock:
+                deadline = time.monotonic() + self.flush_interval
+                while self.running and len(self.pending) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.lock.wait(remaining)
+                rows = [self.pending.popleft() for _ in range(min(len(self.pending), self.batch_size))]
+                running = self.running
+
+            if rows:
+                self._write(rows)
+            elif self._spill_size() > 0:
+                self._replay_spill()
+
+            if not running:
+                with self.lock:
+                    if not self.pending:
+                        break
+
+    def _insert(self, rows):
+        conn = self.connection_factory()
+        if not conn:
+            return False
+        started = time.perf_counter()
+        try:
+            cursor = conn.cursor()
+            self.layout.insert(cursor, rows)
+            # Keep the minute/hour rollups in step with the raw rows
+            apply_rollups(cursor, rows)
+            conn.commit()
+            cursor.close()
+            INGEST_INSERT_SECONDS.labels('ok').observe(time.perf_counter() - started)
+            INGEST_BATCH_ROWS.observe(len(rows))
+            return True
+        except mysql.connector.Error as err:
+            logger.error(f"Error inserting sensor batch: {err}")
+            try:
+                conn.rollback()
+            except mysql.connector.Error:
+                pass  # The connection is gone; the transaction died with it
+            self.layout.reset()
+            INGEST_INSERT_SECONDS.labels('error').observe(time.perf_counter() - started)
+            return False
+        finally:
+            conn.close()
+
+    def _write(self, rows):
+        start = time.monotonic()
+        if self._insert(rows):
+            with self.lock:
+                self.stats['inserted'] += len(rows)
+                self.stats['batches'] += 1
+            logger.debug(f"Flushed {len(rows)} sensor readings in {time.monotonic() - start:.3f}s")
+            # The database is healthy again; catch up on anything spilled earlier
+            if self._spill_size() > 0:
+                self._replay_spill()
+        else:
+            with self.lock:
+                self.stats['flush_errors'] += 1
+            self._spill(rows)
+
+    def _spill_size(self):
+        size = 0
+        for path in (self.spill_file, self.spill_file + '.replay'):
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return size
+
+    def _spill(self, rows):
+        """Append rows to the spill file, dropping them if it is full or can't be written"""
+        lines = ''.join(
+            f"{reading_type},{reading_value!r},{timestamp.strftime(TIMESTAMP_FORMAT)},{device_id}\n"
+            for reading_type, reading_value, timestamp, device_id in rows
+        )
+        with self.spill_lock:
+            if self._spill_size() + len(lines) > self.spill_max_bytes:
+                with self.lock:
+                    self.stats['dropped'] += len(rows)
+                logger.warning(f"Sensor spill file full, dropped {len(rows)} readings")
+                return
+            try:
+                with open(self.spill_file, 'a') as f:
+                    f.write(lines)
+            except OSError as e:
+                # Disk full, read-only directory...: the last resort failed, keep flushing anyway
+                with self.lock:
+                    self.stats['dropped'] += len(rows)
+                    self.stats['spill_errors'] += 1
+                logger.error(f"Could not write sensor spill file {self.spill_file}, dropped {len(rows)} readings: {e}")
+                return
+        with self.lock:
+            self.stats['spilled'] += len(rows)
+
+    def _replay_spill(self):
+        """Insert spilled rows in batches; keeps the rest on disk if the database fails again"""
+        replay_file = self.spill_file + '.replay'
+        # Move the spill file aside so add() can keep spilling while we replay
+        with self.spill_lock:
+            if not os.path.exists(replay_file):
+                try:
+                    os.replace(self.spill_file, replay_file)
+                except OSError:
+                    return
+
+        try:
+            with open(replay_file) as f:
+                lines = f.readlines()
+        except OSError:
+            return
+
+        entries = []
+        for line in lines:
+            try:
+                # Lines spilled before device ids existed have three fields
+                reading_type, reading_value, timestamp, *device = line.rstrip('\n').split(',', 3)
+                device_id = int(device[0]) if device else DEFAULT_DEVICE_ID
+                entries.append((line, (reading_type, float(reading_value),
+                                       datetime.strptime(timestamp, TIMESTAMP_FORMAT), device_id)))
+            except ValueError:
+                logger.warning(f"Skipping corrupt spill line: {line!r}")
+
+        written = 0
+        for i in range(0, len(entries), self.batch_size):
+            batch = [row for _, row in entries[i:i + self.batch_size]]
+            if not self._insert(batch):
+                # Keep what hasn't been written yet for the next attempt
+                with open(replay_file, 'w') as f:
+                    f.writelines(line for line, _ in entries[i:])
+                break
+            written += len(batch)
+        else:
+            os.remove(replay_file)
+
+        with self.lock:
+            self.stats['replayed'] += written
+            self.stats['inserted'] += written
+        if written:
+            logger.info(f"Replayed {written} spilled sensor readings")
@@ -0,0 +1,204 @@
+import os
+import threading
+import logging
+
+logger = logging.getLogger("SensorLayout")
+
+# Which raw table the bridge writes: 'rows' (sensor_readings, one row per key
+# with the type name repeated) or 'compact' (sensor_samples with a smallint
+# type id from the sensor_types dictionary)
+SENSOR_STORAGE_LAYOUT = os.getenv('SENSOR_STORAGE_LAYOUT', 'rows')
+
+PARTITION_CLAUSE = '''
+PARTITION BY RANGE (UNIX_TIMESTAMP(timestamp)) (
+    PARTITION pmax VALUES LESS THAN MAXVALUE
+)
+'''
+
+
+class RowLayout:
+    """The original layout: sensor_readings(device_id, reading_type VARCHAR, reading_value, timestamp)"""
+
+    name = 'rows'
+    table = 'sensor_readings'
+    device_column = 'device_id'
+    type_column = 'reading_type'
+    value_column = 'reading_value'
+    timestamp_column = 'timestamp'
+
+    INSERT_SQL = '''
+    INSERT INTO sensor_readings (reading_type, reading_value, timestamp, device_id) VALUES (%s, %s, %s, %s)
+    '''
+
+    def source(self, partition=None):
+        """FROM clause for raw reads, optionally restricted to one partition"""
+        return f"sensor_readings PARTITION ({partition})" if partition else "sensor_readings"
+
+    def create_tables(self, cursor):
+        cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS sensor_readings (
+            id INT AUTO_INCREMENT,
+            device_id INT NOT NULL DEFAULT 1,
+            reading_type VARCHAR(50) NOT NULL,
+            reading_value FLOAT NOT NULL,
+            timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, timestamp),
+            INDEX idx_reading_type (reading_type),
+            INDEX idx_timestamp (timestamp)
+        )
+        {PARTITION_CLAUSE}
+        ''')
+
+    def insert(self, cursor, rows):
+        """Insert (reading_type, reading_value, timestamp, device_id) rows"""
+        cursor.executemany(self.INSERT_SQL, rows)
+
+    def reset(self):
+        """Forget cached state after a rolled back insert"""
+
+
+class CompactLayout:
+    """
+    Compact layout: sensor_samples(timestamp, device_id, type_id SMALLINT, seq,
+    value), clustered on (timestamp, device_id, type_id, seq) with no secondary
+    indexes. `seq` separates samples of one type that land in the same second
+    on the same device. The newest second written per (device, type) is
+    tracked in memory; any other second (the first batch after a restart, a
+    spill replay) continues after the highest seq already stored for it, read
+    from the primary key, so stored samples are never overwritten.
+    """
+
+    name = 'compact'
+    table = 'sensor_samples'
+    device_column = 's.device_id'
+    type_column = 't.name'
+    value_column = 's.value'
+    timestamp_column = 's.timestamp'
+
+    INSERT_SQL = '''
+    INSERT INTO sensor_samples (timestamp, device_id, type_id, seq, value) VALUES (%s, %s, %s, %s, %s)
+    '''
+
+    # (timestamp, device_id, type_id) groups looked up per MAX(seq) query
+    SEQ_LOOKUP_CHUNK = 500
+
+    def __init__(self):
+        self.type_ids = {}
+        self.last_second = {}  # (device_id, type_id) -> (second, seq) of the newest sample written
+        self.lock = threading.Lock()
+
+    def source(self, partition=None):
+        samples = f"sensor_samples PARTITION ({partition})" if partition else "sensor_samples"
+        return f"{samples} AS s JOIN sensor_types AS t ON t.id = s.type_id"
+
+    def create_tables(self, cursor):
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sensor_types (
+            id SMALLINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(50) NOT NULL,
+            UNIQUE KEY uq_sensor_type_name (name)
+        )
+        ''')
+        cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS sensor_samples (
+            timestamp TIMESTAMP NOT NULL,
+            device_id SMALLINT UNSIGNED NOT NULL DEFAULT 1,
+            type_id SMALLINT UNSIGNED NOT NULL,
+            seq SMALLINT UNSIGNED NOT NULL DEFAULT 0,
+            value FLOAT NOT NULL,
+            PRIMARY KEY (timestamp, device_id, type_id, seq)
+        )
+        {PARTITION_CLAUSE}
+        ''')
+
+    def resolve_type_ids(self, cursor, names):
+        """Map type names to ids, registering new types in sensor_types"""
+        missing = [name for name in names if name not in self.type_ids]
+        if missing:
+            cursor.executemany(
+                "INSERT INTO sensor_types (name) VALUES (%s) ON DUPLICATE KEY UPDATE name = name",
+                [(name,) for name in missing]
+            )
+            cursor.execute("SELECT id, name FROM sensor_types")
+            for type_id, name in cursor.fetchall():
+                self.type_ids[name] = type_id
+        return self.type_ids
+
+    def stored_seqs(self, cursor, groups):
+        """{(second, device_id, type_id): highest stored seq} for the groups that already have samples"""
+        stored = {}
+        groups = list(groups)
+        for start in range(0, len(groups), self.SEQ_LOOKUP_CHUNK):
+            chunk = groups[start:start + self.SEQ_LOOKUP_CHUNK]
+            cursor.execute(f"""
+                SELECT timestamp, device_id, type_id, MAX(seq)
+                FROM sensor_samples
+                WHERE (timestamp, device_id, type_id) IN ({', '.join(['(%s, %s, %s)'] * len(chunk))})
+                GROUP BY timestamp, device_id, type_id
+            """, [value for group in chunk for value in group])
+            for second, device_id, type_id, seq in cursor.fetchall():
+                stored[(second, device_id, type_id)] = seq
+        return stored
+
+    def insert(self, cursor, rows):
+        """Insert (reading_type, reading_value, timestamp, device_id) rows as compact samples"""
+        type_ids = self.resolve_type_ids(cursor, {row[0] for row in rows})
+        rows = sorted(rows, key=lambda row: row[2])
+        samples = []
+        with self.lock:
+            # TIMESTAMP keeps whole seconds; number samples within each second.
+            # A second after the newest one this process wrote is known to be
+            # empty; anything else may already hold samples in the table.
+            unknown = set()
+            for reading_type, _, timestamp, device_id in rows:
+                key = (device_id, type_ids[reading_type])
+                second = timestamp.replace(microsecond=0)
+                last = self.last_second.get(key)
+                if last is None or second < last[0]:
+                    unknown.add((second, device_id, key[1]))
+            next_seq = {group: seq + 1 for group, seq in self.stored_seqs(cursor, unknown).items()}
+
+            for reading_type, reading_value, timestamp, device_id in rows:
+                key = (device_id, type_ids[reading_type])
+                second = timestamp.replace(microsecond=0)
+                group = (second, device_id, key[1])
+                last = self.last_second.get(key)
+                if last is not None and last[0] == second:
+                    seq = last[1] + 1
+                else:
+                    seq = next_seq.get(group, 0)
+                if last is None or second >= last[0]:
+                    self.last_second[key] = (second, seq)
+                else:
+                    next_seq[group] = seq + 1
+                samples.append((second, device_id, key[1], seq, reading_value))
+        cursor.executemany(self.INSERT_SQL, samples)
+
+    def reset(self):
+        """
+        Forget cached type ids and seqs after a rolled back insert (new types
+        may not exist, and the next batch re-reads seqs from the table)
+        """
+        with self.lock:
+            self.type_ids = {}
+            self.last_second = {}
+
+
+LAYOUTS = {
+    RowLayout.name: RowLayout,
+    CompactLayout.name: CompactLayout
+}
+
+_layout = None
+
+
+def get_layout(name=None):
+    """Return the configured layout (a shared instance unless `name` is given)"""
+    global _layout
+    if name is not None:
+        return LAYOUTS[name]()
+    if _layout is None:
+        if SENSOR_STORAGE_LAYOUT not in LAYOUTS:
+            logger.warning(f"Unknown SENSOR_STORAGE_LAYOUT '{SENSOR_STORAGE_LAYOUT}', using 'rows'")
+        _layout = LAYOUTS.get(SENSOR_STORAGE_LAYOUT, RowLayout)()
+    return _layout
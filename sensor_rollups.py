@@ -0,0 +1,276 @@
+import os
+import logging
+
+from sensor_layout import get_layout
+
+logger = logging.getLogger("SensorRollups")
+
+# Rollup tables, keyed by bucket start, device and reading type. count/sum/min/max/sumsq
+# are enough to derive average, range and standard deviation for any span of
+# buckets without touching sensor_readings.
+ROLLUP_TABLES = {
+    'minute': 'sensor_rollup_minute',
+    'hour': 'sensor_rollup_hour'
+}
+
+BUCKET_FORMATS = {
+    'minute': '%Y-%m-%d %H:%M:00',
+    'hour': '%Y-%m-%d %H:00:00'
+}
+
+BUCKET_SECONDS = {
+    'minute': 60,
+    'hour': 3600
+}
+
+ROLLUP_TABLE_SQL = '''
+CREATE TABLE IF NOT EXISTS {table} (
+    device_id INT NOT NULL DEFAULT 1,
+    reading_type VARCHAR(50) NOT NULL,
+    bucket_start DATETIME NOT NULL,
+    reading_count INT NOT NULL,
+    value_sum DOUBLE NOT NULL,
+    value_min FLOAT NOT NULL,
+    value_max FLOAT NOT NULL,
+    value_sumsq DOUBLE NOT NULL,
+    PRIMARY KEY (bucket_start, device_id, reading_type)
+)
+'''
+
+UPSERT_SQL = '''
+INSERT INTO {table}
+    (device_id, reading_type, bucket_start, reading_count, value_sum, value_min, value_max, value_sumsq)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE
+    reading_count = reading_count + VALUES(reading_count),
+    value_sum = value_sum + VALUES(value_sum),
+    value_min = LEAST(value_min, VALUES(value_min)),
+    value_max = GREATEST(value_max, VALUES(value_max)),
+    value_sumsq = value_sumsq + VALUES(value_sumsq)
+'''
+
+BACKFILL_SQL = '''
+INSERT INTO {table}
+    (device_id, reading_type, bucket_start, reading_count, value_sum, value_min, value_max, value_sumsq)
+SELECT
+    {device_column},
+    {type_column},
+    DATE_FORMAT({timestamp_column}, '{bucket_format}') AS bucket,
+    COUNT(*),
+    SUM({value_column}),
+    MIN({value_column}),
+    MAX({value_column}),
+    SUM({value_column} * {value_column})
+FROM
+    {source}
+GROUP BY
+    {device_column}, {type_column}, bucket
+'''
+
+# Window start for each dashboard timeframe, and which rollup answers it
+TIMEFRAMES = {
+    '1h': ('minute', 'DATE_SUB(NOW(), INTERVAL 1 HOUR)'),
+    '24h': ('hour', 'DATE_SUB(NOW(), INTERVAL 24 HOUR)'),
+    '7d': ('hour', 'DATE_SUB(NOW(), INTERVAL 7 DAY)')
+}
+DEFAULT_TIMEFRAME = '24h'
+
+# 'rollup' answers analytics from the rollup tables; 'raw' scans the raw
+# layout instead (slow, but handy to cross-check the rollups)
+ANALYTICS_SOURCE = os.getenv('ANALYTICS_SOURCE', 'rollup')
+
+
+def create_rollup_tables(cursor, layout=None):
+    """Create the rollup tables, backfilling them from the raw layout when new"""
+    layout = layout or get_layout()
+    for granularity, table in ROLLUP_TABLES.items():
+        cursor.execute(ROLLUP_TABLE_SQL.format(table=table))
+        cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        if cursor.fetchone()[0] == 0:
+            cursor.execute(BACKFILL_SQL.format(
+                table=table,
+                bucket_format=BUCKET_FORMATS[granularity],
+                device_column=layout.device_column,
+                type_column=layout.type_column,
+                value_column=layout.value_column,
+                timestamp_column=layout.timestamp_column,
+                source=layout.source()
+            ))
+            logger.info(f"Backfilled {table} from {layout.table}")
+
+
+def truncate_timestamp(timestamp, granularity):
+    if granularity == 'minute':
+        return timestamp.replace(second=0, microsecond=0)
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def aggregate_rows(rows, granularity):
+    """Fold (reading_type, reading_value, timestamp, device_id) rows into rollup upsert parameters"""
+    buckets = {}
+    for reading_type, reading_value, timestamp, device_id in rows:
+        key = (device_id, reading_type, truncate_timestamp(timestamp, granularity))
+        bucket = buckets.get(key)
+        if bucket is None:
+            buckets[key] = [1, reading_value, reading_value, reading_value, reading_value * reading_value]
+        else:
+            bucket[0] += 1
+            bucket[1] += reading_value
+            bucket[2] = min(bucket[2], reading_value)
+            bucket[3] = max(bucket[3], reading_value)
+            bucket[4] += reading_value * reading_value
+    return [(*key, *values) for key, values in buckets.items()]
+
+
+def apply_rollups(cursor, rows):
+    """Add a batch of freshly inserted readings to every rollup table"""
+    for granularity, table in ROLLUP_TABLES.items():
+        cursor.executemany(UPSERT_SQL.format(table=table), aggregate_rows(rows, granularity))
+
+
+def device_filter(column, device_id):
+    """SQL condition restricting a query to one device (all devices when None)"""
+    return f"AND {column} = {int(device_id)}" if device_id is not None else ""
+
+
+def query_raw_analytics(cursor, timeframe='24h', layout=None, device_id=None):
+    """Same result as query_sensor_analytics, computed from the raw readings"""
+    if timeframe not in TIMEFRAMES:
+        timeframe = DEFAULT_TIMEFRAME
+    layout = layout or get_layout()
+    _, window_start = TIMEFRAMES[timeframe]
+    reading_type = layout.type_column
+    value = layout.value_column
+    timestamp = layout.timestamp_column
+    device_sql = device_filter(layout.device_column, device_id)
+
+    cursor.execute(f"""
+        SELECT
+            {reading_type} AS reading_type,
+            AVG({value}) AS avg_value,
+            MIN({value}) AS min_value,
+            MAX({value}) AS max_value,
+            STDDEV({value}) AS stddev_value,
+            COUNT(*) AS reading_count
+        FROM
+            {layout.source()}
+        WHERE
+            {timestamp} >= {window_start} {device_sql}
+        GROUP BY
+            {reading_type}
+    """)
+    summary_stats = cursor.fetchall()
+
+    cursor.execute(f"""
+        SELECT
+            {reading_type} AS reading_type,
+            DATE_FORMAT({timestamp}, '{BUCKET_FORMATS['hour']}') AS hour_bucket,
+            AVG({value}) AS avg_value
+        FROM
+            {layout.source()}
+        WHERE
+            {timestamp} >= {window_start} {device_sql}
+        GROUP BY
+            {reading_type}, hour_bucket
+        ORDER BY
+            hour_bucket
+    """)
+    time_series = cursor.fetchall()
+
+    return summary_stats, time_series
+
+
+def query_sensor_analytics(cursor, timeframe='24h', source=None, device_id=None):
+    """
+    Return (summary, time_series) for the dashboard from the rollup tables,
+    for one device or (device_id=None) all of them. `cursor` must be a
+    dictionary cursor. Rollups are updated in the same transaction as the raw
+    inserts, so the current bucket is already included.
+    """
+    if timeframe not in TIMEFRAMES:
+        timeframe = DEFAULT_TIMEFRAME
+    if (source or ANALYTICS_SOURCE) == 'raw':
+        return query_raw_analytics(cursor, timeframe, device_id=device_id)
+    summary_stats = query_sensor_summary(cursor, timeframe, device_id=device_id)
+
+    # Get time series data for charts (hourly averages)
+    _, window_start = TIMEFRAMES[timeframe]
+    hour_format = BUCKET_FORMATS['hour']
+    cursor.execute(f"""
+        SELECT
+            reading_type,
+            DATE_FORMAT(bucket_start, '{hour_format}') AS hour_bucket,
+            SUM(value_sum) / SUM(reading_count) AS avg_value
+        FROM
+            {ROLLUP_TABLES['hour']}
+        WHERE
+            bucket_start >= DATE_FORMAT({window_start}, '{hour_format}') {device_filter('device_id', device_id)}
+        GROUP BY
+            reading_type, hour_bucket
+        ORDER BY
+            hour_bucket
+    """)
+    time_series = cursor.fetchall()
+
+    return summary_stats, time_series
+
+
+def query_sensor_summary(cursor, timeframe='24h', source=None, device_id=None):
+    """Per reading type average/min/max/stddev/count for the timeframe, from the rollups"""
+    if timeframe not in TIMEFRAMES:
+        timeframe = DEFAULT_TIMEFRAME
+    if (source or ANALYTICS_SOURCE) == 'raw':
+        return query_raw_analytics(cursor, timeframe, device_id=device_id)[0]
+    granularity, window_start = TIMEFRAMES[timeframe]
+    table = ROLLUP_TABLES[granularity]
+    bucket_format = BUCKET_FORMATS[granularity]
+
+    # Whole buckets overlapping the window, matching the old raw-table query
+    window_sql = f"bucket_start >= DATE_FORMAT({window_start}, '{bucket_format}')"
+    device_sql = device_filter('device_id', device_id)
+
+    cursor.execute(f"""
+        SELECT
+            reading_type,
+            SUM(value_sum) / SUM(reading_count) AS avg_value,
+            MIN(value_min) AS min_value,
+            MAX(value_max) AS max_value,
+            SQRT(GREATEST(SUM(value_sumsq) / SUM(reading_count)
+                 - POW(SUM(value_sum) / SUM(reading_count), 2), 0)) AS stddev_value,
+            SUM(reading_count) AS reading_count
+        FROM
+            {table}
+        WHERE
+            {window_sql} {device_sql}
+        GROUP BY
+            reading_type
+    """)
+    return cursor.fetchall()
+
+
+def query_bucket_series(cursor, timeframe='24h', granularity=None, device_id=None):
+    """
+    (reading_type, bucket_start, avg_value) rows for every minute or hour
+    bucket in the timeframe (default: the timeframe's own granularity),
+    oldest first; devices are averaged together when device_id is None
+    """
+    if timeframe not in TIMEFRAMES:
+        timeframe = DEFAULT_TIMEFRAME
+    default_granularity, window_start = TIMEFRAMES[timeframe]
+    granularity = granularity if granularity in ROLLUP_TABLES else default_granularity
+    cursor.execute(f"""
+        SELECT
+            reading_type,
+            bucket_start,
+            SUM(value_sum) / SUM(reading_count) AS avg_value
+        FROM
+            {ROLLUP_TABLES[granularity]}
+        WHERE
+            bucket_start >= DATE_FORMAT({window_start}, '{BUCKET_FORMATS[granularity]}')
+            {device_filter('device_id', device_id)}
+        GROUP BY
+            reading_type, bucket_start
+        ORDER BY
+            bucket_start
+    """)
+    return cursor.fetchall()
@@ -0,0 +1,201 @@
+import os
+import logging
+from datetime import date, datetime, timedelta
+
+import mysql.connector
+
+from sensor_layout import get_layout
+from sensor_rollups import ROLLUP_TABLES
+
+logger = logging.getLogger("SensorStorage")
+
+# Retention configuration (days)
+RAW_RETENTION_DAYS = int(os.getenv('RAW_RETENTION_DAYS', '14'))
+MINUTE_ROLLUP_RETENTION_DAYS = int(os.getenv('MINUTE_ROLLUP_RETENTION_DAYS', '14'))
+PARTITION_DAYS_AHEAD = int(os.getenv('PARTITION_DAYS_AHEAD', '3'))
+DELETE_CHUNK_SIZE = 10000  # Rows per DELETE when the table isn't partitioned
+
+PARTITION_PREFIX = 'p'
+MAX_PARTITION = 'pmax'
+
+
+def partition_name(day):
+    return f"{PARTITION_PREFIX}{day.strftime('%Y%m%d')}"
+
+
+def partition_day(name):
+    """Day held by a daily partition, or None for pmax/foreign partitions"""
+    try:
+        return datetime.strptime(name[len(PARTITION_PREFIX):], '%Y%m%d').date()
+    except ValueError:
+        return None
+
+
+def partition_definition(day):
+    """Daily partition holding rows with day <= timestamp < day + 1"""
+    upper = (day + timedelta(days=1)).strftime('%Y-%m-%d 00:00:00')
+    return f"PARTITION {partition_name(day)} VALUES LESS THAN (UNIX_TIMESTAMP('{upper}'))"
+
+
+class SensorStorageManager:
+    """
+    Maintains the daily RANGE partitions of the raw readings table
+    (sensor_readings or sensor_samples, per the storage layout): creates them
+    ahead of time, and once a day falls out of RAW_RETENTION_DAYS folds it into
+    the hour rollup (the long-term history) and drops the whole partition.
+    Minute rollups are pruned on their own retention. If the table hasn't been
+    migrated to the partitioned layout yet, expired rows are deleted in chunks.
+    """
+
+    def __init__(self, connection_factory, raw_retention_days=RAW_RETENTION_DAYS,
+                 minute_retention_days=MINUTE_ROLLUP_RETENTION_DAYS,
+                 days_ahead=PARTITION_DAYS_AHEAD, layout=None):
+        self.connection_factory = connection_factory
+        self.layout = layout or get_layout()
+        self.table = self.layout.table
+        self.raw_retention_days = raw_retention_days
+        self.minute_retention_days = minute_retention_days
+        self.days_ahead = days_ahead
+
+    def get_partitions(self, cursor):
+        """Return the daily partition names of the raw table, oldest first"""
+        cursor.execute("""
+            SELECT PARTITION_NAME
+            FROM information_schema.PARTITIONS
+            WHERE TABLE_SCHEMA = DATABASE()
+              AND TABLE_NAME = %s
+              AND PARTITION_NAME IS NOT NULL
+            ORDER BY PARTITION_ORDINAL_POSITION
+        """, (self.table,))
+        return [row[0] for row in cursor.fetchall()]
+
+    def ensure_partitions(self, cursor, partitions, today):
+        """Split pmax so that every day up to today + days_ahead has its own partition"""
+        days = [partition_day(name) for name in partitions]
+        days = [day for day in days if day is not None]
+        if days:
+            start = max(days) + timedelta(days=1)
+        else:
+            # Only pmax exists: start from the oldest row it holds
+            cursor.execute(f"SELECT DATE(MIN(timestamp)) FROM {self.table}")
+            start = cursor.fetchone()[0] or today
+
+        end = today + timedelta(days=self.days_ahead)
+        new_days = []
+        day = start
+        while day <= end:
+            new_days.append(day)
+            day += timedelta(days=1)
+        if not new_days:
+            return []
+
+        definitions = ', '.join(partition_definition(day) for day in new_days)
+        cursor.execute(f"""
+            ALTER TABLE {self.table} REORGANIZE PARTITION {MAX_PARTITION} INTO (
+                {definitions},
+                PARTITION {MAX_PARTITION} VALUES LESS THAN MAXVALUE
+            )
+        """)
+        logger.info(f"Created {len(new_days)} {self.table} partitions up to {new_days[-1]}")
+        return new_days
+
+    def downsample_day(self, cursor, day, partition=None):
+        """Recompute the hour rollup for one day from its raw rows before they are dropped"""
+        layout = self.layout
+        value = layout.value_column
+        next_day = day + timedelta(days=1)
+        cursor.execute(f"""
+            INSERT INTO {ROLLUP_TABLES['hour']}
+                (device_id, reading_type, bucket_start, reading_count, value_sum, value_min, value_max, value_sumsq)
+            SELECT
+                {layout.device_column},
+                {layout.type_column},
+                DATE_FORMAT({layout.timestamp_column}, '%Y-%m-%d %H:00:00') AS bucket,
+                COUNT(*),
+                SUM({value}),
+                MIN({value}),
+                MAX({value}),
+                SUM({value} * {value})
+            FROM
+                {layout.source(partition)}
+            WHERE
+                {layout.timestamp_column} >= '{day}' AND {layout.timestamp_column} < '{next_day}'
+            GROUP BY
+                {layout.device_column}, {layout.type_column}, bucket
+            ON DUPLICATE KEY UPDATE
+                reading_count = VALUES(reading_count),
+                value_sum = VALUES(value_sum),
+                value_min = VALUES(value_min),
+                value_max = VALUES(value_max),
+                value_sumsq = VALUES(value_sumsq)
+        """)
+
+    def expire_partitions(self, cursor, partitions, today):
+        """Downsample and drop daily partitions older than the raw retention"""
+        cutoff = today - timedelta(days=self.raw_retention_days)
+        expired = [name for name in partitions
+                   if partition_day(name) is not None and partition_day(name) < cutoff]
+        for name in expired:
+            self.downsample_day(cursor, partition_day(name), partition=name)
+            cursor.execute(f"ALTER TABLE {self.table} DROP PARTITION {name}")
+            logger.info(f"Dropped expired {self.table} partition {name}")
+        return expired
+
+    def expire_unpartitioned(self, conn, cursor, today):
+        """Fallback for an unmigrated table: downsample, then delete expired rows in chunks"""
+        cutoff = today - timedelta(days=self.raw_retention_days)
+        cursor.execute(f"SELECT DATE(MIN(timestamp)) FROM {self.table}")
+        oldest = cursor.fetchone()[0]
+        if oldest is None or oldest >= cutoff:
+            return 0
+
+        day = oldest
+        while day < cutoff:
+            self.downsample_day(cursor, day)
+            day += timedelta(days=1)
+        conn.commit()
+
+        deleted = 0
+        while True:
+            cursor.execute(
+                f"DELETE FROM {self.table} WHERE timestamp < %s LIMIT %s",
+                (cutoff, DELETE_CHUNK_SIZE)
+            )
+            conn.commit()
+            deleted += cursor.rowcount
+            if cursor.rowcount < DELETE_CHUNK_SIZE:
+                break
+        logger.info(f"Deleted {deleted} expired sensor readings (table is not partitioned)")
+        return deleted
+
+    def prune_minute_rollups(self, cursor, today):
+        cutoff = today - timedelta(days=self.minute_retention_days)
+        cursor.execute(
+            f"DELETE FROM {ROLLUP_TABLES['minute']} WHERE bucket_start < %s",
+            (cutoff,)
+        )
+
+    def maintain(self, today=None):
+        """Run one maintenance pass; safe to call repeatedly"""
+        today = today or date.today()
+        conn = self.connection_factory()
+        if not conn:
+            return False
+
+        try:
+            cursor = conn.cursor()
+            partitions = self.get_partitions(cursor)
+            if MAX_PARTITION in partitions:
+                self.expire_partitions(cursor, partitions, today)
+                self.ensure_partitions(cursor, self.get_partitions(cursor), today)
+            else:
+                self.expire_unpartitioned(conn, cursor, today)
+            self.prune_minute_rollups(cursor, today)
+            conn.commit()
+            cursor.close()
+            return True
+        except mysql.connector.Error as err:
+            logger.error(f"Sensor storage maintenance failed: {err}")
+            return False
+        finally:
+            conn.close()
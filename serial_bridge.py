@@ -1,21 +1,29 @@
-import serial
-import time
+import asyncio
 import mysql.connector
 import os
 from dotenv import load_dotenv
 import logging
 import signal
 import sys
+import time
+from datetime import datetime
+from control_channel import ControlSubscriber
+from control_writes import ControlWriteBuffer, query_operation_stats
+from devices import (DEFAULT_DEVICE_ID, load_devices, parse_serial_ports,
+                     register_device, set_device_status)
+from serial_engine import ACK_PREFIX, SerialEngine
+from serial_messages import CONTROL_COMMANDS, MessageRegistry, control_command, parse_fields, parse_readings
+from chart_series import CHART_MAX_POINTS, chart_payload, rows_to_series
+from live_series import TimeSeriesStore, warm_store
+from sensor_ingest import SensorIngestBuffer
+from sensor_storage import SensorStorageManager
+from sensor_rollups import BUCKET_SECONDS, TIMEFRAMES, query_bucket_series, query_sensor_summary
+from telemetry import TelemetryPublisher
+from metrics import Counter, start_http_server
+from logging_setup import configure_logging
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("serial_bridge.log"),
-        logging.StreamHandler()
-    ]
-)
+# Configure logging: queued, rotated and rate-limited so callers never wait on disk
+configure_logging("serial_bridge.log")
 logger = logging.getLogger("SerialBridge")
 
 # Load environment variables
@@ -30,14 +38,41 @@ DB_CONFIG = {
 }
 
 # Serial port configuration
-SERIAL_PORT = os.getenv('SERIAL_PORT', 'COM3')  # Default to COM3
+SERIAL_PORT = os.getenv('SERIAL_PORT', 'COM3')  # Default to COM3, used for the default device
+# Supervisor mode: "1=/dev/ttyUSB0,2=/dev/ttyUSB1" bridges one vehicle per port.
+# When unset, ports come from device.serial_port, falling back to SERIAL_PORT.
+SERIAL_PORTS = os.getenv('SERIAL_PORTS', '')
 BAUD_RATE = 9600
-RECONNECT_DELAY = 5  # Seconds to wait before trying to reconnect
+RECONNECT_DELAY = 5  # Seconds before the first reconnect attempt, doubling up to MAX_RECONNECT_DELAY
+MAX_RECONNECT_DELAY = float(os.getenv('MAX_RECONNECT_DELAY', '60'))
+# 'binary' negotiates CRC-checked frames with firmware that supports them (see protocol.py)
+SERIAL_PROTOCOL = os.getenv('SERIAL_PROTOCOL', 'ascii')
+# Control changes are pushed by the API; the DB is only re-read to reconcile
+RECONCILE_INTERVAL = float(os.getenv('CONTROL_RECONCILE_INTERVAL', '30'))
+# Pushed values newer than this may not be in drone_controls yet (the API
+# coalesces control writes), so reconciliation leaves them alone
+RECONCILE_GRACE = float(os.getenv('CONTROL_RECONCILE_GRACE', '5'))
+# Partition rotation and retention for the raw sensor readings
+STORAGE_MAINTENANCE_INTERVAL = float(os.getenv('STORAGE_MAINTENANCE_INTERVAL', '3600'))
+# Prometheus scrape listener (0 disables it)
+BRIDGE_METRICS_PORT = int(os.getenv('BRIDGE_METRICS_PORT', '9105'))
+
+# Metrics
+SERIAL_LINES = Counter('serial_lines_total', 'Lines received from the Arduino by type', ['type'])
+PARSE_FAILURES = Counter('serial_parse_failures_total', 'Arduino lines or values that could not be parsed',
+                         ['type'])
+LINES_BY_TYPE = {kind: SERIAL_LINES.labels(kind) for kind in ('sensors', 'status', 'request', 'ack', 'other')}
+SENSOR_PARSE_FAILURES = PARSE_FAILURES.labels('sensors')
+STATUS_PARSE_FAILURES = PARSE_FAILURES.labels('status')
 
 # Global variables
-arduino = None
-last_control_values = {}
-running = True
+vehicles = {}  # device_id -> VehicleBridge
+sensor_ingest = None
+control_writes = None
+live_series = TimeSeriesStore()  # recent readings for 1h analytics without MySQL
+telemetry = TelemetryPublisher()
+shutdown_event = None
+bridge_loop = None
 
 
 def get_db_connection():
@@ -50,29 +85,24 @@ def get_db_connection():
         return None
 
 
-def connect_to_arduino():
-    """Attempt to connect to the Arduino via serial port"""
-    global arduino
-    try:
-        arduino = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1)
-        logger.info(f"Connected to Arduino on {SERIAL_PORT}")
-        time.sleep(2)  # Wait for Arduino to reset after connection
-        return True
-    except serial.SerialException as e:
-        logger.error(f"Failed to connect to Arduino: {e}")
-        return False
-
-
-def read_control_values():
-    """Read control values from the database"""
+def read_control_values(device_id=None):
+    """Read control values from the database as {device_id: {control_name: value}}"""
     conn = get_db_connection()
     if not conn:
         return None
     
     try:
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT control_name, control_value FROM drone_controls")
-        controls = {item['control_name']: item['control_value'] for item in cursor.fetchall()}
+        if device_id is None:
+            cursor.execute("SELECT device_id, control_name, control_value FROM drone_controls")
+        else:
+            cursor.execute(
+                "SELECT device_id, control_name, control_value FROM drone_controls WHERE device_id = %s",
+                (device_id,)
+            )
+        controls = {}
+        for item in cursor.fetchall():
+            controls.setdefault(item['device_id'], {})[item['control_name']] = item['control_value']
         cursor.close()
         conn.close()
         return controls
@@ -83,181 +113,249 @@ def read_control_values():
         return None
 
 
-def send_to_arduino(command):
-    """Send a command to the Arduino"""
-    global arduino
-    
-    if arduino is None or not arduino.is_open:
-        logger.warning("Serial connection not open, attempting to reconnect")
-        if not connect_to_arduino():
-            return False
-    
+def update_device_status(device_id, status):
+    """Record whether a vehicle's serial link is up, for the API's device list"""
+    conn = get_db_connection()
+    if not conn:
+        return
     try:
-        # Add newline to command for Arduino to recognize end of command
-        command_with_newline = command + '\n'
-        arduino.write(command_with_newline.encode())
-        logger.info(f"Sent to Arduino: {command}")
-        
-        # Wait for response
-        time.sleep(0.1)
-        return True
-    except serial.SerialException as e:
-        logger.error(f"Error sending command to Arduino: {e}")
-        arduino = None  # Reset the connection
-        return False
+        cursor = conn.cursor()
+        set_device_status(cursor, device_id, status)
+        conn.commit()
+        cursor.close()
+    except mysql.connector.Error as err:
+        logger.error(f"Error updating status of device {device_id}: {err}")
+    finally:
+        conn.close()
 
 
-def read_from_arduino():
-    """Read any available data from Arduino"""
-    global arduino
-    
-    if arduino is None or not arduino.is_open:
-        return None
-    
+def resolve_serial_ports():
+    """
+    Ports to bridge as {device_id: port}: SERIAL_PORTS if set, else the
+    serial_port column of the device table, else SERIAL_PORT for the default
+    device. Configured devices are registered so the API can list them.
+    """
+    ports = parse_serial_ports(SERIAL_PORTS)
+    conn = get_db_connection()
+    if not conn:
+        return ports or {DEFAULT_DEVICE_ID: SERIAL_PORT}
     try:
-        if arduino.in_waiting > 0:
-            line = arduino.readline().decode('utf-8').strip()
-            return line
-        return None
-    except serial.SerialException as e:
-        logger.error(f"Error reading from Arduino: {e}")
-        arduino = None  # Reset the connection
-        return None
+        cursor = conn.cursor(dictionary=True)
+        if not ports:
+            ports = {device['id']: device['serial_port'] for device in load_devices(cursor) if device['serial_port']}
+        if not ports:
+            ports = {DEFAULT_DEVICE_ID: SERIAL_PORT}
+        for device_id, port in ports.items():
+            register_device(cursor, device_id, port)
+        conn.commit()
+        cursor.close()
+    except mysql.connector.Error as err:
+        logger.error(f"Error loading devices: {err}")
+        ports = ports or {DEFAULT_DEVICE_ID: SERIAL_PORT}
+    finally:
+        conn.close()
+    return ports
 
 
-def update_sensor_data(sensor_data):
-    """Parse sensor data and update in database"""
-    # Handle both formats: direct "SENSORS:..." and "Sending: SENSORS:..."
-    if "SENSORS:" in sensor_data:
-        # Extract the part after "SENSORS:"
-        sensors_part = sensor_data.split("SENSORS:")[1]
-        
-        # Parse sensor data format: "DIST=20;LIGHT=300"
-        try:
-            data_parts = sensors_part.split(';')
-            parsed_data = {}
-            
-            for part in data_parts:
-                if '=' in part:
-                    key, value = part.split('=')
-                    parsed_data[key] = value
-            
-            # Log the sensor values
-            logger.info(f"Received sensor data: {parsed_data}")
-            
-            # Store sensor data in the database
-            conn = get_db_connection()
-            if conn:
-                cursor = conn.cursor()
-                
-                # Insert each sensor reading as a separate row
-                for sensor_type, sensor_value in parsed_data.items():
-                    try:
-                        # Convert the sensor value to float
-                        float_value = float(sensor_value)
-                        
-                        cursor.execute(
-                            "INSERT INTO sensor_readings (reading_type, reading_value) VALUES (%s, %s)",
-                            (sensor_type, float_value)
-                        )
-                    except ValueError:
-                        logger.warning(f"Could not convert sensor value to float: {sensor_type}={sensor_value}")
-                
-                conn.commit()
-                cursor.close()
-                conn.close()
-                logger.info(f"Successfully saved sensor data to database")
-                
-        except Exception as e:
-            logger.error(f"Error parsing sensor data: {e}")
-    else:
-        logger.warning(f"Received data does not contain SENSORS format: {sensor_data}")
+class VehicleBridge:
+    """
+    Bridge state for one vehicle: its serial engine (own connection, command
+    queue and reconnect backoff) and the control values last sent to it.
+    All vehicles share the process's event loop, ingest buffer and channels.
+    """
 
-def handle_status_update(status_message):
-    """Handle status update from Arduino"""
-    if "STATUS:" not in status_message:
-        return
-    
-    # Extract the part after "STATUS:"
-    status_part = status_message.split("STATUS:")[1]
-    
-    # Parse status update format: "DRIVE=stop;REASON=obstacle"
-    try:
-        parts = status_part.split(';')
-        updates = {}
+    def __init__(self, device_id, port):
+        self.device_id = device_id
+        self.port = port
+        self.last_control_values = {}
+        self.pushed_at = {}  # control_name -> monotonic time of its last pushed change
+        self.engine = SerialEngine(
+            port, BAUD_RATE, self.handle_line,
+            reconnect_delay=RECONNECT_DELAY,
+            max_reconnect_delay=MAX_RECONNECT_DELAY,
+            protocol=SERIAL_PROTOCOL,
+            on_connect=self.on_connect,
+            on_disconnect=self.on_disconnect
+        )
+
+    def handle_line(self, line):
+        return handle_arduino_line(line, self.device_id)
+
+    def send(self, command):
+        """Queue a command for the Arduino; the serial engine paces the writes"""
+        if not self.engine.submit(command):
+            logger.warning(f"Serial engine for device {self.device_id} not running, dropping command: {command}")
+            return False
+        return True
+
+    def on_connect(self):
+        # Ask the Arduino for a full resync whenever the port (re)opens
+        self.send("GET_ALL")
+        self._report_link('online')
+
+    def on_disconnect(self):
+        self._report_link('offline')
+
+    def _report_link(self, status):
+        telemetry.publish('status', {'LINK': status}, self.device_id)
+        asyncio.get_running_loop().run_in_executor(None, update_device_status, self.device_id, status)
+
+    def process_control_changes(self, new_values):
+        """Send the controls whose value changed since the last update"""
+        if not new_values:
+            return
         
-        for part in parts:
-            if '=' in part:
-                key, value = part.split('=')
-                updates[key] = value
+        commands_to_send = [
+            control_command(name, new_values[name])
+            for name in CONTROL_COMMANDS
+            if name in new_values and (not self.last_control_values
+                                       or new_values[name] != self.last_control_values.get(name))
+        ]
         
-        # Update database if arduino reports state change
-        if 'DRIVE' in updates:
-            conn = get_db_connection()
-            if conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "UPDATE drone_controls SET control_value = %s WHERE control_name = %s",
-                    (updates['DRIVE'], 'drive_motor')
-                )
-                conn.commit()
-                cursor.close()
-                conn.close()
-                logger.info(f"Updated database with Arduino status: drive_motor = {updates['DRIVE']}")
-    except Exception as e:
-        logger.error(f"Error handling status update: {e}")
+        for command in commands_to_send:
+            if not self.send(command):
+                logger.warning(f"Failed to send command to device {self.device_id}: {command}")
         
-def process_control_changes(new_values):
-    """Process any changes in control values and send to Arduino"""
-    global last_control_values
-    
-    if not new_values:
+        # Update last known values
+        if commands_to_send:
+            self.last_control_values = dict(new_values)
+
+    def send_all_controls(self, control_values):
+        """Send every control value to the Arduino, e.g. after it requests a resync"""
+        for name in CONTROL_COMMANDS:
+            if name in control_values:
+                self.send(control_command(name, control_values[name]))
+        self.last_control_values = dict(control_values)
+
+    async def start(self):
+        # Keep going without the device; the engine retries with backoff
+        await self.engine.start(require_connection=False)
+        if not self.engine.is_connected:
+            self._report_link('offline')
+
+    async def stop(self):
+        await self.engine.stop()
+
+
+def record_sensor_readings(parsed, device_id=DEFAULT_DEVICE_ID):
+    """Queue parsed sensor readings for the database and push them to dashboards"""
+    readings, invalid = parsed
+    for part in invalid:
+        SENSOR_PARSE_FAILURES.inc()
+        logger.warning(f"Could not convert sensor value to float: {part}")
+    if not readings:
         return
     
-    commands_to_send = []
-    
-    # Check for changes in drive motor
-    if 'drive_motor' in new_values and (not last_control_values or new_values['drive_motor'] != last_control_values.get('drive_motor')):
-        commands_to_send.append(f"DRIVE:{new_values['drive_motor']}")
+    # Queue the readings; the ingest buffer batches them into the database
+    timestamp = datetime.now()
+    for sensor_type, value in readings:
+        sensor_ingest.add(sensor_type, value, timestamp, device_id)
+    live_series.add_readings(dict(readings), timestamp.timestamp(), device_id)
     
-    # Check for changes in steering
-    if 'steering' in new_values and (not last_control_values or new_values['steering'] != last_control_values.get('steering')):
-        commands_to_send.append(f"STEER:{new_values['steering']}")
+    # Push the live values to dashboards
+    telemetry.publish('sensors', dict(readings), device_id)
+
+
+async def handle_status_update(updates, device_id=DEFAULT_DEVICE_ID):
+    """Handle a parsed status update, e.g. {'DRIVE': 'stop', 'REASON': 'obstacle'}"""
+    if not updates:
+        STATUS_PARSE_FAILURES.inc()
+        return
     
-    # Check for changes in headlights
-    if 'headlights' in new_values and (not last_control_values or new_values['headlights'] != last_control_values.get('headlights')):
-        commands_to_send.append(f"LIGHTS:{new_values['headlights']}")
+    # Push the status to dashboards before touching the database
+    telemetry.publish('status', updates, device_id)
     
-    # Check for changes in LCD message
-    if 'lcd_message' in new_values and (not last_control_values or new_values['lcd_message'] != last_control_values.get('lcd_message')):
-        commands_to_send.append(f"LCD:{new_values['lcd_message']}")
+    # Record a drive state the Arduino changed itself (e.g. an obstacle stop);
+    # the write buffer keeps this off the event loop
+    if 'DRIVE' in updates:
+        control_writes.set('drive_motor', updates['DRIVE'], device_id, source='arduino')
+        logger.info(f"Queued Arduino status for the database: device {device_id} drive_motor = {updates['DRIVE']}")
+
+
+async def handle_control_request(body, device_id=DEFAULT_DEVICE_ID):
+    """Answer REQUEST:CONTROLS with every control value of the device"""
+    if body != 'CONTROLS':
+        return
+    control_values = await asyncio.to_thread(read_control_values, device_id)
+    vehicle = vehicles.get(device_id)
+    if control_values and vehicle is not None:
+        vehicle.send_all_controls(control_values.get(device_id, {}))
+
+
+# Line handlers, indexed by message tag (after the firmware's echo prefixes)
+MESSAGES = MessageRegistry()
+MESSAGES.register('SENSORS', 'sensors', record_sensor_readings, parse_readings)
+MESSAGES.register('STATUS', 'status', handle_status_update, parse_fields)
+MESSAGES.register('REQUEST', 'request', handle_control_request)
+MESSAGES.register_phrase(ACK_PREFIX.rstrip(': '), 'ack')
+
+
+def apply_pushed_changes(changes):
+    """Apply control changes pushed by the API on top of each vehicle's last known values"""
+    if not changes:
+        return
     
-    # Send all commands
-    for command in commands_to_send:
-        success = send_to_arduino(command)
-        if not success:
-            logger.warning(f"Failed to send command: {command}")
+    by_device = {}
+    for control_name, control_value, device_id in changes:
+        by_device.setdefault(device_id, {})[control_name] = control_value
     
-    # Update last known values
-    if commands_to_send:
-        last_control_values = new_values.copy()
+    logger.info(f"Received pushed control changes: {changes}")
+    now = time.monotonic()
+    for device_id, device_changes in by_device.items():
+        vehicle = vehicles.get(device_id)
+        if vehicle is None:
+            logger.warning(f"Ignoring control changes for unbridged device {device_id}")
+            continue
+        vehicle.pushed_at.update(dict.fromkeys(device_changes, now))
+        vehicle.process_control_changes({**vehicle.last_control_values, **device_changes})
+
+
+async def handle_arduino_line(response, device_id=DEFAULT_DEVICE_ID):
+    """Dispatch one line from a vehicle's Arduino; blocking DB work runs off the event loop"""
+    logger.info(f"Received from Arduino {device_id}: {response}")
+    kind = await MESSAGES.dispatch(response, device_id)
+    LINES_BY_TYPE[kind].inc()
+
+
+async def reconcile_controls(interval):
+    """Periodically re-read every vehicle's controls in case a pushed change was missed"""
+    while True:
+        new_control_values = await asyncio.to_thread(read_control_values)
+        for device_id, values in (new_control_values or {}).items():
+            vehicle = vehicles.get(device_id)
+            if vehicle is not None:
+                # Don't undo a fresh push with a value read before its write landed
+                cutoff = time.monotonic() - RECONCILE_GRACE
+                values.update({name: vehicle.last_control_values[name]
+                               for name, pushed in vehicle.pushed_at.items()
+                               if pushed > cutoff and name in vehicle.last_control_values})
+                vehicle.process_control_changes(values)
+        await asyncio.sleep(interval)
+
+
+async def maintain_storage(interval):
+    """Rotate raw sensor partitions and apply retention periodically"""
+    storage = SensorStorageManager(get_db_connection)
+    while True:
+        await asyncio.to_thread(storage.maintain)
+        await asyncio.sleep(interval)
 
 
 def signal_handler(sig, frame):
     """Handle exit signals gracefully"""
-    global running
     logger.info("Shutting down serial bridge...")
-    running = False
-    if arduino and arduino.is_open:
-        arduino.close()
-    sys.exit(0)
+    if bridge_loop is not None:
+        bridge_loop.call_soon_threadsafe(shutdown_event.set)
+    else:
+        sys.exit(0)
 
 
-def get_sensor_analytics(timeframe='24h'):
+def get_sensor_analytics(timeframe='24h', device_id=None, max_points=CHART_MAX_POINTS):
     """
     Get sensor analytics for the dashboard
-    timeframe can be '1h', '24h', '7d', etc.
+    timeframe can be '1h', '24h', '7d', etc.; device_id=None covers all vehicles
     """
+    resolution = TIMEFRAMES.get(timeframe, TIMEFRAMES['24h'])[0]
     conn = get_db_connection()
     if not conn:
         return None
@@ -265,76 +363,24 @@ def get_sensor_analytics(timeframe='24h'):
     try:
         cursor = conn.cursor(dictionary=True)
         
-        # Calculate the time boundary based on the timeframe
-        if timeframe == '1h':
-            time_sql = "timestamp >= DATE_SUB(NOW(), INTERVAL 1 HOUR)"
-        elif timeframe == '24h':
-            time_sql = "timestamp >= DATE_SUB(NOW(), INTERVAL 24 HOUR)"
-        elif timeframe == '7d':
-            time_sql = "timestamp >= DATE_SUB(NOW(), INTERVAL 7 DAY)"
+        # Answer from memory when it holds the whole window, else from the
+        # minute/hour rollups maintained at ingest time
+        live = live_series.analytics(timeframe, device_id, resolution)
+        if live is not None:
+            summary_stats, series = live
         else:
-            time_sql = "timestamp >= DATE_SUB(NOW(), INTERVAL 24 HOUR)"  # Default to 24h
+            summary_stats = query_sensor_summary(cursor, timeframe, device_id=device_id)
+            series = rows_to_series(query_bucket_series(cursor, timeframe, resolution, device_id))
         
-        # Get summary stats for each sensor type
-        cursor.execute(f"""
-            SELECT 
-                reading_type, 
-                AVG(reading_value) AS avg_value,
-                MIN(reading_value) AS min_value,
-                MAX(reading_value) AS max_value,
-                COUNT(*) AS reading_count
-            FROM 
-                sensor_readings
-            WHERE 
-                {time_sql}
-            GROUP BY 
-                reading_type
-        """)
-        
-        summary_stats = cursor.fetchall()
-        
-        # Get time series data for charts (hourly averages)
-        cursor.execute(f"""
-            SELECT 
-                reading_type,
-                DATE_FORMAT(timestamp, '%Y-%m-%d %H:00:00') AS hour_bucket,
-                AVG(reading_value) AS avg_value
-            FROM 
-                sensor_readings
-            WHERE 
-                {time_sql}
-            GROUP BY 
-                reading_type, hour_bucket
-            ORDER BY 
-                hour_bucket
-        """)
-        
-        time_series = cursor.fetchall()
-        
-        # Get operation stats based on control changes
-        cursor.execute(f"""
-            SELECT 
-                control_name,
-                control_value,
-                COUNT(*) AS change_count
-            FROM 
-                drone_controls_history
-            WHERE 
-                updated_at >= DATE_SUB(NOW(), INTERVAL 24 HOUR)
-            GROUP BY 
-                control_name, control_value
-            ORDER BY 
-                control_name, change_count DESC
-        """)
-        
-        operation_stats = cursor.fetchall()
+        # Get operation stats from the indexed control history
+        operation_stats = query_operation_stats(cursor, timeframe, device_id)
         
         cursor.close()
         conn.close()
         
         return {
             'summary': summary_stats,
-            'time_series': time_series,
+            'series': chart_payload(series, resolution, BUCKET_SECONDS[resolution], max_points),
             'operations': operation_stats
         }
         
@@ -343,72 +389,71 @@ def get_sensor_analytics(timeframe='24h'):
         if conn:
             conn.close()
         return None
+async def run_bridge():
+    """Run a serial engine per vehicle, the control channel and reconciliation until shutdown"""
+    global sensor_ingest, control_writes, shutdown_event, bridge_loop
+    
+    bridge_loop = asyncio.get_running_loop()
+    shutdown_event = asyncio.Event()
+    
+    sensor_ingest = SensorIngestBuffer(get_db_connection)
+    sensor_ingest.start()
+    asyncio.get_running_loop().run_in_executor(None, warm_store, live_series, get_db_connection)
+    control_writes = ControlWriteBuffer(get_db_connection)
+    control_writes.start()
+    
+    metrics_server = None
+    if BRIDGE_METRICS_PORT:
+        try:
+            metrics_server = start_http_server(BRIDGE_METRICS_PORT)
+        except OSError as e:
+            logger.warning(f"Metrics listener unavailable on port {BRIDGE_METRICS_PORT}: {e}")
+    
+    ports = await asyncio.to_thread(resolve_serial_ports)
+    vehicles.clear()
+    for device_id, port in ports.items():
+        vehicles[device_id] = VehicleBridge(device_id, port)
+    logger.info(f"Bridging {len(vehicles)} vehicle(s): {ports}")
+    # Vehicles that are not connected yet keep retrying in the background
+    await asyncio.gather(*(vehicle.start() for vehicle in vehicles.values()))
+    
+    # Listen for control changes pushed by the API
+    transport = None
+    try:
+        control_subscriber = ControlSubscriber()
+        transport = await control_subscriber.attach(apply_pushed_changes)
+        reconcile_interval = RECONCILE_INTERVAL
+    except OSError as e:
+        logger.warning(f"Control channel unavailable, falling back to DB polling: {e}")
+        reconcile_interval = 1.0
+    
+    reconcile_task = asyncio.create_task(reconcile_controls(reconcile_interval))
+    storage_task = asyncio.create_task(maintain_storage(STORAGE_MAINTENANCE_INTERVAL))
+    
+    await shutdown_event.wait()
+    
+    reconcile_task.cancel()
+    storage_task.cancel()
+    if transport is not None:
+        transport.close()
+    await asyncio.gather(*(vehicle.stop() for vehicle in vehicles.values()))
+    
+    # Write out anything still buffered before exiting
+    await asyncio.to_thread(sensor_ingest.stop)
+    await asyncio.to_thread(control_writes.stop)
+    if metrics_server is not None:
+        metrics_server.shutdown()
+
+
 def main():
     """Main function to run the serial bridge"""
-    global running
-    
-    logger.info("Starting serial bridge between database and Arduino")
+    logger.info("Starting serial bridge between database and Arduinos")
     
     # Register signal handlers
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
     
-    # Connect to Arduino
-    if not connect_to_arduino():
-        logger.error(f"Could not connect to Arduino on {SERIAL_PORT}. Check connection and try again.")
-        return
-    
-    # Send initial command to request control values from Arduino
-    send_to_arduino("GET_ALL")
-    
-    poll_counter = 0
-    
-    # Main loop
-    while running:
-        try:
-            # Every 10th iteration (approximately every second), check database for updates
-            if poll_counter % 10 == 0:
-                new_control_values = read_control_values()
-                process_control_changes(new_control_values)
-            
-            # Read from Arduino
-            response = read_from_arduino()
-            if response:
-                logger.info(f"Received from Arduino: {response}")
-                
-                # Process sensor data - check if "SENSORS:" is in the response, not just at the beginning
-                if "SENSORS:" in response:
-                    update_sensor_data(response)
-                
-                # Process status updates - check if "STATUS:" is in the response, not just at the beginning
-                elif "STATUS:" in response:
-                    handle_status_update(response)
-                
-                # Process other responses - check if "REQUEST:" is in the response, not just at the beginning
-                elif "REQUEST:" in response:
-                    # Arduino is requesting data
-                    if "REQUEST:CONTROLS" in response:
-                        control_values = read_control_values()
-                        if control_values:
-                            for name, value in control_values.items():
-                                if name == 'drive_motor':
-                                    send_to_arduino(f"DRIVE:{value}")
-                                elif name == 'steering':
-                                    send_to_arduino(f"STEER:{value}")
-                                elif name == 'headlights':
-                                    send_to_arduino(f"LIGHTS:{value}")
-                                elif name == 'lcd_message':
-                                    send_to_arduino(f"LCD:{value}")
-            
-            # Wait a short time
-            time.sleep(0.1)
-            poll_counter += 1
-            if poll_counter > 100:
-                poll_counter = 0
-                
-        except Exception as e:
-            logger.error(f"Unexpected error in main loop: {e}")
-            time.sleep(1)  # Prevent tight error loop
+    asyncio.run(run_bridge())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
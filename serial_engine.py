@@ -0,0 +1,368 @@
+import asyncio
+import logging
+import random
+
+import serial
+import serial_asyncio
+
+from metrics import Counter, Gauge, Histogram
+from protocol import NEGOTIATE_COMMAND, AsciiCodec
+
+logger = logging.getLogger("SerialEngine")
+
+# The firmware echoes every command it processes on its USB serial port
+ACK_PREFIX = "Command received: "
+ACK_TIMEOUT = 0.25  # Seconds to wait for an echo before sending the next command
+ACK_MISSES_BEFORE_FALLBACK = 3  # Consecutive missed echoes before pacing by wire time
+BITS_PER_BYTE = 10  # 8N1 framing: start bit + 8 data bits + stop bit
+MAX_RECONNECT_DELAY = 60  # Cap for the exponential reconnect backoff, in seconds
+NEGOTIATE_TIMEOUT = 1.0  # Seconds to wait for the firmware to accept the binary protocol
+COMMAND_RETRIES = 2  # Retransmissions of an unacked command frame (binary protocol only)
+READ_SIZE = 512
+
+SERIAL_QUEUE_DEPTH = Gauge('serial_queue_depth', 'Lines and commands waiting in the serial engine',
+                           ['port', 'queue'])
+SERIAL_CONNECTED = Gauge('serial_connected', '1 while the serial port is open', ['port'])
+SERIAL_COMMANDS = Counter('serial_commands_sent_total', 'Commands written to the Arduino', ['port'])
+SERIAL_ACK_SECONDS = Histogram('serial_command_ack_seconds', 'Time from writing a command to its firmware echo',
+                               ['port'])
+SERIAL_ACK_TIMEOUTS = Counter('serial_ack_timeouts_total', 'Commands not echoed within the ack timeout', ['port'])
+SERIAL_RECONNECTS = Counter('serial_reconnects_total', 'Times the serial connection was lost', ['port'])
+SERIAL_RETRANSMITS = Counter('serial_command_retransmits_total', 'Command frames resent after a missing ack',
+                             ['port'])
+
+
+class SerialEngine:
+    """
+    Asyncio serial I/O engine with separate reader and writer tasks.
+
+    The reader drains every complete line as soon as it arrives and hands it to
+    `on_line` through an inbound queue, so slow handlers never back up the UART.
+    The writer sends queued commands one at a time and paces them on the
+    firmware's "Command received: ..." echo instead of fixed sleeps. If the
+    firmware does not echo (e.g. the bridge is wired to the SoftwareSerial
+    port), pacing falls back to the time the bytes take on the wire.
+
+    With protocol='binary' the engine asks the firmware for CRC-checked
+    frames (see protocol.py) after every connect. Commands are then acked by
+    sequence number and retransmitted when the ack is lost; firmware that
+    doesn't answer the request keeps talking ASCII.
+
+    Reconnects back off exponentially (with jitter) from `reconnect_delay`
+    up to `max_reconnect_delay`, so many engines on one loop don't retry a
+    missing device, or a hub that dropped all of them, in lockstep.
+
+    `port` is a device path or a pyserial URL that serial_asyncio can open
+    (it needs a file descriptor), so tests without hardware run against a
+    pty path (see fake_arduino.py) or "socket://host:port"; "loop://" has no
+    descriptor and doesn't work.
+    """
+
+    def __init__(self, port, baudrate, on_line, reconnect_delay=5,
+                 ack_timeout=ACK_TIMEOUT, settle_delay=2, on_connect=None,
+                 on_disconnect=None, max_reconnect_delay=MAX_RECONNECT_DELAY, protocol='ascii',
+                 negotiate_timeout=NEGOTIATE_TIMEOUT):
+        self.port = port
+        self.protocol = protocol
+        self.negotiate_timeout = negotiate_timeout
+        self.baudrate = baudrate
+        self.on_line = on_line
+        self.on_connect = on_connect
+        self.on_disconnect = on_disconnect
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.ack_timeout = ack_timeout
+        self.settle_delay = settle_delay
+
+        self.loop = None
+        self.reader = None
+        self.writer = None
+        self.connected = asyncio.Event()
+        self.negotiated = asyncio.Event()
+        self.codec = AsciiCodec()
+        self.outgoing = asyncio.Queue()
+        self.incoming = asyncio.Queue()
+        self._pending_ack = None
+        self._pending_command = None
+        self._ack_misses = 0
+        self._pending_seq = None
+        self._seq = 0
+        self._sent_at = None
+        self._tasks = []
+        self._reconnect_task = None
+        self._running = False
+
+        # Hot-path metric series, bound once
+        self._commands_sent = SERIAL_COMMANDS.labels(port)
+        self._ack_seconds = SERIAL_ACK_SECONDS.labels(port)
+        self._ack_timeouts = SERIAL_ACK_TIMEOUTS.labels(port)
+        self._reconnects = SERIAL_RECONNECTS.labels(port)
+        self._retransmits = SERIAL_RETRANSMITS.labels(port)
+        SERIAL_QUEUE_DEPTH.labels(port, 'outgoing').set_function(self.outgoing.qsize)
+        SERIAL_QUEUE_DEPTH.labels(port, 'incoming').set_function(self.incoming.qsize)
+        SERIAL_CONNECTED.labels(port).set_function(lambda: int(self.is_connected))
+
+    @property
+    def is_connected(self):
+        return self.connected.is_set()
+
+    async def connect(self):
+        """Open the serial port; returns True on success"""
+        try:
+            self.reader, self.writer = await serial_asyncio.open_serial_connection(
+                url=self.port, baudrate=self.baudrate
+            )
+        except (serial.SerialException, OSError) as e:
+            logger.error(f"Failed to connect to Arduino on {self.port}: {e}")
+            return False
+
+        logger.info(f"Connected to Arduino on {self.port}")
+        await asyncio.sleep(self.settle_delay)  # Wait for Arduino to reset after connection
+        # The firmware starts in ASCII after a reset; queued commands wait until
+        # the protocol is settled
+        self.codec = AsciiCodec(upgrade=self.protocol == 'binary')
+        self._seq = 0
+        # The firmware may have been reflashed or reset; give ack pacing another chance
+        self._ack_misses = 0
+        self.negotiated.clear()
+        if self.protocol == 'binary':
+            try:
+                self.writer.write(self.codec.encode(NEGOTIATE_COMMAND))
+                await self.writer.drain()
+            except (serial.SerialException, OSError) as e:
+                logger.error(f"Failed to negotiate protocol with Arduino on {self.port}: {e}")
+                self.disconnect()
+                return False
+            self.loop.call_later(self.negotiate_timeout, self._negotiation_timeout, self.codec)
+        else:
+            self.negotiated.set()
+        self.connected.set()
+        if self.on_connect:
+            self.on_connect()
+        return True
+
+    def _negotiation_timeout(self, codec):
+        if self.codec is codec and not self.negotiated.is_set():
+            # A late accept still upgrades the codec; until then commands go out as text
+            logger.warning(f"Arduino on {self.port} did not accept the binary protocol, using ASCII")
+            self.negotiated.set()
+
+    def disconnect(self):
+        """Close the serial port and fail any command waiting for an echo"""
+        self.connected.clear()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        self.reader = None
+        if self._pending_ack and not self._pending_ack.done():
+            self._pending_ack.set_result(False)
+
+    async def start(self, require_connection=True):
+        """
+        Connect and start the reader, dispatcher and writer tasks. With
+        `require_connection` a failed first connect returns False; otherwise
+        the engine starts anyway and keeps retrying in the background.
+        """
+        self.loop = asyncio.get_running_loop()
+        self._running = True
+        connected = await self.connect()
+        if not connected and require_connection:
+            return False
+
+        self._tasks = [
+            asyncio.create_task(self._reader_task()),
+            asyncio.create_task(self._dispatch_task()),
+            asyncio.create_task(self._writer_task()),
+        ]
+        if not connected:
+            self._reconnect_task = asyncio.create_task(self._retry_connect())
+        return True
+
+    async def stop(self):
+        self._running = False
+        tasks = self._tasks + ([self._reconnect_task] if self._reconnect_task else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._reconnect_task = None
+        self.disconnect()
+
+    def submit(self, command):
+        """Queue a command for the writer; safe to call from any thread"""
+        if self.loop is None or not self._running:
+            return False
+        self.loop.call_soon_threadsafe(self.outgoing.put_nowait, command)
+        return True
+
+    def _backoff(self, attempt):
+        """Delay before the `attempt`-th retry: exponential, jittered over its upper half"""
+        delay = min(self.max_reconnect_delay, self.reconnect_delay * 2 ** min(attempt, 16))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def _retry_connect(self):
+        attempt = 0
+        while self._running:
+            delay = self._backoff(attempt)
+            logger.warning(f"Arduino on {self.port} unavailable, reconnecting in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            if await self.connect():
+                return
+            attempt += 1
+
+    async def _reconnect(self):
+        """
+        Drop the connection and reconnect. The reader and the writer can both
+        notice a dead port; the second caller waits for the first one's
+        attempt instead of opening another transport.
+        """
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._reconnects.inc()
+            self.disconnect()
+            if self.on_disconnect:
+                self.on_disconnect()
+            self._reconnect_task = asyncio.create_task(self._retry_connect())
+        await asyncio.shield(self._reconnect_task)
+
+    async def _reader_task(self):
+        while self._running:
+            await self.connected.wait()
+            reader = self.reader
+            try:
+                raw = await reader.read(READ_SIZE)
+            except (serial.SerialException, OSError) as e:
+                logger.error(f"Error reading from Arduino: {e}")
+                raw = b''
+
+            if not raw:
+                # EOF or read error: the device went away, unless this was the
+                # old transport ending after someone else already reconnected
+                if reader is self.reader:
+                    await self._reconnect()
+                continue
+
+            events = self.codec.feed(raw)
+            if self.codec.next is not None:
+                self.codec = self.codec.next
+                logger.info(f"Arduino on {self.port} switched to the binary protocol")
+                self.negotiated.set()
+
+            for line, ack_seq in events:
+                if line is None:
+                    line = self._check_ack_seq(ack_seq)
+                    if line is None:
+                        continue
+                else:
+                    self._check_ack(line)
+                self.incoming.put_nowait(line)
+
+    async def _dispatch_task(self):
+        while True:
+            line = await self.incoming.get()
+            try:
+                result = self.on_line(line)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                logger.error(f"Error handling line from Arduino: {e}")
+
+    def _check_ack(self, line):
+        if self._pending_ack is None or self._pending_ack.done():
+            return
+        if line.startswith(ACK_PREFIX) and line[len(ACK_PREFIX):].strip() == self._pending_command:
+            self._pending_ack.set_result(True)
+            self._ack_misses = 0
+            self._ack_seconds.observe(self.loop.time() - self._sent_at)
+
+    def _check_ack_seq(self, seq):
+        """Resolve the pending command frame if `seq` acks it; returns the equivalent echo line"""
+        if self._pending_ack is None or self._pending_ack.done() or seq != self._pending_seq:
+            return None  # A duplicate ack for a retransmitted command
+        self._pending_ack.set_result(True)
+        self._ack_misses = 0
+        self._ack_seconds.observe(self.loop.time() - self._sent_at)
+        return ACK_PREFIX + self._pending_command
+
+    def _wire_time(self, payload):
+        return len(payload) * BITS_PER_BYTE / self.baudrate
+
+    async def _write(self, command, payload):
+        """Write one command, marking it as waiting for its ack; False if the port failed or is closed"""
+        writer = self.writer
+        if writer is None:
+            # Disconnected while waiting; the reader is already reconnecting
+            return False
+        self._pending_command = command
+        self._pending_seq = self._seq
+        self._pending_ack = self.loop.create_future()
+        try:
+            self._sent_at = self.loop.time()
+            writer.write(payload)
+            await writer.drain()
+        except (serial.SerialException, OSError) as e:
+            logger.error(f"Error sending command to Arduino: {e}")
+            self._pending_ack = None
+            if writer is self.writer:
+                await self._reconnect()
+            return False
+        logger.info(f"Sent to Arduino: {command}")
+        self._commands_sent.inc()
+        return True
+
+    async def _wait_ack(self):
+        try:
+            return await asyncio.wait_for(asyncio.shield(self._pending_ack), self.ack_timeout)
+        except asyncio.TimeoutError:
+            return False
+
+    async def _send_line(self, command):
+        payload = self.codec.encode(command)
+        if not await self._write(command, payload):
+            return
+
+        if self._ack_misses >= ACK_MISSES_BEFORE_FALLBACK:
+            # Firmware isn't echoing; only wait for the bytes to leave the wire
+            await asyncio.sleep(self._wire_time(payload))
+            return
+
+        if not await self._wait_ack():
+            if not self.is_connected:
+                return  # The port went away, not the echo
+            self._ack_timeouts.inc()
+            self._ack_misses += 1
+            if self._ack_misses == ACK_MISSES_BEFORE_FALLBACK:
+                logger.warning("No command echo from Arduino, pacing commands by wire time")
+
+    async def _send_frame(self, command):
+        """Send a command frame, resending it with the same seq until the firmware acks it"""
+        payload = self.codec.encode(command, self._seq)
+        for attempt in range(1 + COMMAND_RETRIES):
+            if attempt:
+                self._retransmits.inc()
+            if not await self._write(command, payload):
+                return
+            if await self._wait_ack():
+                return
+            if not self.is_connected:
+                # Resending on the new link is left to on_connect, which asks for a full resync
+                logger.warning(f"Dropped {command}: Arduino on {self.port} disconnected before acking it")
+                return
+            self._ack_timeouts.inc()
+        logger.warning(f"Arduino on {self.port} did not ack {command} after {1 + COMMAND_RETRIES} attempts")
+
+    async def _writer_task(self):
+        # Checked as well as cancelled: on 3.11 wait_for() in _wait_ack can
+        # swallow stop()'s cancel if the ack lands at the same moment
+        while self._running:
+            command = (await self.outgoing.get()).strip()
+            await self.connected.wait()
+            await self.negotiated.wait()
+            self._seq = self._seq % 255 + 1
+            try:
+                if self.codec.framed:
+                    await self._send_frame(command)
+                else:
+                    await self._send_line(command)
+            except Exception as e:
+                # e.g. too long for a frame; drop it rather than stop sending
+                logger.error(f"Dropped command {command!r} for Arduino on {self.port}: {e}")
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+
+logger = logging.getLogger("SerialMessages")
+
+# Debug echoes the firmware prints in front of a real message on its USB port,
+# e.g. "Sending: SENSORS:DIST=20;LIGHT=300"
+ECHO_PREFIXES = frozenset(('Sending', 'Reporting status'))
+
+# Control name -> firmware command, in the order a full resync sends them
+CONTROL_COMMANDS = {
+    'drive_motor': 'DRIVE',
+    'steering': 'STEER',
+    'headlights': 'LIGHTS',
+    'lcd_message': 'LCD'
+}
+
+
+def control_command(control_name, control_value):
+    """Firmware command for a control value, or None for controls the firmware doesn't know"""
+    command = CONTROL_COMMANDS.get(control_name)
+    return f"{command}:{control_value}" if command else None
+
+
+def parse_fields(body):
+    """Parse "KEY=value;KEY=value" into a dict; values may contain '='"""
+    fields = {}
+    for part in body.split(';'):
+        key, sep, value = part.partition('=')
+        if sep:
+            fields[key] = value
+    return fields
+
+
+def parse_readings(body):
+    """Parse "DIST=20;LIGHT=300" into ([(name, float)], [bad "name=value"])"""
+    readings = []
+    invalid = []
+    for part in body.split(';'):
+        key, sep, value = part.partition('=')
+        if not sep:
+            continue
+        try:
+            readings.append((key, float(value)))
+        except ValueError:
+            invalid.append(part)
+    return readings, invalid
+
+
+class MessageRegistry:
+    """
+    Prefix-indexed dispatch for lines from the Arduino. A line is split once
+    at its first ": " or ":"; the head is looked up in two dicts:
+
+      - `phrases`: whole-phrase prefixes such as "Command received: X"
+      - `tags`: message tags such as "SENSORS:..." (after any echo prefix)
+
+    Each entry is (kind, parser, handler). The parser turns the rest of the
+    line into the handler's argument; kind is used for counting. Lines that
+    match nothing are kind 'other' with no handler.
+    """
+
+    def __init__(self):
+        self.tags = {}
+        self.phrases = {}
+
+    def register(self, tag, kind, handler=None, parser=None):
+        """Handle "TAG:body" lines; `handler(parsed_body, *args)` may be a coroutine function"""
+        self.tags[tag] = (kind, parser, handler)
+
+    def register_phrase(self, phrase, kind, handler=None, parser=None):
+        """Handle "<phrase>: body" lines, e.g. the firmware's command echo"""
+        self.phrases[phrase] = (kind, parser, handler)
+
+    def parse(self, line):
+        """Return (kind, handler, parsed body) for one line"""
+        head, sep, rest = line.partition(': ')
+        if sep:
+            entry = self.phrases.get(head)
+            if entry is not None:
+                return entry[0], entry[2], entry[1](rest) if entry[1] else rest
+            if head in ECHO_PREFIXES:
+                line = rest
+        tag, sep, body = line.partition(':')
+        if sep:
+            entry = self.tags.get(tag)
+            if entry is not None:
+                return entry[0], entry[2], entry[1](body) if entry[1] else body
+        return 'other', None, line
+
+    async def dispatch(self, line, *args):
+        """Parse a line and run its handler; returns the kind"""
+        kind, handler, payload = self.parse(line)
+        if handler is not None:
+            result = handler(payload, *args)
+            if asyncio.iscoroutine(result):
+                await result
+        return kind
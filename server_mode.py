@@ -0,0 +1,70 @@
+import os
+
+from dotenv import load_dotenv
+
+# Read here as well as in app.py: the mode has to be known before anything is patched
+load_dotenv()
+
+# How app.py serves HTTP and Socket.IO:
+#   'eventlet' / 'gevent' - cooperative green threads on the library's production WSGI
+#                           server; one OS thread serves every viewer and API client
+#   'threading'           - the Werkzeug development server, one OS thread per connection
+SERVER_MODE = os.getenv('SERVER_MODE', 'eventlet')
+SERVER_HOST = os.getenv('SERVER_HOST', '0.0.0.0')
+SERVER_PORT = int(os.getenv('SERVER_PORT', '5000'))
+# Flask debug mode (reloader and debugger); only honoured by the threading server
+SERVER_DEBUG = os.getenv('SERVER_DEBUG', '0') == '1'
+
+SERVER_MODES = ('eventlet', 'gevent', 'threading')
+if SERVER_MODE not in SERVER_MODES:
+    raise ValueError(f"SERVER_MODE must be one of {', '.join(SERVER_MODES)}, not {SERVER_MODE!r}")
+
+ASYNC_SERVER = SERVER_MODE != 'threading'
+
+
+def monkey_patch():
+    """
+    Make socket, threading, time.sleep etc. cooperative for the async modes.
+    Must run before the rest of app.py is imported, which is why app.py calls
+    it only when run as a script; repeated calls are no-ops.
+    """
+    if SERVER_MODE == 'eventlet':
+        import eventlet
+        eventlet.monkey_patch()
+    elif SERVER_MODE == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+
+
+def offload(function, *args):
+    """
+    Call a blocking C function (OpenCV capture/encode) on a real OS thread so
+    it doesn't stall every green thread; a plain call in threading mode.
+    """
+    if SERVER_MODE == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(function, *args)
+    if SERVER_MODE == 'gevent':
+        import gevent
+        return gevent.get_hub().threadpool.apply(function, args)
+    return function(*args)
+
+
+def join(thread, timeout):
+    """Wait for a thread from socketio.start_background_task (eventlet's don't take a timeout)"""
+    if SERVER_MODE == 'eventlet':
+        thread.join()
+    else:
+        thread.join(timeout)
+
+
+def run(socketio, app):
+    """Serve the app until interrupted"""
+    if ASYNC_SERVER:
+        print(f"Serving on {SERVER_HOST}:{SERVER_PORT} with the {SERVER_MODE} server")
+        socketio.run(app, host=SERVER_HOST, port=SERVER_PORT, debug=False)
+    else:
+        # The Werkzeug server is only meant for development; Flask-SocketIO insists on the opt-in
+        print(f"Serving on {SERVER_HOST}:{SERVER_PORT} with the Werkzeug development server")
+        socketio.run(app, host=SERVER_HOST, port=SERVER_PORT, debug=SERVER_DEBUG,
+                     allow_unsafe_werkzeug=True)
@@ -0,0 +1,177 @@
+import json
+import os
+import socket
+import threading
+import time
+import logging
+from flask_socketio import join_room, leave_room
+
+from devices import DEFAULT_DEVICE_ID, parse_device_id
+
+logger = logging.getLogger("Telemetry")
+
+# Loopback channel carrying parsed Arduino telemetry from the serial bridge to
+# the Flask app, which fans it out to dashboards over Socket.IO
+TELEMETRY_CHANNEL_HOST = os.getenv('TELEMETRY_CHANNEL_HOST', '127.0.0.1')
+TELEMETRY_CHANNEL_PORT = int(os.getenv('TELEMETRY_CHANNEL_PORT', '5056'))
+TELEMETRY_ROOM = 'telemetry'  # Per-vehicle rooms are 'telemetry:<device id>'
+MAX_DATAGRAM = 4096
+
+
+class TelemetryPublisher:
+    """Fire-and-forget publisher used by the serial bridge"""
+
+    def __init__(self, host=TELEMETRY_CHANNEL_HOST, port=TELEMETRY_CHANNEL_PORT):
+        self.address = (host, port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+
+    def publish(self, event_type, data, device_id=DEFAULT_DEVICE_ID):
+        """Publish one telemetry message; returns False if it could not be sent"""
+        payload = json.dumps({'type': event_type, 'device': device_id, 'data': data, 'ts': time.time()})
+        try:
+            self.sock.sendto(payload.encode('utf-8'), self.address)
+            return True
+        except OSError as e:
+            logger.debug(f"Could not publish telemetry: {e}")
+            return False
+
+    def close(self):
+        self.sock.close()
+
+
+def telemetry_room(device_id):
+    return f"{TELEMETRY_ROOM}:{device_id}"
+
+
+class DeviceState:
+    """Latest controls/sensors/status of one vehicle"""
+
+    def __init__(self):
+        self.controls = None
+        self.sensors = {}
+        self.status = {}
+
+
+class TelemetryHub:
+    """
+    Keeps the latest controls/sensors/status snapshot of each vehicle and
+    pushes small delta events to the Socket.IO clients subscribed to it.
+    Clients join with the 'subscribe_telemetry' event ({'device': id}) and
+    get that vehicle's full snapshot as its ack.
+    """
+
+    def __init__(self, socketio, load_controls=None, on_controls_changed=None, on_sensors=None):
+        self.socketio = socketio
+        self.load_controls = load_controls
+        self.on_controls_changed = on_controls_changed
+        self.on_sensors = on_sensors  # called with (readings, ts, device_id) for every sensor line
+        self.lock = threading.Lock()
+        self.devices = {}
+        self.sock = None
+
+    def _state(self, device_id):
+        state = self.devices.get(device_id)
+        if state is None:
+            state = self.devices[device_id] = DeviceState()
+        return state
+
+    def snapshot(self, device_id=DEFAULT_DEVICE_ID):
+        with self.lock:
+            controls = self._state(device_id).controls
+        if controls is None and self.load_controls:
+            rows = self.load_controls(device_id)
+            if rows is not None:
+                with self.lock:
+                    state = self._state(device_id)
+                    # Don't clobber values pushed while we were loading
+                    loaded = {row['control_name']: row['control_value'] for row in rows}
+                    loaded.update(state.controls or {})
+                    state.controls = loaded
+        with self.lock:
+            state = self._state(device_id)
+            return {
+                'device': device_id,
+                'controls': dict(state.controls or {}),
+                'sensors': dict(state.sensors),
+                'status': dict(state.status)
+            }
+
+    def _broadcast(self, device_id, event):
+        event['device'] = device_id
+        self.socketio.emit('telemetry', event, to=telemetry_room(device_id))
+
+    def update_controls(self, changes, device_id=DEFAULT_DEVICE_ID):
+        """Record control values written through the API and push them"""
+        with self.lock:
+            state = self._state(device_id)
+            if state.controls is not None:
+                state.controls.update(changes)
+        self._broadcast(device_id, {'type': 'controls', 'controls': changes})
+
+    def handle_message(self, message):
+        """Apply one message from the bridge and push the resulting delta"""
+        event_type = message.get('type')
+        data = message.get('data') or {}
+        device_id = parse_device_id(message.get('device'))
+        event = {'type': event_type, 'data': data, 'ts': message.get('ts')}
+
+        with self.lock:
+            state = self._state(device_id)
+            if event_type == 'sensors':
+                state.sensors.update(data)
+            elif event_type == 'status':
+                state.status.update(data)
+                # The Arduino reports drive changes (e.g. an obstacle stop) itself
+                if 'DRIVE' in data:
+                    if state.controls is not None:
+                        state.controls['drive_motor'] = data['DRIVE']
+                    event['controls'] = {'drive_motor': data['DRIVE']}
+            else:
+                return
+
+        if event_type == 'sensors' and self.on_sensors:
+            self.on_sensors(data, message.get('ts'), device_id)
+        if 'controls' in event and self.on_controls_changed:
+            self.on_controls_changed(device_id)
+        self._broadcast(device_id, event)
+
+    def listen(self, host=TELEMETRY_CHANNEL_HOST, port=TELEMETRY_CHANNEL_PORT):
+        """Receive bridge telemetry forever; run as a Socket.IO background task"""
+        try:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.bind((host, port))
+        except OSError as e:
+            logger.error(f"Telemetry channel unavailable: {e}")
+            return
+
+        logger.info(f"Listening for bridge telemetry on {host}:{port}")
+        while True:
+            try:
+                payload = self.sock.recv(MAX_DATAGRAM)
+            except OSError as e:
+                logger.error(f"Telemetry receive error: {e}")
+                return
+            try:
+                self.handle_message(json.loads(payload.decode('utf-8')))
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                # e.g. valid JSON that isn't an object; one bad datagram mustn't end live telemetry
+                logger.warning(f"Ignoring malformed telemetry ({e}): {payload!r}")
+
+
+def init_telemetry(socketio, load_controls=None, on_controls_changed=None, on_sensors=None):
+    hub = TelemetryHub(socketio, load_controls, on_controls_changed, on_sensors)
+
+    @socketio.on('subscribe_telemetry')
+    def handle_subscribe_telemetry(data=None):
+        device_id = parse_device_id((data or {}).get('device'))
+        join_room(telemetry_room(device_id))
+        return hub.snapshot(device_id)
+
+    @socketio.on('unsubscribe_telemetry')
+    def handle_unsubscribe_telemetry(data=None):
+        leave_room(telemetry_room(parse_device_id((data or {}).get('device'))))
+        return {'success': True}
+
+    socketio.start_background_task(hub.listen)
+    return hub
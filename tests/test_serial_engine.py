@@ -0,0 +1,48 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from protocol import (ACK_OK, FRAME_ACK, FRAME_COMMAND, MAX_PAYLOAD, NEGOTIATE_ACCEPT, NEGOTIATE_COMMAND,
+                      FrameDecoder, encode_frame)
+from serial_engine import SerialEngine
+
+
+async def fake_binary_arduino(commands):
+    """A socket:// peer that accepts the binary protocol and acks every command frame"""
+    async def handle(reader, writer):
+        if (await reader.readline()).strip() != NEGOTIATE_COMMAND.encode():
+            writer.close()
+            return
+        writer.write((NEGOTIATE_ACCEPT + "\r\n").encode())
+        decoder = FrameDecoder()
+        while data := await reader.read(256):
+            for frame in decoder.feed(data):
+                if frame.type == FRAME_COMMAND:
+                    commands.put_nowait(frame.payload.decode())
+                    writer.write(encode_frame(FRAME_ACK, frame.seq, bytes([ACK_OK])))
+        writer.close()
+
+    return await asyncio.start_server(handle, '127.0.0.1', 0)
+
+
+def test_writer_keeps_sending_after_oversized_command():
+    async def run():
+        commands = asyncio.Queue()
+        server = await fake_binary_arduino(commands)
+        port = server.sockets[0].getsockname()[1]
+        engine = SerialEngine(f"socket://127.0.0.1:{port}", 115200, lambda line: None,
+                              settle_delay=0, protocol='binary', ack_timeout=1.0)
+        try:
+            assert await engine.start()
+            await asyncio.wait_for(engine.negotiated.wait(), 2.0)
+            engine.submit("LCD:" + "x" * MAX_PAYLOAD)
+            engine.submit("DRIVE:forward")
+            assert await asyncio.wait_for(commands.get(), 2.0) == "DRIVE:forward"
+            assert engine.outgoing.qsize() == 0
+        finally:
+            await engine.stop()
+            server.close()
+
+    asyncio.run(run())
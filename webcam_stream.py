@@ -1,37 +1,236 @@
-import cv2
+import importlib
+import numpy as np
 import base64
 import threading
 import time
 import logging
+import os
+from flask import Response, jsonify, request
 from flask_socketio import SocketIO
+from metrics import Counter, Gauge, Histogram
+from logging_setup import configure_logging
+from server_mode import join, offload
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("webcam_stream.log"),
-        logging.StreamHandler()
-    ]
-)
+# Configure logging: queued, rotated and rate-limited so callers never wait on disk
+configure_logging("webcam_stream.log")
 logger = logging.getLogger("WebcamStream")
 
+# How frames reach the browser: 'mjpeg' (raw JPEG over multipart HTTP),
+# 'socketio' (base64 over Socket.IO, the original path) or 'both'
+WEBCAM_TRANSPORT = os.getenv('WEBCAM_TRANSPORT', 'mjpeg')
+MJPEG_BOUNDARY = b'frame'
+
+# Per-client delivery limits
+MIN_CLIENT_FPS = 1
+MIN_CLIENT_QUALITY = 10
+FRAME_ACK_TIMEOUT = 2.0  # Seconds an unacknowledged frame may block a client
+
+# Capture -> encode -> publish pipeline
+FRAME_POOL_SIZE = 8  # Preallocated frame buffers shared by all stages
+FLIP_CODES = {1: 1, 2: 0, 3: -1}  # flip_method -> cv2.flip code (horizontal, vertical, both)
+
+WEBCAM_STAGE_SECONDS = Histogram('webcam_stage_seconds',
+                                 'Per-frame time in each pipeline stage (latency = capture to publish)',
+                                 ['stage'])
+WEBCAM_FPS = Gauge('webcam_fps', 'Frames published per second since the stream started')
+WEBCAM_DROPPED = Counter('webcam_frames_dropped_total', 'Frames skipped by the pipeline', ['reason'])
+WEBCAM_VIEWERS = Gauge('webcam_viewers', 'Connected stream viewers', ['transport'])
+
+# OpenCV is the slowest import of the app, so it is loaded when the camera is
+# first started rather than with this module
+cv2 = None
+_opencv_import_seconds = None
+
+
+def load_opencv():
+    """Import cv2 on first use (on a real thread, so the async servers keep serving meanwhile)"""
+    global cv2, _opencv_import_seconds
+    if cv2 is None:
+        started = time.perf_counter()
+        module = offload(importlib.import_module, 'cv2')
+        _opencv_import_seconds = round(time.perf_counter() - started, 3)
+        cv2 = module
+        logger.info(f"OpenCV imported in {_opencv_import_seconds * 1000:.0f} ms")
+    return cv2
+
+
+def opencv_import_seconds():
+    """How long the deferred cv2 import took, or None if nothing has needed it yet"""
+    return _opencv_import_seconds
+
+
+class FrameBufferPool:
+    """
+    Fixed set of preallocated frame buffers handed out by index. Buffers are
+    reference-counted so a frame still being read (e.g. re-encoded for another
+    viewer) is not recycled by the capture stage.
+    """
+
+    def __init__(self, count, shape, dtype=np.uint8):
+        self.shape = shape
+        self.buffers = [np.empty(shape, dtype) for _ in range(count)]
+        self.refs = [0] * count
+        self.free = list(range(count))
+        self.lock = threading.Lock()
+        self.exhausted = 0
+
+    def acquire(self):
+        """Return a free buffer index with one reference, or None if all are in use"""
+        with self.lock:
+            if not self.free:
+                self.exhausted += 1
+                return None
+            index = self.free.pop()
+            self.refs[index] = 1
+            return index
+
+    def retain(self, index):
+        with self.lock:
+            self.refs[index] += 1
+
+    def release(self, index):
+        with self.lock:
+            self.refs[index] -= 1
+            if self.refs[index] == 0:
+                self.free.append(index)
+
+
+class LatestSlot:
+    """Single-slot hand-off between stages; a new item replaces an unconsumed one"""
+
+    def __init__(self, on_drop=None):
+        self.cond = threading.Condition()
+        self.item = None
+        self.on_drop = on_drop
+        self.dropped = 0
+
+    def put(self, item):
+        with self.cond:
+            old, self.item = self.item, item
+            if old is not None:
+                self.dropped += 1
+            self.cond.notify()
+        if old is not None and self.on_drop:
+            self.on_drop(old)
+
+    def get(self, timeout):
+        with self.cond:
+            if self.item is None:
+                self.cond.wait(timeout)
+            item, self.item = self.item, None
+            return item
+
+    def clear(self):
+        with self.cond:
+            old, self.item = self.item, None
+        if old is not None and self.on_drop:
+            self.on_drop(old)
+
+
+class StageTimer:
+    """Per-stage timing: call count, mean/max/last duration and achieved rate"""
+
+    def __init__(self, histogram=None):
+        self.histogram = histogram
+        self.lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+        self.started = time.time()
+
+    def record(self, duration):
+        with self.lock:
+            self.count += 1
+            self.total += duration
+            self.last = duration
+            if duration > self.max:
+                self.max = duration
+        if self.histogram is not None:
+            self.histogram.observe(duration)
+
+    def stats(self):
+        with self.lock:
+            elapsed = time.time() - self.started
+            return {
+                'count': self.count,
+                'mean_ms': round(self.total / self.count * 1000, 3) if self.count else 0.0,
+                'max_ms': round(self.max * 1000, 3),
+                'last_ms': round(self.last * 1000, 3),
+                'rate': round(self.count / elapsed, 2) if elapsed > 0 else 0.0
+            }
+
+
+class StreamSubscriber:
+    """Delivery state for one Socket.IO viewer: its caps and the frame in flight"""
+
+    def __init__(self, sid, fps, quality):
+        self.sid = sid
+        self.fps = fps
+        self.quality = quality
+        self.min_interval = 1.0 / fps
+        self.last_sent = 0.0
+        self.awaiting_since = None  # Set while a frame is unacknowledged
+        self.sent = 0
+        self.dropped = 0
+
+    def ready(self, now):
+        """True if the client has consumed its last frame and its fps cap allows another"""
+        if self.awaiting_since is not None and now - self.awaiting_since < FRAME_ACK_TIMEOUT:
+            return False
+        return now - self.last_sent >= self.min_interval
+
+    def acked(self, *args):
+        self.awaiting_since = None
+
+
 class WebcamStreamer:
-    def __init__(self, socketio, camera_id=0, fps=20, quality=70, flip_method=0):
+    def __init__(self, socketio, camera_id=0, fps=20, quality=70, flip_method=0,
+                 transport=WEBCAM_TRANSPORT, camera_factory=None):
         
         self.socketio = socketio
         self.camera_id = camera_id
+        # Opens the capture device; anything with the VideoCapture read/grab/set API works
+        # (default: cv2.VideoCapture, resolved once OpenCV is loaded)
+        self.camera_factory = camera_factory
         self.fps = fps
         self.quality = quality
         self.flip_method = flip_method
         self.running = False
         self.camera = None
-        self.thread = None
+        self.threads = []
+        self.transport = transport
+        
+        # Pipeline state: buffer pool and single-slot hand-offs between stages
+        self.pool = None
+        self.encode_slot = LatestSlot(on_drop=self._drop_captured)
+        self.publish_slot = LatestSlot(on_drop=self._drop_encoded)
+        self.timers = {}
+        
+        # Latest frame (a pool index), plus its JPEG at each quality level viewers asked for
+        self.frame_lock = threading.Condition()
+        self.latest_index = None
+        self.frame_seq = 0
+        self.encoded = {}
+        self.encoded_b64 = {}
+        
+        # Viewers: Socket.IO subscribers by sid, and open MJPEG responses
+        self.subscribers = {}
+        self.subscriber_lock = threading.Lock()
+        self.mjpeg_viewers = 0
         
         # Frame dimensions
         self.width = 640
         self.height = 480
         
+        # Metrics are read from the pipeline state at scrape time
+        WEBCAM_FPS.set_function(lambda: self.timers['publish'].stats()['rate'] if self.running else 0.0)
+        WEBCAM_DROPPED.labels('before_encode').set_function(lambda: self.encode_slot.dropped)
+        WEBCAM_DROPPED.labels('before_publish').set_function(lambda: self.publish_slot.dropped)
+        WEBCAM_DROPPED.labels('pool_exhausted').set_function(lambda: self.pool.exhausted if self.pool else 0)
+        WEBCAM_VIEWERS.labels('socketio').set_function(lambda: len(self.subscribers))
+        WEBCAM_VIEWERS.labels('mjpeg').set_function(lambda: self.mjpeg_viewers)
+        
         logger.info(f"webcam initialised (camera_id={camera_id}, fps={fps})")
 
     def start(self):
@@ -41,7 +240,9 @@ class WebcamStreamer:
             return
         
         try:
-            self.camera = cv2.VideoCapture(self.camera_id)
+            load_opencv()
+            # Opening a camera can block for seconds; keep it off the event loop
+            self.camera = offload(self.camera_factory or cv2.VideoCapture, self.camera_id)
             self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
             self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
             
@@ -49,10 +250,22 @@ class WebcamStreamer:
                 logger.error(f"Cam cannot open, ID {self.camera_id}")
                 return False
                 
+            # Size the buffer pool from the first frame the camera actually delivers
+            success, frame = offload(self.camera.read)
+            if not success:
+                logger.error(f"Cam opened but returned no frame, ID {self.camera_id}")
+                self.camera.release()
+                self.camera = None
+                return False
+            if self.pool is None or self.pool.shape != frame.shape:
+                self.pool = FrameBufferPool(FRAME_POOL_SIZE, frame.shape, frame.dtype)
+            
+            self.timers = {stage: StageTimer(WEBCAM_STAGE_SECONDS.labels(stage))
+                           for stage in ('capture', 'encode', 'publish', 'latency')}
             self.running = True
-            self.thread = threading.Thread(target=self._stream_thread)
-            self.thread.daemon = True
-            self.thread.start()
+            # Green threads in the async server modes; the OpenCV calls inside are offloaded
+            for target in (self._capture_thread, self._encode_thread, self._publish_thread):
+                self.threads.append(self._spawn(target))
             logger.info("Webcam started steamin")
             return True
             
@@ -60,11 +273,29 @@ class WebcamStreamer:
             logger.error(f"Error starting cam: {e}")
             return False
     
+    def _spawn(self, target):
+        if self.socketio is None:
+            # No Socket.IO server (MJPEG only, e.g. the benchmark): plain threads
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            return thread
+        return self.socketio.start_background_task(target)
+    
     def stop(self):
         self.running = False
-        if self.thread:
-            self.thread.join(timeout=1.0)
-            self.thread = None
+        for thread in self.threads:
+            join(thread, timeout=1.0)
+        self.threads = []
+        self.encode_slot.clear()
+        self.publish_slot.clear()
+        
+        # Wake any MJPEG viewers so their responses can finish, and return the
+        # last published frame to the pool
+        with self.frame_lock:
+            old_index, self.latest_index = self.latest_index, None
+            self.frame_lock.notify_all()
+        if old_index is not None:
+            self.pool.release(old_index)
         
         if self.camera:
             self.camera.release()
@@ -72,46 +303,247 @@ class WebcamStreamer:
         
         logger.info("Webcam streaming stopped")
     
-    def _stream_thread(self):
+    def negotiate(self, data):
+        """Clamp a client's requested fps/quality caps to what the camera produces"""
+        data = data or {}
+        try:
+            fps = min(max(float(data.get('fps', self.fps)), MIN_CLIENT_FPS), self.fps)
+            quality = min(max(int(data.get('quality', self.quality)), MIN_CLIENT_QUALITY), self.quality)
+        except (TypeError, ValueError):
+            fps, quality = self.fps, self.quality
+        return fps, quality
+    
+    def subscribe(self, sid, data=None):
+        """Register a Socket.IO viewer and return its negotiated caps"""
+        fps, quality = self.negotiate(data)
+        with self.subscriber_lock:
+            self.subscribers[sid] = StreamSubscriber(sid, fps, quality)
+        return {'fps': fps, 'quality': quality}
+    
+    def unsubscribe(self, sid):
+        with self.subscriber_lock:
+            self.subscribers.pop(sid, None)
+    
+    def has_viewers(self):
+        with self.subscriber_lock:
+            return bool(self.subscribers) or self.mjpeg_viewers > 0
+    
+    def publish_frame(self, index, jpeg):
+        """Replace the shared latest frame (and its default-quality JPEG) and wake viewers"""
+        with self.frame_lock:
+            old_index, self.latest_index = self.latest_index, index
+            self.frame_seq += 1
+            self.encoded = {self.quality: jpeg}
+            self.encoded_b64 = {}
+            self.frame_lock.notify_all()
+        if old_index is not None:
+            self.pool.release(old_index)
+    
+    def jpeg_for(self, seq, quality):
+        """JPEG of frame `seq` at `quality`, encoded at most once per frame and level"""
+        with self.frame_lock:
+            if seq != self.frame_seq:
+                return None
+            jpeg = self.encoded.get(quality)
+            index = self.latest_index
+            if jpeg is None:
+                # Keep the buffer alive while we encode outside the lock
+                self.pool.retain(index)
+        if jpeg is not None:
+            return jpeg
+        
+        try:
+            ret, buffer = offload(cv2.imencode, '.jpg', self.pool.buffers[index], [cv2.IMWRITE_JPEG_QUALITY, quality])
+        finally:
+            self.pool.release(index)
+        if not ret:
+            return None
+        jpeg = buffer.tobytes()
+        with self.frame_lock:
+            if seq == self.frame_seq:
+                self.encoded[quality] = jpeg
+        return jpeg
+    
+    def b64_for(self, seq, quality):
+        with self.frame_lock:
+            if seq == self.frame_seq and quality in self.encoded_b64:
+                return self.encoded_b64[quality]
+        jpeg = self.jpeg_for(seq, quality)
+        if jpeg is None:
+            return None
+        jpg_as_text = base64.b64encode(jpeg).decode('utf-8')
+        with self.frame_lock:
+            if seq == self.frame_seq:
+                self.encoded_b64[quality] = jpg_as_text
+        return jpg_as_text
+    
+    def wait_for_frame(self, last_seq, timeout=1.0):
+        """Return the seq of the first frame newer than last_seq, or last_seq on timeout"""
+        with self.frame_lock:
+            # Also wait while no frame exists yet; returning at once would spin the caller
+            if (self.frame_seq == last_seq or self.latest_index is None) and self.running:
+                self.frame_lock.wait(timeout)
+            if self.latest_index is None:
+                return last_seq
+            return self.frame_seq
+    
+    def mjpeg_frames(self, fps=None, quality=None):
+        """Yield multipart MJPEG parts, always skipping to the newest frame"""
+        fps, quality = self.negotiate({'fps': fps or self.fps, 'quality': quality or self.quality})
+        min_interval = 1.0 / fps
+        last_seq = -1
+        with self.subscriber_lock:
+            self.mjpeg_viewers += 1
+        try:
+            while self.running:
+                seq = self.wait_for_frame(last_seq)
+                if seq == last_seq:
+                    continue
+                jpeg = self.jpeg_for(seq, quality)
+                if jpeg is None:
+                    continue
+                last_seq = seq
+                sent_at = time.time()
+                yield (b'--' + MJPEG_BOUNDARY + b'\r\n'
+                       b'Content-Type: image/jpeg\r\n'
+                       b'Content-Length: ' + str(len(jpeg)).encode() + b'\r\n\r\n')
+                yield jpeg
+                yield b'\r\n'
+                # Honour the viewer's fps cap; frames produced meanwhile are skipped
+                time.sleep(max(0, min_interval - (time.time() - sent_at)))
+        finally:
+            with self.subscriber_lock:
+                self.mjpeg_viewers -= 1
+    
+    def _deliver_socketio(self, seq):
+        """Send the newest frame to every subscriber that has consumed its last one"""
+        now = time.time()
+        with self.subscriber_lock:
+            subscribers = list(self.subscribers.values())
+        
+        for subscriber in subscribers:
+            if not subscriber.ready(now):
+                # Drop rather than queue: the client gets the newest frame once it catches up
+                subscriber.dropped += 1
+                continue
+            jpg_as_text = self.b64_for(seq, subscriber.quality)
+            if jpg_as_text is None:
+                return
+            subscriber.awaiting_since = now
+            subscriber.last_sent = now
+            subscriber.sent += 1
+            self.socketio.emit('webcam_frame', {'image': jpg_as_text},
+                               to=subscriber.sid, callback=subscriber.acked)
+    
+    def stats(self):
+        """Per-stage timings, achieved fps, drops and viewer counts"""
+        stats = {stage: timer.stats() for stage, timer in self.timers.items()}
+        stats['fps'] = stats.get('publish', {}).get('rate', 0.0)
+        stats['dropped'] = {
+            'before_encode': self.encode_slot.dropped,
+            'before_publish': self.publish_slot.dropped,
+            'pool_exhausted': self.pool.exhausted if self.pool else 0
+        }
+        with self.subscriber_lock:
+            stats['subscribers'] = {
+                sub.sid: {'fps': sub.fps, 'quality': sub.quality, 'sent': sub.sent, 'dropped': sub.dropped}
+                for sub in self.subscribers.values()
+            }
+            stats['mjpeg_viewers'] = self.mjpeg_viewers
+        return stats
+    
+    def _drop_captured(self, item):
+        self.pool.release(item[0])
+    
+    def _drop_encoded(self, item):
+        self.pool.release(item[0])
+    
+    def _capture_thread(self):
+        """Read frames into pooled buffers and hand the newest to the encoder"""
         frame_interval = 1.0 / self.fps
-        encode_params = [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        flip_code = FLIP_CODES.get(self.flip_method)
+        # Flipping can't happen in place, so the raw frame lands in a scratch buffer
+        scratch = np.empty(self.pool.shape, self.pool.buffers[0].dtype) if flip_code is not None else None
         
         while self.running:
             start_time = time.time()
             
-            # Capture frame
-            success, frame = self.camera.read()
+            index = self.pool.acquire()
+            if index is None:
+                # Every buffer is in use downstream; drop this frame
+                offload(self.camera.grab)
+                continue
+            buffer = self.pool.buffers[index]
+            
+            # Capture frame straight into the pooled buffer (or the flip scratch)
+            target = scratch if flip_code is not None else buffer
+            success, frame = offload(self.camera.read, target)
             if not success:
+                self.pool.release(index)
                 logger.warning("fail capture ")
                 time.sleep(0.1)
                 continue
+            if frame is not target:
+                # The driver handed back a new array (e.g. resolution changed)
+                if frame.shape != target.shape:
+                    self.pool.release(index)
+                    logger.warning(f"Frame shape changed to {frame.shape}, dropping frame")
+                    continue
+                np.copyto(target, frame)
             
             # Apply flip if needed
-            if self.flip_method == 1:
-                frame = cv2.flip(frame, 1)  # Horizontal
-            elif self.flip_method == 2:
-                frame = cv2.flip(frame, 0)  # Vertical
-            elif self.flip_method == 3:
-                frame = cv2.flip(frame, -1)  # Both
+            if flip_code is not None:
+                offload(cv2.flip, scratch, flip_code, buffer)
             
-            # Encode the frame as JPEG
-            ret, buffer = cv2.imencode('.jpg', frame, encode_params)
-            if not ret:
-                continue
-                
-            # Convert to base64 string
-            jpg_as_text = base64.b64encode(buffer).decode('utf-8')
-            
-            # Emit the frame via socketio
-            self.socketio.emit('webcam_frame', {'image': jpg_as_text})
+            self.timers['capture'].record(time.time() - start_time)
+            self.encode_slot.put((index, start_time))
             
             # Calculate sleep time to maintain FPS
             elapsed = time.time() - start_time
             sleep_time = max(0, frame_interval - elapsed)
             time.sleep(sleep_time)
+    
+    def _encode_thread(self):
+        """JPEG-encode the newest captured frame at the default quality"""
+        encode_params = [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        
+        while self.running:
+            item = self.encode_slot.get(timeout=0.5)
+            if item is None:
+                continue
+            index, captured_at = item
+            
+            start_time = time.time()
+            # Encode the frame as JPEG
+            ret, buffer = offload(cv2.imencode, '.jpg', self.pool.buffers[index], encode_params)
+            if not ret:
+                self.pool.release(index)
+                continue
+            self.timers['encode'].record(time.time() - start_time)
+            self.publish_slot.put((index, buffer.tobytes(), captured_at))
+    
+    def _publish_thread(self):
+        """Expose the newest encoded frame to MJPEG viewers and Socket.IO subscribers"""
+        while self.running:
+            item = self.publish_slot.get(timeout=0.5)
+            if item is None:
+                continue
+            index, jpeg, captured_at = item
+            
+            start_time = time.time()
+            # Publish the frame; MJPEG viewers pick it up from the shared buffer
+            self.publish_frame(index, jpeg)
+            
+            # Emit the frame via socketio to each subscriber that is ready for it
+            if self.transport in ('socketio', 'both'):
+                self._deliver_socketio(self.frame_seq)
+            
+            now = time.time()
+            self.timers['publish'].record(now - start_time)
+            self.timers['latency'].record(now - captured_at)
 
-def init_webcam_stream(app):
-    socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+def init_webcam_stream(app, async_mode='threading'):
+    socketio = SocketIO(app, cors_allowed_origins="*", async_mode=async_mode)
     streamer = WebcamStreamer(socketio)
     
     @socketio.on('connect')
@@ -123,19 +555,49 @@ def init_webcam_stream(app):
     @socketio.on('disconnect')
     def handle_disconnect():
         logger.info("bro disconnected")
+        streamer.unsubscribe(request.sid)
+    
+    def stream_info(success, caps=None):
+        info = {'success': success, 'transport': streamer.transport}
+        if caps:
+            info.update(caps)
+        if streamer.transport in ('mjpeg', 'both'):
+            info['url'] = '/video_feed'
+        return info
     
     @socketio.on('start_stream')
     def handle_start_stream(data=None):
-        if not streamer.running:
-            success = streamer.start()
-            return {'success': success}
-        return {'success': True}
+        # data may carry per-client caps, e.g. {'fps': 10, 'quality': 50}
+        if not streamer.running and not streamer.start():
+            return stream_info(False)
+        caps = streamer.subscribe(request.sid, data)
+        return stream_info(True, caps)
+    
+    @app.route('/video_feed')
+    def video_feed():
+        """MJPEG endpoint serving the shared latest frame without re-encoding"""
+        if streamer.transport not in ('mjpeg', 'both'):
+            return Response("MJPEG transport disabled", status=404)
+        if not streamer.running and not streamer.start():
+            return Response("Webcam unavailable", status=503)
+        return Response(
+            streamer.mjpeg_frames(request.args.get('fps'), request.args.get('quality')),
+            mimetype='multipart/x-mixed-replace; boundary=' + MJPEG_BOUNDARY.decode()
+        )
+    
+    @app.route('/api/webcam_stats')
+    def webcam_stats():
+        """Per-stage pipeline timings and achieved frame rate"""
+        return jsonify(streamer.stats())
     
     @socketio.on('stop_stream')
     def handle_stop_stream(data=None):
-        if streamer.running:
+        if not streamer.running:
+            return {'success': False}
+        # Stop this client's delivery; release the camera once nobody is watching
+        streamer.unsubscribe(request.sid)
+        if not streamer.has_viewers():
             streamer.stop()
-            return {'success': True}
-        return {'success': False}
+        return {'success': True}
         
     return socketio, streamer
\ No newline at end of file